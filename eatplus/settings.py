@@ -57,6 +57,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'eatplusapp.profiling.ProfilingMiddleware',
+    'eatplusapp.metrics.MetricsMiddleware',
+    'eatplusapp.querylog.QueryLogMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -66,6 +69,27 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# Share of requests profiled into a Server-Timing header and the
+# "eatplusapp.profiling" log, e.g. 0.01. 0 turns profiling off.
+PROFILING_SAMPLE_RATE = 0
+
+# Request, SQL and cache metrics per URL pattern, served to staff in
+# the Prometheus format on /admin/metrics/. Every worker writes its
+# metrics to METRICS_DIR every METRICS_FLUSH_INTERVAL seconds; files
+# of workers that exited are dropped, restarting the counters. Wraps
+# every query, so only turn it on where the metrics are scraped.
+METRICS_ENABLED = False
+METRICS_DIR = os.path.join(BASE_DIR, 'var', 'metrics')
+METRICS_FLUSH_INTERVAL = 5
+
+# Time of every query, added up per SQL fingerprint and view, ranked
+# by `manage.py query_report`. Queries slower than QUERYLOG_SLOW_MS
+# are also logged to "eatplusapp.querylog". Off unless turned on for
+# a profiling session.
+QUERYLOG_ENABLED = False
+QUERYLOG_SLOW_MS = 100
+QUERYLOG_DIR = os.path.join(BASE_DIR, 'var', 'querylog')
+
 ROOT_URLCONF = 'eatplus.urls'
 
 TEMPLATES = [
@@ -105,6 +129,54 @@ DATABASES = {
     }
 }
 
+# Cache
+# Menu versions live in the cache, use a backend shared by all workers
+# (e.g. memcached) when running more than one process.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+MENU_CACHE_TIMEOUT = 60 * 60 * 24
+# Restaurant cards of a city, rebuilt when one of its restaurants changes
+LISTING_CACHE_TIMEOUT = 60 * 60 * 24
+
+# Keyset pagination of restaurant orders
+ORDER_PAGE_SIZE = 50
+ORDER_MAX_PAGE_SIZE = 200
+# The changed-since feed lags this far behind, longer than any order
+# transaction, so a change committed late is never skipped
+ORDER_CHANGES_SETTLE_SECONDS = 5
+
+# Completed and cancelled orders move to the archive tables after this
+# many days (manage.py archive_orders)
+ORDER_ARCHIVE_AFTER_DAYS = 30
+
+# Order events pushed to kitchens. LocalPubSub only reaches subscribers
+# of the same process; streams need threaded or async workers.
+ORDER_PUBSUB_BACKEND = 'eatplusapp.pubsub.LocalPubSub'
+ORDER_STREAM_HEARTBEAT = 15
+ORDER_POLL_TIMEOUT = 25
+
+# Restaurant discovery around customers, in km. Radii up to about 19km
+# are answered from the geohash prefix indexes of Address.
+NEARBY_RADIUS_KM = 5
+NEARBY_MAX_RADIUS_KM = 15
+
+# Tax added to order sub totals
+ORDER_TAX_PERCENT = 13
+
+# Web carts stay out of the orders table until checkout.
+# 'eatplusapp.cart.CacheCartStorage' keeps them in the cache instead.
+CART_STORAGE = 'eatplusapp.cart.SessionCartStorage'
+CART_CACHE_TIMEOUT = 60 * 60 * 24 * 7
+
+# Idempotency-Key replays of order placement
+IDEMPOTENCY_CACHE = 'default'
+IDEMPOTENCY_KEY_TTL = 60 * 60 * 24
+
 
 # Password validation
 # https://docs.djangoproject.com/en/1.11/ref/settings/#auth-password-validators
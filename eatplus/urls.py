@@ -8,12 +8,14 @@ from rest_framework_swagger.views import get_swagger_view
 
 from eatplusapp import apis
 from eatplusapp import manager_views
+from eatplusapp import metrics
 from eatplusapp import views
 
 schema_view = get_swagger_view(title='Eatplus API')
 
 urlpatterns = [
     url(r'^restaurants/$', views.restaurants_list, name='restaurants'),
+    url(r'^admin/metrics/$', metrics.metrics_view, name='metrics'),
     url(r'^admin/', admin.site.urls),
     url(r'^accounts/', include('allauth.urls')),
     url(r'^login/', views.MyLoginView.as_view(), name='login'),
@@ -32,8 +34,22 @@ urlpatterns = [
     url(r'^(?P<restaurant_slug>[-\w]+)/delivery-menu/$', views.delivery_menu,
         name='delivery_menu'),
 
+    # cart
+    url(r'^(?P<restaurant_slug>[-\w]+)/items/(?P<item_id>\d+)/options/$',
+        views.item_option, name='item_option'),
+    url(r'^(?P<restaurant_slug>[-\w]+)/cart/add/(?P<item_id>\d+)/'
+        r'(?P<action>add|plus|mines)/$', views.cart_add, name='cart_add'),
+    url(r'^(?P<restaurant_slug>[-\w]+)/cart/lines/(?P<line_id>\d+)/'
+        r'choices/(?P<choice_id>\d+)/$', views.add_choice, name='add_choice'),
+    url(r'^(?P<restaurant_slug>[-\w]+)/cart/remove/(?P<line_id>\d+)/$',
+        views.cart_remove, name='cart_remove'),
+    url(r'^(?P<restaurant_slug>[-\w]+)/checkout/$', views.order_create,
+        name='order_create'),
+
     # manager
     url(r'^manager/menu/$', manager_views.menu, name='manager_menu'),
+    url(r'^manager/orders/$', manager_views.restaurant_order,
+        name='manager_orders'),
 
     # APIs urls
     # Docs
@@ -47,13 +63,19 @@ urlpatterns = [
     # Customers
     url(r'^api/v1/customer/', include([
         url(r'^restaurants/$', apis.customer_get_restaurants),
+        url(r'^restaurants/delivering/$',
+            apis.customer_get_delivering_restaurants),
         url(r'^restaurants/(?P<restaurant_id>\d+)/menus/',
             apis.customer_get_menus),
         url(r'^restaurants/(?P<restaurant_id>\d+)/items/',
             apis.customer_get_items),
+        url(r'^restaurants/(?P<restaurant_id>\d+)/menu-tree/$',
+            apis.customer_get_menu_tree, name='customer_get_menu_tree'),
         url(r'^items/(?P<item_id>\d+)/options/', apis.get_item_options),
         url(r'^items/(?P<item_id>\d+)/choices/', apis.get_item_choices),
         url(r'^orderitems/$', apis.add_item_to_cart, name='add_item_to_cart'),
+        url(r'^orderitems/batch/$', apis.batch_order_items,
+            name='batch_order_items'),
         url(r'^orderitems/(?P<orderitem_id>\d+)/$',
             apis.delete_item_from_cart),
         url(r'^orderitems/(?P<orderitem_id>\d+)/quantity-up/',
@@ -62,6 +84,8 @@ urlpatterns = [
             apis.orderitem_quantity_down, name='orderitem_quantity_down'),
         url(r'^choices/(?P<choice_id>\d+)/$',
             apis.update_delete_item_choice, name='update_delete_item_choice'),
+        url(r'^orders/history/$', apis.customer_get_order_history,
+            name='customer_get_order_history'),
         url(r'^orders/', apis.customer_add_order, name='customer_add_order'),
     ])),
 
@@ -69,6 +93,16 @@ urlpatterns = [
     url(r'api/v1/restaurant/', include([
         url(r'orders/$', apis.get_restaurant_orders,
             name='get_restaurant_orders'),
+        url(r'orders/changes/$', apis.get_restaurant_order_changes,
+            name='get_restaurant_order_changes'),
+        url(r'orders/history/$', apis.get_restaurant_order_history,
+            name='get_restaurant_order_history'),
+        url(r'orders/stream/$', apis.restaurant_order_stream,
+            name='restaurant_order_stream'),
+        url(r'orders/poll/$', apis.restaurant_order_poll,
+            name='restaurant_order_poll'),
+        url(r'orders/status/$', apis.restaurant_bulk_update_orders,
+            name='restaurant_bulk_update_orders'),
         url(r'orders/(?P<order_id>\d+)/$', apis.restaurant_update_order,
             name='restaurant_update_order')    
     ])),
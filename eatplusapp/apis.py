@@ -1,6 +1,8 @@
 # from datetime import timedelta
+from django.db import connection
 from django.utils import timezone
-from django.http import JsonResponse
+from django.http import JsonResponse, StreamingHttpResponse
+from django.shortcuts import get_object_or_404
 from django.views.decorators.csrf import csrf_exempt
 from rest_framework.authentication import TokenAuthentication
 from rest_framework.permissions import IsAuthenticated
@@ -15,27 +17,64 @@ from rest_framework.decorators import (
 )
 from rest_framework_jwt.authentication import JSONWebTokenAuthentication
 
+from eatplusapp.archive import order_history
+from eatplusapp.cart import (
+    CartOpError,
+    apply_cart_ops,
+    change_quantity,
+    customer_order_items,
+    find_order_item_owner
+)
+from eatplusapp.delivery import (
+    restaurants_delivering_to_address,
+    restaurants_delivering_to_point
+)
+from eatplusapp.idempotency import idempotent
+from eatplusapp.listings import (
+    absolute_logos,
+    get_city_cards,
+    listed_city_slugs
+)
+from eatplusapp.menus import menu_response
+from eatplusapp.nearby import (
+    nearest_restaurants,
+    parse_point,
+    parse_radius,
+    rank_restaurants
+)
+from eatplusapp.order_states import advance, bulk_transition
+from eatplusapp.pagination import (
+    InvalidPage,
+    changed_orders,
+    paginate_orders_for_request,
+    parse_page_size
+)
+from eatplusapp.pricing import PricingError, order_total_cents, quote_cart
+from eatplusapp.pubsub import (
+    ORDER_POLL_TIMEOUT,
+    get_backend,
+    restaurant_channel,
+    stream_events
+)
 from eatplusapp.models import (
+    Address,
     Customer,
-    MenuSection,
     Item,
     Option,
     Choice,
     Restaurant,
-    Order,
-    OrderItem
+    Order
 )
 from eatplusapp.serializers import (
     CustomerPlaceOrderSerializer,
     PlaceOrderItemSerializer,
-    MenuSectionSerializer,
     ItemSerializer,
     OptionSerializer,
     ChoiceSerializer,
     RestarauntListSerializer,
     RestaurantSerializer,
     OrderSerializer,
-    AddOrdeItemSerializer,
+    CartItemSerializer,
     OrderListSerializer,
     UpdateOrderStatusSerializer
 )
@@ -48,7 +87,96 @@ def customer_get_restaurants(request):
     """
     List restaurants
 
-    Return all availabilities restaurants
+    Return the available restaurants within `radius` km of a point,
+    nearest first. Without lat/lng, the point is the customer's address;
+    when it has no coordinates the restaurants of its city are returned.
+
+    Query params: {\n
+        "lat": float,
+        "lng": float,
+        "radius": float, km, 5 by default
+    }
+
+    Response {\n
+        "restaurants": [
+            {
+            "id": int,
+            "name": string,
+            "phone": string,
+            "address": int,
+            "restaurant_slug": string,
+            "logo": url,
+            "minimum_delivery_order": int,
+            "delivery_fee": int,
+            "pickup_payment_methods": [int, ...],
+            "delivery_payment_methods": [int, ...],
+            "distance": float, km, only when searching around a point
+            },
+            ...
+        ]
+    }
+    """
+    try:
+        point = parse_point(request.query_params)
+        radius = parse_radius(request.query_params.get("radius"))
+    except ValueError as error:
+        return Response(
+            {"detail": str(error)}, status=status.HTTP_400_BAD_REQUEST
+        )
+
+    city_slugs = None
+    if point is None:
+        address = Address.objects.filter(
+            address_customer__user_id=request.user.pk
+        ).values_list("latitude", "longitude", "city_slug").first()
+        if address is None:
+            city_slugs = listed_city_slugs()
+        elif address[0] is None or address[1] is None:
+            city_slugs = [address[2]]
+        else:
+            point = address[:2]
+
+    if point is None:
+        cards = get_city_cards(city_slugs)
+        restaurants = absolute_logos(
+            [card for slug in sorted(cards) for card in cards[slug]],
+            request
+        )
+        return JsonResponse({"restaurants": restaurants})
+
+    ranked = rank_restaurants(point[0], point[1], radius)
+    cards = get_city_cards(city_slug for (_, city_slug), _ in ranked)
+    cards_by_id = dict(
+        (card["id"], card) for city in cards.values() for card in city
+    )
+
+    restaurants = []
+    for (restaurant_id, _), distance in ranked:
+        # listed since the cards of its city were cached
+        if restaurant_id not in cards_by_id:
+            continue
+        card = dict(cards_by_id[restaurant_id], distance=round(distance, 2))
+        restaurants.append(card)
+
+    return JsonResponse({
+        "restaurants": absolute_logos(restaurants, request)
+    })
+
+
+@api_view(["GET"])
+@authentication_classes((JSONWebTokenAuthentication, ))
+@permission_classes((IsAuthenticated,))
+def customer_get_delivering_restaurants(request):
+    """
+    List restaurants delivering to a point
+
+    Without lat/lng, the customer's address is used: its coordinates
+    when it has some, its postal code otherwise
+
+    Query params: {\n
+        "lat": float,
+        "lng": float
+    }
 
     Response {\n
         "restaurants": [
@@ -63,9 +191,30 @@ def customer_get_restaurants(request):
         ]
     }
     """
+    try:
+        point = parse_point(request.query_params)
+    except ValueError as error:
+        return Response(
+            {"detail": str(error)}, status=status.HTTP_400_BAD_REQUEST
+        )
+
+    if point is not None:
+        restaurant_ids = restaurants_delivering_to_point(*point)
+    else:
+        customer = Customer.objects.select_related("address").filter(
+            user_id=request.user.pk
+        ).first()
+        if customer is None:
+            return Response(
+                {"detail": "lat and lng are required"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        restaurant_ids = restaurants_delivering_to_address(customer.address)
+
     restaurants = RestaurantSerializer(
         Restaurant.objects.filter(
-            verified=True, available=True).order_by("-id"),
+            id__in=restaurant_ids, verified=True, available=True
+        ).order_by("-id"),
         many=True,
         context={"request": request}
     ).data
@@ -81,6 +230,7 @@ def customer_get_items(request, restaurant_id):
     Get restaurant items
 
     Return list of meals for restaurant
+    Answers 304 when If-None-Match holds the current menu ETag
 
     Response {\n
         "meals": [
@@ -95,13 +245,7 @@ def customer_get_items(request, restaurant_id):
         ]
     }
     """
-    items = ItemSerializer(
-        Item.objects.filter(restaurant_id=restaurant_id).order_by("-id"),
-        many=True,
-        context={"request": request}
-    ).data
-
-    return JsonResponse({"meals": items})
+    return menu_response(request, restaurant_id, "meals", "meals")
 
 
 @api_view(["GET"])
@@ -110,14 +254,65 @@ def customer_get_items(request, restaurant_id):
 def customer_get_menus(request, restaurant_id):
     """
     Get restaurant menus
+
+    Answers 304 when If-None-Match holds the current menu ETag
     """
-    menus = MenuSectionSerializer(
-        MenuSection.objects.filter(
-            restaurant_id=restaurant_id).order_by("-id"),
-        many=True
-    ).data
+    return menu_response(request, restaurant_id, "menus", "menus")
 
-    return JsonResponse({"menus": menus})
+
+@api_view(["GET"])
+@authentication_classes((JSONWebTokenAuthentication, ))
+@permission_classes((IsAuthenticated,))
+def customer_get_menu_tree(request, restaurant_id):
+    """
+    Get restaurant menu tree
+
+    Return sections, items, options and choices in one document
+    Answers 304 when If-None-Match holds the current menu ETag
+
+    Response {\n
+        "menu": [
+            {
+                "id": int,
+                "title": string,
+                "order": int,
+                "items": [
+                    {
+                        "id": int,
+                        "name": string,
+                        "short_description": string,
+                        "image": url,
+                        "price": int,
+                        "order": int,
+                        "available": bool,
+                        "delivery": bool,
+                        "takeout": bool,
+                        "options": [
+                            {
+                                "id": int,
+                                "name": string,
+                                "type": int,
+                                "choices": [
+                                    {
+                                        "id": int,
+                                        "name": string,
+                                        "default": bool,
+                                        "extra_charge": decimal
+                                    },
+                                    ...
+                                ]
+                            },
+                            ...
+                        ]
+                    },
+                    ...
+                ]
+            },
+            ...
+        ]
+    }
+    """
+    return menu_response(request, restaurant_id, "tree", "menu")
 
 
 @api_view(["GET"])
@@ -195,16 +390,21 @@ def update_delete_item_choice(request, choice_id):
 @api_view(["POST"])
 @authentication_classes((JSONWebTokenAuthentication, ))
 @permission_classes((IsAuthenticated,))
+@idempotent
 def customer_add_order(request):
     """
     Place order
 
+    Send an Idempotency-Key header to retry safely: a retry with the
+    same key gets the original response back without placing the
+    order again.
+
     Request data: {\n
-        'items': [
+        'order_items': [
             {
-                'id': int,
-                'name': string,
-                'price': int
+                'item_id': int,
+                'quantity': int,
+                'choices': [int, ...]
             },
             ...
         ],
@@ -214,22 +414,46 @@ def customer_add_order(request):
     }
     """
     order_items = PlaceOrderItemSerializer(
-        request.data.get('order_items'), many=True
-    ).data
+        data=request.data.get('order_items'), many=True
+    )
+    if not order_items.is_valid():
+        return Response(
+            {'order_items': order_items.errors},
+            status=status.HTTP_400_BAD_REQUEST
+        )
 
-    order_total = 0
-    for items in order_items:
-        item = Item.objects.get(id=items['item_id'])
-        order_total += item.price * items['quantity']
+    try:
+        restaurant_id = int(request.data.get('restaurant_id'))
+    except (TypeError, ValueError):
+        return Response(
+            {'restaurant_id': ["Invalid restaurant."]},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    try:
+        payment_method_id = int(request.data.get('payment_method_id'))
+    except (TypeError, ValueError):
+        return Response(
+            {'payment_method_id': ["Invalid payment method."]},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    try:
+        quote = quote_cart(restaurant_id, order_items.validated_data)
+    except PricingError as error:
+        return Response(
+            {'order_items': [str(error)]}, status=status.HTTP_400_BAD_REQUEST
+        )
 
     customer_id = Customer.objects.get(user_id=request.user.pk).id
 
     data = {
         'address': request.data.get('address'),
-        'restaurant_id': int(request.data.get('restaurant_id')),
-        'payment_method_id': int(request.data.get('payment_method_id')),
+        'restaurant_id': restaurant_id,
+        'payment_method_id': payment_method_id,
         'customer_id': customer_id,
-        'total': order_total,
+        'sub_total': quote.sub_total_cents,
+        'total': order_total_cents(quote.sub_total_cents),
     }
 
     serializer = CustomerPlaceOrderSerializer(data=data)
@@ -246,18 +470,29 @@ def customer_add_order(request):
 def add_item_to_cart(request):
     """
     Add item to Cart
+
+    Choices are validated against the option schema of the item
+
+    Request data: {\n
+        'order_id': int,
+        'item_id': int,
+        'quantity': int,
+        'choices': [int, ...]
+    }
     """
     customer = Customer.objects.get(user_id=request.user.pk)
 
     try:
         order = Order.objects.get(id=int(request.data.get('order_id')))
-    except Order.DoesNotExist:
+    except (Order.DoesNotExist, TypeError, ValueError):
         return Response(status=status.HTTP_404_NOT_FOUND)
 
     if order.customer != customer:
-        return Response(status.HTTP_403_FORBIDDEN)
+        return Response(status=status.HTTP_403_FORBIDDEN)
 
-    serializer = AddOrdeItemSerializer(request.data)
+    serializer = CartItemSerializer(
+        data=request.data, context={'order': order}
+    )
     if serializer.is_valid():
         serializer.save()
         return Response(serializer.data, status=status.HTTP_201_CREATED)
@@ -272,16 +507,13 @@ def orderitem_quantity_up(request, orderitem_id):
     """
     To increase quantity of items in cart
     """
-    try:
-        item = OrderItem.objects.get(id=orderitem_id)
-    except OrderItem.DoesNotExist:
-        return Response(status=status.HTTP_404_NOT_FOUND)
-
-    if item.order.customer.user != request.user:
+    if not change_quantity(
+            customer_order_items(request.user), orderitem_id, 1):
+        exists, user_id = find_order_item_owner(orderitem_id)
+        if not exists:
+            return Response(status=status.HTTP_404_NOT_FOUND)
         return Response(status=status.HTTP_403_FORBIDDEN)
 
-    item.quantity += 1
-    item.save()
     return Response(status=status.HTTP_204_NO_CONTENT)
 
 
@@ -292,17 +524,14 @@ def orderitem_quantity_down(request, orderitem_id):
     """
     To decrease quantity of items in cart
     """
-    try:
-        item = OrderItem.objects.get(id=orderitem_id)
-    except OrderItem.DoesNotExist:
-        return Response(status=status.HTTP_404_NOT_FOUND)
-
-    if item.order.customer.user != request.user:
-        return Response(status=status.HTTP_403_FORBIDDEN)
-
-    if item.quantity > 0:
-        item.quantity -= 1
-        item.save()
+    if not change_quantity(
+            customer_order_items(request.user), orderitem_id, -1):
+        # nothing changed: missing, someone else's or already at zero
+        exists, user_id = find_order_item_owner(orderitem_id)
+        if not exists:
+            return Response(status=status.HTTP_404_NOT_FOUND)
+        if user_id != request.user.pk:
+            return Response(status=status.HTTP_403_FORBIDDEN)
 
     return Response(status=status.HTTP_204_NO_CONTENT)
 
@@ -314,16 +543,109 @@ def delete_item_from_cart(request, orderitem_id):
     """
     Delete item from cart
     """
+    deleted, _ = customer_order_items(request.user).filter(
+        id=orderitem_id
+    ).delete()
+    if not deleted:
+        exists, user_id = find_order_item_owner(orderitem_id)
+        if not exists:
+            return Response(status=status.HTTP_404_NOT_FOUND)
+        return Response(status=status.HTTP_403_FORBIDDEN)
+
+    return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+@api_view(["POST"])
+@authentication_classes((JSONWebTokenAuthentication, ))
+@permission_classes((IsAuthenticated,))
+def batch_order_items(request):
+    """
+    Apply several cart operations in one transaction
+
+    Either every operation applies or none does.
+
+    Request data: {\n
+        'order_id': int,
+        'ops': [
+            {'op': 'add', 'item_id': int, 'quantity': int, 'choices': [int]},
+            {'op': 'inc', 'id': int, 'by': int},
+            {'op': 'dec', 'id': int, 'by': int},
+            {'op': 'remove', 'id': int},
+            ...
+        ]
+    }
+
+    Response {\n
+        "order_items": [int, ...], id of the line of each operation
+    }
+    """
     try:
-        item = OrderItem.objects.get(id=orderitem_id)
-    except OrderItem.DoesNotExist:
+        order = Order.objects.get(
+            id=int(request.data.get('order_id')),
+            customer__user=request.user
+        )
+    except (Order.DoesNotExist, TypeError, ValueError):
         return Response(status=status.HTTP_404_NOT_FOUND)
 
-    if item.order.customer.user != request.user:
-        return Response(status=status.HTTP_403_FORBIDDEN)
+    ops = request.data.get('ops')
+    if not isinstance(ops, list):
+        return Response(
+            {'ops': ["Expected a list of operations."]},
+            status=status.HTTP_400_BAD_REQUEST
+        )
 
-    item.delete()
-    return Response(status=status.HTTP_204_NO_CONTENT)
+    try:
+        order_items = apply_cart_ops(order, ops)
+    except CartOpError as error:
+        return Response(
+            {'ops': {error.index: error.detail}},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    return Response({'order_items': order_items}, status=status.HTTP_200_OK)
+
+
+@api_view(["GET"])
+@authentication_classes((JSONWebTokenAuthentication, ))
+@permission_classes((IsAuthenticated,))
+def customer_get_order_history(request):
+    """
+    Get customer order history
+
+    Return the customer's orders, archived ones included, newest first,
+    one page at a time
+
+    Query params: {\n
+        "cursor": string, "next" of the previous page,
+        "page_size": int
+    }
+
+    Response {\n
+        "orders": [
+            {
+                "id": int,
+                ...same fields as the restaurant orders list...
+            },
+            ...
+        ],
+        "next": string or null
+    }
+    """
+    customer = Customer.objects.get(user_id=request.user.pk)
+
+    try:
+        orders, next_cursor = order_history(
+            cursor=request.query_params.get("cursor"),
+            page_size=parse_page_size(request.query_params.get("page_size")),
+            customer_id=customer.id
+        )
+    except InvalidPage as error:
+        return Response(
+            {"detail": str(error)}, status=status.HTTP_400_BAD_REQUEST
+        )
+
+    orders = OrderListSerializer(orders, many=True).data
+    return JsonResponse({'orders': orders, 'next': next_cursor})
 
 
 def customer_get_latest_order(request):
@@ -349,7 +671,13 @@ def get_restaurant_orders(request):
     """
     Get restaurant orders
 
-    Return orders list of restaurant
+    Return orders list of restaurant, newest first, one page at a time
+
+    Query params: {\n
+        "cursor": string, "next" of the previous page,
+        "page_size": int,
+        "status": comma separated status ids, e.g. "3,4"
+    }
 
     Response {\n
         "orders": [
@@ -362,8 +690,8 @@ def get_restaurant_orders(request):
                     "phone": string,
                 },
                 "address": string,
-                "total": int,
-                "sub_total": int,
+                "total": int, in cents
+                "sub_total": int, in cents
                 "order_for": string,
                 "status": string,
                 "note": string,
@@ -372,19 +700,225 @@ def get_restaurant_orders(request):
                 "picked_at": date
             },
             ...
-        ]
+        ],
+        "next": string or null
     }
     """
     try:
-        restaurant = Restaurant.objects.get(user=request.user)
+        restaurant = Restaurant.objects.get(manager__user=request.user)
     except Restaurant.DoesNotExist:
         return Response(status=status.HTTP_404_NOT_FOUND)
 
-    orders = OrderListSerializer(
-        Order.objects.filter(restaurant=restaurant).order_by("-id"),
-        many=True
-    ).data
-    return JsonResponse({'orders': orders})
+    try:
+        orders, next_cursor = paginate_orders_for_request(
+            Order.objects.filter(restaurant=restaurant).select_related(
+                "customer__user", "payment_method"
+            ),
+            request.query_params
+        )
+    except InvalidPage as error:
+        return Response(
+            {"detail": str(error)}, status=status.HTTP_400_BAD_REQUEST
+        )
+
+    orders = OrderListSerializer(orders, many=True).data
+    return JsonResponse({'orders': orders, 'next': next_cursor})
+
+
+@api_view(["GET"])
+@authentication_classes((JSONWebTokenAuthentication, ))
+@permission_classes((IsAuthenticated,))
+def get_restaurant_order_changes(request):
+    """
+    Get restaurant order changes
+
+    Return orders created or updated after the watermark, oldest change
+    first. Poll again with the returned watermark; when "has_more" is
+    true more changes are waiting. Changes are listed once they are
+    ORDER_CHANGES_SETTLE_SECONDS old, the stream endpoints push them
+    right away.
+
+    Query params: {\n
+        "since": string, "watermark" of the previous poll,
+        "page_size": int
+    }
+
+    Response {\n
+        "orders": [
+            {
+                "id": int,
+                ...same fields as the orders list...
+            },
+            ...
+        ],
+        "watermark": string,
+        "has_more": bool
+    }
+    """
+    try:
+        restaurant = Restaurant.objects.get(manager__user=request.user)
+    except Restaurant.DoesNotExist:
+        return Response(status=status.HTTP_404_NOT_FOUND)
+
+    try:
+        orders, watermark, has_more = changed_orders(
+            Order.objects.filter(restaurant=restaurant).select_related(
+                "customer__user", "payment_method"
+            ),
+            watermark=request.query_params.get("since"),
+            page_size=parse_page_size(request.query_params.get("page_size"))
+        )
+    except InvalidPage as error:
+        return Response(
+            {"detail": str(error)}, status=status.HTTP_400_BAD_REQUEST
+        )
+
+    orders = OrderListSerializer(orders, many=True).data
+    return JsonResponse({
+        'orders': orders, 'watermark': watermark, 'has_more': has_more
+    })
+
+
+@api_view(["GET"])
+@authentication_classes((JSONWebTokenAuthentication, ))
+@permission_classes((IsAuthenticated,))
+def get_restaurant_order_history(request):
+    """
+    Get restaurant order history
+
+    Return orders of the restaurant, archived ones included, newest
+    first, one page at a time
+
+    Query params: {\n
+        "cursor": string, "next" of the previous page,
+        "page_size": int
+    }
+
+    Response {\n
+        "orders": [
+            {
+                "id": int,
+                ...same fields as the orders list...
+            },
+            ...
+        ],
+        "next": string or null
+    }
+    """
+    try:
+        restaurant = Restaurant.objects.get(manager__user=request.user)
+    except Restaurant.DoesNotExist:
+        return Response(status=status.HTTP_404_NOT_FOUND)
+
+    try:
+        orders, next_cursor = order_history(
+            cursor=request.query_params.get("cursor"),
+            page_size=parse_page_size(request.query_params.get("page_size")),
+            restaurant_id=restaurant.id
+        )
+    except InvalidPage as error:
+        return Response(
+            {"detail": str(error)}, status=status.HTTP_400_BAD_REQUEST
+        )
+
+    orders = OrderListSerializer(orders, many=True).data
+    return JsonResponse({'orders': orders, 'next': next_cursor})
+
+
+@api_view(["GET"])
+@authentication_classes((JSONWebTokenAuthentication, ))
+@permission_classes((IsAuthenticated,))
+def restaurant_order_stream(request):
+    """
+    Stream restaurant order events
+
+    Server-Sent Events stream, one "order" event per new or updated
+    order. Reconnecting clients send Last-Event-ID to resume.
+
+    Event data {\n
+        "event": "created" | "updated",
+        "id": int,
+        "status": int,
+        "updated_at": date
+    }
+    """
+    try:
+        restaurant = Restaurant.objects.get(manager__user=request.user)
+    except Restaurant.DoesNotExist:
+        return Response(status=status.HTTP_404_NOT_FOUND)
+
+    last_id = request.META.get('HTTP_LAST_EVENT_ID')
+    try:
+        last_id = int(last_id) if last_id else None
+    except ValueError:
+        return Response(status=status.HTTP_400_BAD_REQUEST)
+
+    response = StreamingHttpResponse(
+        stream_events(restaurant_channel(restaurant.id), last_id),
+        content_type='text/event-stream'
+    )
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+@api_view(["GET"])
+@authentication_classes((JSONWebTokenAuthentication, ))
+@permission_classes((IsAuthenticated,))
+def restaurant_order_poll(request):
+    """
+    Long-poll restaurant order events
+
+    Wait until orders are created or updated after "last_event_id" or
+    the poll times out, for clients that can't use the stream.
+
+    Query params: {\n
+        "last_event_id": int
+    }
+
+    Response {\n
+        "events": [
+            {
+                "event_id": int,
+                "event": "created" | "updated",
+                "id": int,
+                "status": int,
+                "updated_at": date
+            },
+            ...
+        ],
+        "last_event_id": int
+    }
+    """
+    try:
+        restaurant = Restaurant.objects.get(manager__user=request.user)
+    except Restaurant.DoesNotExist:
+        return Response(status=status.HTTP_404_NOT_FOUND)
+
+    last_id = request.query_params.get('last_event_id')
+    try:
+        last_id = int(last_id) if last_id else None
+    except ValueError:
+        return Response(status=status.HTTP_400_BAD_REQUEST)
+
+    backend = get_backend()
+    last_id = backend.resume_id(last_id)
+
+    # don't hold a database connection while waiting
+    connection.close()
+    events = backend.wait(
+        restaurant_channel(restaurant.id), last_id,
+        timeout=ORDER_POLL_TIMEOUT
+    )
+
+    if events:
+        last_id = events[-1][0]
+    return JsonResponse({
+        'events': [
+            dict(message, event_id=event_id) for event_id, message in events
+        ],
+        'last_event_id': last_id
+    })
 
 
 @api_view(["PUT"])
@@ -409,7 +943,7 @@ def restaurant_update_order(request, order_id):
     }
     """
     try:
-        restaurant = Restaurant.objects.get(user=request.user)
+        restaurant = Restaurant.objects.get(manager__user=request.user)
         order = Order.objects.get(id=order_id, restaurant=restaurant)
     except (Order.DoesNotExist, Restaurant.DoesNotExist):
         return Response(status=status.HTTP_404_NOT_FOUND)
@@ -421,6 +955,50 @@ def restaurant_update_order(request, order_id):
     return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
+@api_view(["POST"])
+@authentication_classes((JSONWebTokenAuthentication, ))
+@permission_classes((IsAuthenticated,))
+def restaurant_bulk_update_orders(request):
+    """
+    Move several orders to a new status
+
+    Orders still in "from" move to "to" in a single query; the others
+    are listed as conflicts.
+
+    Request {\n
+        "order_ids": [int, ...],
+        "from": int,
+        "to": int
+    }
+
+    Response {\n
+        "updated": [int, ...],
+        "conflicts": [int, ...]
+    }
+    """
+    try:
+        restaurant = Restaurant.objects.get(manager__user=request.user)
+    except Restaurant.DoesNotExist:
+        return Response(status=status.HTTP_404_NOT_FOUND)
+
+    try:
+        order_ids = [int(order_id) for order_id in request.data['order_ids']]
+        from_status = int(request.data['from'])
+        to_status = int(request.data['to'])
+        result = bulk_transition(
+            restaurant.id, order_ids, from_status, to_status
+        )
+    except (KeyError, TypeError, ValueError) as error:
+        return Response(
+            {"detail": str(error)}, status=status.HTTP_400_BAD_REQUEST
+        )
+
+    return Response(
+        {"updated": result.updated, "conflicts": result.conflicts},
+        status=status.HTTP_200_OK
+    )
+
+
 def restaurant_get_latest_order(request):
     access_token = AccessToken.objects.get(
         token=request.GET.get("access_token"),
@@ -446,22 +1024,10 @@ def restaurant_order_notification(request, last_request_time):
 
 def restaurant_change_status(request):
     if request.method == "POST":
-        order = Order.objects.get(
-            id=request.POST["id"],
-            restaurant=request.user.restaurant
+        new_status = advance(
+            request.user.manager.restaurant.id, request.POST["id"]
         )
-
-        if order.status == Order.PLACED:
-            order.status = Order.RECEIVED
-            order.save()
-
-        elif order.status == Order.RECEIVED:
-            order.status = Order.READY
-            order.save()
-
-        elif order.status == Order.READY and order.order_for == 1:
-            order.status = Order.COMPLETED
-            order.save()
+        return JsonResponse({"status": new_status})
 
 
 # noinspection PyShadowingBuiltins,PyUnusedLocal
@@ -472,12 +1038,22 @@ class RestaurantList(APIView):
     @staticmethod
     def get(request, format=None):
         """
-        Returns a list of all restaurants in a customer's city
+        Returns the restaurants near a customer, nearest first, or the
+        ones of their city when their address has no coordinates
         """
-        user = request.user
-        customer = Customer.objects.filter(user_id=user.id)
-        city = customer[0].city
-        restaurants = Restaurant.objects.filter(city=city)
+        customer = get_object_or_404(
+            Customer.objects.select_related("address"), user=request.user
+        )
+        address = customer.address
+        if address.latitude is not None and address.longitude is not None:
+            restaurants = nearest_restaurants(
+                address.latitude, address.longitude
+            )
+        else:
+            restaurants = Restaurant.objects.filter(
+                address__city_slug=address.city_slug,
+                verified=True, available=True
+            )
         serializer = RestarauntListSerializer(restaurants, many=True)
 
         return JsonResponse({"data": serializer.data})
@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class EatplusappConfig(AppConfig):
     name = 'eatplusapp'
+
+    def ready(self):
+        from eatplusapp import signals  # noqa: F401
@@ -0,0 +1,144 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Q, QuerySet
+from django.utils import timezone
+
+from eatplusapp.models import (
+    Order,
+    OrderItem,
+    ArchivedOrder,
+    ArchivedOrderItem
+)
+from eatplusapp.pagination import ORDER_PAGE_SIZE, decode_cursor, encode_cursor
+
+ORDER_ARCHIVE_AFTER_DAYS = getattr(settings, "ORDER_ARCHIVE_AFTER_DAYS", 30)
+ARCHIVED_STATUSES = (Order.COMPLETED, Order.CANCELLED)
+
+ORDER_FIELDS = (
+    "id", "customer_id", "restaurant_id", "address", "total", "sub_total",
+    "order_for", "status", "created_at", "updated_at", "picked_at", "note",
+    "payment_method_id"
+)
+
+
+def delete_rows(model, column, values):
+    """
+    DELETE the rows of `model` whose `column` is in `values`, a list or
+    a values_list() queryset of another table, with a single statement:
+    no rows are loaded, no cascades are collected and no signals are
+    sent.
+    """
+    if isinstance(values, QuerySet):
+        subquery, params = values.query.sql_with_params()
+    else:
+        if not values:
+            return
+        subquery = ", ".join(["%s"] * len(values))
+        params = list(values)
+
+    quote = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        cursor.execute("DELETE FROM %s WHERE %s IN (%s)" % (
+            quote(model._meta.db_table), quote(column), subquery
+        ), params)
+
+
+def archive_chunk(cutoff, chunk_size=500):
+    """
+    Move up to `chunk_size` finished orders last changed before `cutoff`,
+    with their lines and choices, to the archive tables in one
+    transaction. Returns the number of moved orders.
+    """
+    with transaction.atomic():
+        orders = list(Order.objects.select_for_update().filter(
+            status__in=ARCHIVED_STATUSES, updated_at__lt=cutoff
+        ).order_by("id").values(*ORDER_FIELDS)[:chunk_size])
+        if not orders:
+            return 0
+
+        order_ids = [order["id"] for order in orders]
+        ArchivedOrder.objects.bulk_create(
+            [ArchivedOrder(**order) for order in orders]
+        )
+
+        ArchivedOrderItem.objects.bulk_create([
+            ArchivedOrderItem(**line)
+            for line in OrderItem.objects.filter(
+                order_id__in=order_ids
+            ).values("id", "order_id", "item_id", "quantity", "sub_total")
+        ])
+
+        ArchivedOrderItem.choices.through.objects.bulk_create([
+            ArchivedOrderItem.choices.through(
+                archivedorderitem_id=order_item_id, choice_id=choice_id
+            )
+            for order_item_id, choice_id in (
+                OrderItem.choices.through.objects.filter(
+                    orderitem__order_id__in=order_ids
+                ).values_list("orderitem_id", "choice_id")
+            )
+        ])
+
+        # the rows moved to the archive, they aren't deleted orders:
+        # plain DELETEs, without the OrderItem signals or cascades
+        delete_rows(
+            OrderItem.choices.through, "orderitem_id",
+            OrderItem.objects.filter(
+                order_id__in=order_ids
+            ).values_list("id", flat=True)
+        )
+        delete_rows(OrderItem, "order_id", order_ids)
+        delete_rows(Order, "id", order_ids)
+
+    return len(orders)
+
+
+def archive_orders(days=ORDER_ARCHIVE_AFTER_DAYS, chunk_size=500):
+    """
+    Archive every finished order older than `days`, chunk by chunk
+    """
+    cutoff = timezone.now() - timedelta(days=days)
+    archived = 0
+    while True:
+        moved = archive_chunk(cutoff, chunk_size)
+        archived += moved
+        if moved < chunk_size:
+            return archived
+
+
+def order_history(cursor=None, page_size=None, **filters):
+    """
+    One page of orders matching `filters` (e.g. restaurant_id=...,
+    customer_id=...) across the hot and archive tiers, newest first,
+    and the cursor of the next page.
+
+    Each tier is read with the same (created_at, id) keyset as
+    `pagination.paginate_orders` and the two pages are merged.
+    """
+    page_size = page_size or ORDER_PAGE_SIZE
+    keyset = Q()
+    if cursor:
+        created_at, order_id = decode_cursor(cursor)
+        keyset = Q(created_at__lt=created_at) | Q(
+            created_at=created_at, id__lt=order_id
+        )
+
+    pages = [
+        list(model.objects.filter(keyset, **filters).select_related(
+            "customer__user", "payment_method"
+        ).order_by("-created_at", "-id")[:page_size + 1])
+        for model in (Order, ArchivedOrder)
+    ]
+    orders = sorted(
+        pages[0] + pages[1],
+        key=lambda order: (order.created_at, order.id),
+        reverse=True
+    )
+
+    next_cursor = None
+    if len(orders) > page_size:
+        orders = orders[:page_size]
+        next_cursor = encode_cursor(orders[-1])
+    return orders, next_cursor
@@ -0,0 +1,322 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F, Subquery
+from django.utils.module_loading import import_string
+
+from eatplusapp.models import Order, OrderItem
+from eatplusapp.order_states import check_out
+from eatplusapp.pricing import (
+    move_order_totals, order_total_cents, quote_cart
+)
+from eatplusapp.serializers import CartItemSerializer
+
+CART_OPS = ("add", "inc", "dec", "remove")
+CART_STORAGE = getattr(
+    settings, "CART_STORAGE", "eatplusapp.cart.SessionCartStorage"
+)
+CART_CACHE_TIMEOUT = getattr(settings, "CART_CACHE_TIMEOUT", 60 * 60 * 24 * 7)
+
+
+class CheckoutError(ValueError):
+    pass
+
+
+class CartOpError(ValueError):
+
+    def __init__(self, index, detail):
+        super().__init__(detail)
+        self.index = index
+        self.detail = detail
+
+
+def customer_order_items(user):
+    """
+    Order items of the customer behind `user`, checked with a join
+    instead of loading the order, customer and user of each line
+    """
+    return OrderItem.objects.filter(order__customer__user=user)
+
+
+def find_order_item_owner(order_item_id):
+    """
+    Return (exists, user_id) of a line, to tell a missing line from
+    someone else's once a scoped update matched nothing
+    """
+    owners = list(OrderItem.objects.filter(id=order_item_id).values_list(
+        "order__customer__user_id", flat=True
+    )[:1])
+    if not owners:
+        return False, None
+    return True, owners[0]
+
+
+def change_quantity(order_items, order_item_id, delta):
+    """
+    Add `delta` to the quantity of a line of `order_items` in an open
+    order. A decrease never takes the quantity below zero.
+
+    The line and order totals move by `delta` times the unit price of
+    the line, in one UPDATE each and without reading anything.
+
+    Returns the number of updated lines, 0 or 1.
+    """
+    queryset = order_items.filter(
+        id=order_item_id, order__status=Order.OPEN
+    )
+    if delta < 0:
+        queryset = queryset.filter(quantity__gte=-delta)
+
+    with transaction.atomic():
+        updated = queryset.update(
+            quantity=F("quantity") + delta,
+            sub_total=F("sub_total") + F("unit_price") * delta
+        )
+        if updated:
+            move_order_totals(
+                Order.objects.filter(order_orderitem=order_item_id),
+                Subquery(OrderItem.objects.filter(
+                    id=order_item_id
+                ).values("unit_price")) * delta
+            )
+    return updated
+
+
+def apply_cart_ops(order, ops):
+    """
+    Apply a list of cart operations to `order` in one transaction:
+
+        {"op": "add", "item_id": int, "quantity": int, "choices": [int]}
+        {"op": "inc", "id": int, "by": int}
+        {"op": "dec", "id": int, "by": int}
+        {"op": "remove", "id": int}
+
+    Either every operation applies or none does; a failing one raises
+    CartOpError with its index.
+    """
+    order_items = OrderItem.objects.filter(order=order)
+    results = []
+
+    with transaction.atomic():
+        for index, op in enumerate(ops):
+            name = op.get("op") if isinstance(op, dict) else None
+            if name not in CART_OPS:
+                raise CartOpError(index, "Unknown operation.")
+
+            if name == "add":
+                serializer = CartItemSerializer(
+                    data=op, context={"order": order}
+                )
+                if not serializer.is_valid():
+                    raise CartOpError(index, serializer.errors)
+                results.append(serializer.save().id)
+                continue
+
+            try:
+                order_item_id = int(op["id"])
+                by = int(op.get("by", 1))
+            except (KeyError, TypeError, ValueError):
+                raise CartOpError(index, "Invalid order item.")
+            if by < 1:
+                raise CartOpError(index, "Invalid quantity.")
+
+            if name == "remove":
+                deleted, _ = order_items.filter(id=order_item_id).delete()
+                updated = 1 if deleted else 0
+            elif name == "inc":
+                updated = change_quantity(order_items, order_item_id, by)
+            else:
+                updated = change_quantity(order_items, order_item_id, -by)
+                if not updated and order_items.filter(
+                        id=order_item_id, order__status=Order.OPEN).exists():
+                    raise CartOpError(index, "Quantity can't go below zero.")
+
+            if not updated:
+                raise CartOpError(index, "Order item not found.")
+            results.append(order_item_id)
+
+    return results
+
+
+# SESSION CARTS
+# Web carts live in the session or the cache until checkout, so
+# browsing menus never writes to the orders table.
+class SessionCartStorage(object):
+    """
+    Keep carts in the session of the visitor
+    """
+
+    def __init__(self, request):
+        self.session = request.session
+
+    def load(self, key):
+        return self.session.get(key)
+
+    def save(self, key, data):
+        self.session[key] = data
+
+    def delete(self, key):
+        self.session.pop(key, None)
+
+
+class CacheCartStorage(object):
+    """
+    Keep carts in the cache, per customer when signed in and per
+    session otherwise. Needs a cache shared by all workers.
+    """
+
+    def __init__(self, request):
+        if request.user.is_authenticated:
+            self.owner = "user-%s" % request.user.pk
+        else:
+            if not request.session.session_key:
+                request.session.save()
+            self.owner = "session-%s" % request.session.session_key
+
+    def _key(self, key):
+        return "%s:%s" % (key, self.owner)
+
+    def load(self, key):
+        return cache.get(self._key(key))
+
+    def save(self, key, data):
+        cache.set(self._key(key), data, CART_CACHE_TIMEOUT)
+
+    def delete(self, key):
+        cache.delete(self._key(key))
+
+
+class Cart(object):
+    """
+    Lines a visitor picked from one restaurant:
+
+        {"id": int, "item_id": int, "quantity": int, "choices": [int]}
+    """
+
+    def __init__(self, storage, restaurant_id):
+        self.storage = storage
+        self.key = "cart:%s" % restaurant_id
+        self.restaurant_id = restaurant_id
+        data = storage.load(self.key) or {}
+        self.lines = data.get("lines", [])
+        self.next_id = data.get("next_id", 1)
+        self.payment_method_id = data.get("payment_method_id")
+
+    def __len__(self):
+        return len(self.lines)
+
+    def save(self):
+        self.storage.save(self.key, {
+            "lines": self.lines,
+            "next_id": self.next_id,
+            "payment_method_id": self.payment_method_id,
+        })
+
+    def clear(self):
+        self.lines = []
+        self.storage.delete(self.key)
+
+    def get_line(self, line_id):
+        for line in self.lines:
+            if line["id"] == int(line_id):
+                return line
+        return None
+
+    def add(self, item_id, quantity=1, choices=()):
+        """
+        Add to the line of the same item and choices, or start one
+        """
+        choices = sorted(int(choice) for choice in choices)
+        for line in self.lines:
+            if line["item_id"] == int(item_id) and line["choices"] == choices:
+                line["quantity"] += quantity
+                return line
+
+        line = {
+            "id": self.next_id,
+            "item_id": int(item_id),
+            "quantity": quantity,
+            "choices": choices,
+        }
+        self.next_id += 1
+        self.lines.append(line)
+        return line
+
+    def change_quantity(self, line_id, delta):
+        """
+        Move the quantity of a line, dropping it when it reaches zero
+        """
+        line = self.get_line(line_id)
+        if line is None:
+            return None
+        line["quantity"] += delta
+        if line["quantity"] <= 0:
+            self.remove(line_id)
+        return line
+
+    def remove(self, line_id):
+        self.lines = [
+            line for line in self.lines if line["id"] != int(line_id)
+        ]
+
+
+def get_cart(request, restaurant_id):
+    storage = import_string(CART_STORAGE)(request)
+    return Cart(storage, restaurant_id)
+
+
+def checkout_cart(cart, customer, order_for, extra_cents=0, quote=None):
+    """
+    Turn a cart into an Order with its lines and choices.
+
+    The cart is priced first, unless a `quote` of it is given, so an
+    unavailable item raises PricingError before anything is written; a
+    cart without a payment method raises CheckoutError. The lines go in
+    with the totals of the quote, in one bulk INSERT, and `extra_cents`,
+    e.g. a delivery fee, is added on top of the order before it goes to
+    the kitchen.
+    """
+    if cart.payment_method_id is None:
+        raise CheckoutError("Choose a payment method.")
+    if quote is None:
+        quote = quote_cart(cart.restaurant_id, cart.lines)
+
+    sub_total = quote.sub_total_cents + extra_cents
+    with transaction.atomic():
+        order = Order.objects.create(
+            customer=customer,
+            restaurant_id=cart.restaurant_id,
+            order_for=order_for,
+            status=Order.OPEN,
+            payment_method_id=cart.payment_method_id,
+            sub_total=sub_total,
+            total=order_total_cents(sub_total)
+        )
+
+        # bulk inserts send no signals, the order has its totals already
+        order_items = OrderItem.objects.bulk_create([
+            OrderItem(
+                order=order, item_id=line.item_id, quantity=line.quantity,
+                unit_price=line.unit_cents, sub_total=line.total_cents
+            )
+            for line in quote.lines
+        ])
+        if order_items and order_items[0].pk is None:
+            # the backend doesn't return the ids of bulk inserted rows
+            for order_item, order_item_id in zip(
+                    order_items,
+                    order.order_orderitem.order_by("id").values_list(
+                        "id", flat=True)):
+                order_item.pk = order_item_id
+
+        OrderItem.choices.through.objects.bulk_create([
+            OrderItem.choices.through(
+                orderitem_id=order_item.pk, choice_id=choice_id
+            )
+            for order_item, line in zip(order_items, quote.lines)
+            for choice_id in line.choice_ids
+        ])
+        check_out(order)
+
+    cart.clear()
+    return order
@@ -0,0 +1,84 @@
+from contextlib import contextmanager
+from functools import partial
+
+from django.db import DEFAULT_DB_ALIAS, connections
+
+
+class HookedCursor(object):
+    """
+    Cursor running execute() and executemany() through the wrappers
+    installed on its connection
+    """
+
+    def __init__(self, cursor, connection):
+        self.cursor = cursor
+        self.connection = connection
+
+    def __getattr__(self, attr):
+        return getattr(self.cursor, attr)
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return self.cursor.__exit__(*exc_info)
+
+    def execute(self, sql, params=None):
+        return self._run(self.cursor.execute, sql, params, False)
+
+    def executemany(self, sql, param_list):
+        return self._run(self.cursor.executemany, sql, param_list, True)
+
+    def _run(self, method, sql, params, many):
+        def execute(sql, params, many, context):
+            return method(sql, params)
+
+        context = {"connection": self.connection, "cursor": self}
+        for wrapper in reversed(self.connection._execute_wrappers):
+            execute = partial(wrapper, execute)
+        return execute(sql, params, many, context)
+
+
+def install_hooks(connection):
+    """
+    Route the cursors of a connection through HookedCursor, once
+    """
+    if hasattr(connection, "_execute_wrappers"):
+        return
+    connection._execute_wrappers = []
+
+    for name in ("cursor", "chunked_cursor"):
+        original = getattr(connection, name, None)
+        if original is None:
+            continue
+
+        def hooked(original=original):
+            cursor = original()
+            if not connection._execute_wrappers:
+                return cursor
+            return HookedCursor(cursor, connection)
+        setattr(connection, name, hooked)
+
+
+@contextmanager
+def execute_wrapper(wrapper, using=DEFAULT_DB_ALIAS):
+    """
+    Run every query of `using` in this thread through
+    wrapper(execute, sql, params, many, context), like
+    connection.execute_wrapper() of newer Django versions
+    """
+    connection = connections[using]
+    if hasattr(type(connection), "execute_wrapper"):
+        with connection.execute_wrapper(wrapper):
+            yield
+        return
+
+    install_hooks(connection)
+    connection._execute_wrappers.append(wrapper)
+    try:
+        yield
+    finally:
+        connection._execute_wrappers.remove(wrapper)
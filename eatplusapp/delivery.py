@@ -0,0 +1,168 @@
+import re
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from eatplusapp.geo import GridIndex, parse_area
+from eatplusapp.models import DeliveryZone, Restaurant
+
+DELIVERY_ZONES_VERSION_KEY = "delivery-zones:version"
+DELIVERY_AREAS_VERSION_KEY = "delivery-areas:version"
+# side of a grid cell in degrees, about 5km of latitude
+DELIVERY_GRID_CELL = getattr(settings, "DELIVERY_GRID_CELL", 0.05)
+
+# forward sortation areas, e.g. "M5V" of "M5V 2T6"
+POSTAL_PREFIX_RE = re.compile(r"(?<![A-Z0-9])[A-Z]\d[A-Z]")
+
+_lock = threading.Lock()
+_prefix_map = {"version": None, "restaurants": {}}
+_area_index = {"version": None, "index": None}
+
+
+def postal_prefix(postal_code):
+    """
+    Return the delivery prefix of a postal code, or None
+    """
+    match = POSTAL_PREFIX_RE.search((postal_code or "").upper())
+    return match.group(0) if match else None
+
+
+def parse_boundaries(boundaries):
+    """
+    Return the set of postal prefixes listed in free-text boundaries,
+    e.g. "M5V, M5W / m6k" -> {"M5V", "M5W", "M6K"}
+    """
+    return set(POSTAL_PREFIX_RE.findall((boundaries or "").upper()))
+
+
+def get_version(key):
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, int(time.time() * 1000), None)
+        version = cache.get(key, int(time.time() * 1000))
+    return version
+
+
+def bump_version(key):
+    try:
+        return cache.incr(key)
+    except ValueError:
+        version = int(time.time() * 1000)
+        cache.set(key, version, None)
+        return version
+
+
+def get_zones_version():
+    return get_version(DELIVERY_ZONES_VERSION_KEY)
+
+
+def bump_zones_version():
+    return bump_version(DELIVERY_ZONES_VERSION_KEY)
+
+
+def get_areas_version():
+    return get_version(DELIVERY_AREAS_VERSION_KEY)
+
+
+def bump_areas_version():
+    return bump_version(DELIVERY_AREAS_VERSION_KEY)
+
+
+def sync_delivery_zones(restaurant):
+    """
+    Make the DeliveryZone rows of a restaurant match its boundaries
+    """
+    prefixes = parse_boundaries(restaurant.boundaries)
+    existing = set(DeliveryZone.objects.filter(
+        restaurant=restaurant
+    ).values_list("postal_prefix", flat=True))
+    if prefixes == existing:
+        return False
+
+    with transaction.atomic():
+        DeliveryZone.objects.filter(
+            restaurant=restaurant, postal_prefix__in=existing - prefixes
+        ).delete()
+        DeliveryZone.objects.bulk_create([
+            DeliveryZone(restaurant=restaurant, postal_prefix=prefix)
+            for prefix in sorted(prefixes - existing)
+        ])
+        transaction.on_commit(bump_zones_version)
+    return True
+
+
+def get_prefix_map():
+    """
+    Return {postal prefix: frozenset of restaurant ids}, loaded once
+    per worker and reloaded when the zones version moves on
+    """
+    version = get_zones_version()
+    if _prefix_map["version"] == version:
+        return _prefix_map["restaurants"]
+
+    with _lock:
+        if _prefix_map["version"] != version:
+            restaurants = {}
+            for prefix, restaurant_id in DeliveryZone.objects.values_list(
+                    "postal_prefix", "restaurant_id").iterator():
+                restaurants.setdefault(prefix, set()).add(restaurant_id)
+            _prefix_map["restaurants"] = dict(
+                (prefix, frozenset(ids)) for prefix, ids in restaurants.items()
+            )
+            _prefix_map["version"] = version
+    return _prefix_map["restaurants"]
+
+
+def restaurants_delivering_to(postal_code):
+    """
+    Return the ids of the restaurants delivering to a postal code
+    """
+    return get_prefix_map().get(postal_prefix(postal_code), frozenset())
+
+
+def get_area_index():
+    """
+    Return the GridIndex of every delivery area, built once per worker
+    and rebuilt when the areas version moves on
+    """
+    version = get_areas_version()
+    if _area_index["version"] == version:
+        return _area_index["index"]
+
+    with _lock:
+        if _area_index["version"] != version:
+            areas = Restaurant.objects.exclude(
+                delivery_area=''
+            ).values_list("id", "delivery_area").iterator()
+            _area_index["index"] = GridIndex(
+                (
+                    (restaurant_id, polygon)
+                    for restaurant_id, area in areas
+                    for polygon in parse_area(area)
+                ),
+                cell_size=DELIVERY_GRID_CELL
+            )
+            _area_index["version"] = version
+    return _area_index["index"]
+
+
+def restaurants_delivering_to_point(latitude, longitude):
+    """
+    Return the ids of the restaurants whose delivery area holds a point
+    """
+    return get_area_index().query(longitude, latitude)
+
+
+def restaurants_delivering_to_address(address):
+    """
+    Match by coordinates when the address has some, by postal code
+    otherwise
+    """
+    if address.latitude is not None and address.longitude is not None:
+        return restaurants_delivering_to_point(
+            address.latitude, address.longitude
+        )
+    return restaurants_delivering_to(address.postal_code)
@@ -1,7 +1,8 @@
 from django import forms
 from django.contrib.auth.models import User
-from django.forms.utils import ErrorList
+from django.core.exceptions import ValidationError
 from eatplusapp.models import *
+from eatplusapp.options import get_option_schema, validate_choices
 from allauth.account.forms import SignupForm
 
 
@@ -109,40 +110,66 @@ class OrderItemForm(forms.ModelForm):
 
 
 class ItemForm(forms.Form):
+    """
+    Options of an item, built from its cached option schema.
 
-    def __init__(
-            self, data=None, files=None, auto_id='id_%s', prefix=None,
-            initial=None, error_class=ErrorList, label_suffix=None,
-            empty_permitted=False, field_order=None,
-            use_required_attribute=None, item=None
-    ):
-        type_of_radio = 0
-        options = Option.objects.filter(item=item)
-
-        for option in options:
-            required = False
+    Fields are added to the instance, so options of one item never
+    leak into the form of another.
+    """
+
+    def __init__(self, *args, **kwargs):
+        item = kwargs.pop('item', None)
+        super().__init__(*args, **kwargs)
+
+        if item is not None:
+            self.schema = get_option_schema(item.id)
+        else:
+            self.schema = {'options': [], 'choice_options': {}}
+        for option in self.schema['options']:
             choices = [
                 (
-                    _choice.id, '%s    $%s' % (
-                        _choice.name, _choice.extra_charge
+                    _choice['id'], '%s    $%s' % (
+                        _choice['name'], _choice['extra_charge']
                     )
                 )
-                for _choice in Choice.objects.filter(option=option)
+                for _choice in option['choices']
             ]
 
-            widget = forms.CheckboxSelectMultiple(choices=choices)
-            if option.type == type_of_radio:
-                widget = forms.RadioSelect(choices=choices)
-                required = True
-
-            self.base_fields[option.name] = forms.IntegerField(
-                widget=widget, required=required
-            )
+            if option['widget'] == 'radio':
+                field = forms.TypedChoiceField(
+                    choices=choices, coerce=int, required=True,
+                    widget=forms.RadioSelect
+                )
+            else:
+                field = forms.TypedMultipleChoiceField(
+                    choices=choices, coerce=int, required=False,
+                    widget=forms.CheckboxSelectMultiple
+                )
 
-        super().__init__(
-            data, files, auto_id, prefix, initial, error_class, label_suffix,
-            empty_permitted, field_order, use_required_attribute
-        )
+            self.fields[option['name']] = field
+
+    def clean(self):
+        cleaned_data = super().clean()
+        try:
+            validate_choices(self.schema, self.selected_choices())
+        except ValidationError as error:
+            raise forms.ValidationError(error.messages)
+        return cleaned_data
+
+    def selected_choices(self):
+        """
+        Ids of the submitted choices
+        """
+        choice_ids = []
+        for option in self.schema['options']:
+            value = self.cleaned_data.get(option['name'])
+            if value in (None, ''):
+                continue
+            if isinstance(value, list):
+                choice_ids.extend(value)
+            else:
+                choice_ids.append(value)
+        return choice_ids
 
 
 class CustomerSignupForm(SignupForm):
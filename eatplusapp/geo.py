@@ -0,0 +1,247 @@
+import json
+import math
+
+try:
+    import numpy
+except ImportError:  # pragma: no cover
+    numpy = None
+
+
+GEOHASH_ALPHABET = "0123456789bcdefghjkmnpqrstuvwxyz"
+EARTH_RADIUS_KM = 6371.0088
+
+
+def parse_area(text):
+    """
+    Return the polygons of a delivery area as lists of (lng, lat).
+
+    The area is JSON, either one ring [[lng, lat], ...] or a list of
+    rings [[[lng, lat], ...], ...]. Rings with less than three points
+    and unreadable areas are ignored.
+    """
+    try:
+        data = json.loads(text or "[]")
+    except ValueError:
+        return []
+    if not isinstance(data, list) or not data:
+        return []
+    if _is_point(data[0]):
+        data = [data]
+
+    polygons = []
+    for ring in data:
+        if not isinstance(ring, list):
+            continue
+        points = [
+            (float(point[0]), float(point[1]))
+            for point in ring if _is_point(point)
+        ]
+        if len(points) > 1 and points[0] == points[-1]:
+            points.pop()
+        if len(points) >= 3:
+            polygons.append(points)
+    return polygons
+
+
+def _is_point(value):
+    return (
+        isinstance(value, (list, tuple)) and len(value) == 2 and
+        all(isinstance(v, (int, float)) for v in value)
+    )
+
+
+class GridIndex(object):
+    """
+    Uniform grid over the bounding boxes of polygons.
+
+    Each cell keeps the edges of the polygons whose bounding box
+    overlaps it, so finding the polygons around a point is a dict
+    lookup and a single ray casting pass over the edges of that cell,
+    vectorized with NumPy when it is installed.
+    """
+
+    def __init__(self, polygons, cell_size=0.05):
+        """
+        `polygons` is an iterable of (owner, [(lng, lat), ...])
+        """
+        self.cell_size = cell_size
+        cells = {}
+        for owner, polygon in polygons:
+            xs = [x for x, _ in polygon]
+            ys = [y for _, y in polygon]
+            edges = [
+                (x1, y1, x2, y2)
+                for (x1, y1), (x2, y2) in zip(
+                    polygon, polygon[-1:] + polygon[:-1]
+                )
+            ]
+            col_min, row_min = self.cell(min(xs), min(ys))
+            col_max, row_max = self.cell(max(xs), max(ys))
+            for col in range(col_min, col_max + 1):
+                for row in range(row_min, row_max + 1):
+                    cells.setdefault((col, row), []).append((owner, edges))
+
+        self.cells = dict(
+            (key, self._pack(rings)) for key, rings in cells.items()
+        )
+
+    def cell(self, lng, lat):
+        return (
+            int(math.floor(lng / self.cell_size)),
+            int(math.floor(lat / self.cell_size))
+        )
+
+    @staticmethod
+    def _pack(rings):
+        # crossings are counted per ring, an owner may have several
+        owners = []
+        edges = []
+        for ring_id, (owner, ring_edges) in enumerate(rings):
+            owners.append(owner)
+            edges.extend(edge + (ring_id, ) for edge in ring_edges)
+        if numpy is None:
+            return owners, edges
+        return owners, numpy.array(edges, dtype=float).T
+
+    def query(self, lng, lat):
+        """
+        Return the set of owners with a polygon containing the point
+        """
+        packed = self.cells.get(self.cell(lng, lat))
+        if packed is None:
+            return set()
+        owners, edges = packed
+
+        if numpy is None:
+            crossings = [0] * len(owners)
+            for x1, y1, x2, y2, ring_id in edges:
+                if (y1 > lat) != (y2 > lat) and \
+                        lng < (x2 - x1) * (lat - y1) / (y2 - y1) + x1:
+                    crossings[ring_id] += 1
+        else:
+            x1, y1, x2, y2, ring_ids = edges
+            straddles = (y1 > lat) != (y2 > lat)
+            with numpy.errstate(divide="ignore", invalid="ignore"):
+                crosses = straddles & (
+                    lng < (x2 - x1) * (lat - y1) / (y2 - y1) + x1
+                )
+            crossings = numpy.bincount(
+                ring_ids.astype(int), weights=crosses,
+                minlength=len(owners)
+            ).astype(int)
+
+        return set(
+            owner for owner, count in zip(owners, crossings) if count % 2
+        )
+
+
+# GEOHASH
+def geohash(latitude, longitude, precision=9):
+    """
+    Encode a point, e.g. geohash(43.6426, -79.3871, 6) -> "dpz838"
+    """
+    lat_range = [-90.0, 90.0]
+    lng_range = [-180.0, 180.0]
+    chars = []
+    bits = 0
+    value = 0
+    even = True
+    while len(chars) < precision:
+        if even:
+            bounds, coordinate = lng_range, longitude
+        else:
+            bounds, coordinate = lat_range, latitude
+        middle = (bounds[0] + bounds[1]) / 2
+        value <<= 1
+        if coordinate >= middle:
+            value |= 1
+            bounds[0] = middle
+        else:
+            bounds[1] = middle
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(GEOHASH_ALPHABET[value])
+            bits = value = 0
+    return "".join(chars)
+
+
+def geohash_cell_size(precision):
+    """
+    Return (lat, lng) degrees covered by a geohash of `precision`
+    """
+    lng_bits = (5 * precision + 1) // 2
+    lat_bits = 5 * precision // 2
+    return 180.0 / 2 ** lat_bits, 360.0 / 2 ** lng_bits
+
+
+def geohash_block(latitude, longitude, precision):
+    """
+    Return the geohash of the point and of its 8 neighbours
+    """
+    lat_size, lng_size = geohash_cell_size(precision)
+    cells = set()
+    for d_lat in (-lat_size, 0, lat_size):
+        lat = latitude + d_lat
+        if not -90 <= lat <= 90:
+            continue
+        for d_lng in (-lng_size, 0, lng_size):
+            lng = (longitude + d_lng + 180) % 360 - 180
+            cells.add(geohash(lat, lng, precision))
+    return cells
+
+
+def haversine_km(latitude, longitude, latitudes, longitudes):
+    """
+    Great-circle distances in km from a point to sequences of points,
+    as a NumPy array when NumPy is installed, a list otherwise
+    """
+    if numpy is None:
+        return [
+            _haversine(latitude, longitude, lat, lng)
+            for lat, lng in zip(latitudes, longitudes)
+        ]
+
+    lat1 = math.radians(latitude)
+    lat2 = numpy.radians(numpy.asarray(latitudes, dtype=float))
+    d_lat = lat2 - lat1
+    d_lng = numpy.radians(
+        numpy.asarray(longitudes, dtype=float) - longitude
+    )
+    a = (
+        numpy.sin(d_lat / 2) ** 2 +
+        math.cos(lat1) * numpy.cos(lat2) * numpy.sin(d_lng / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_KM * numpy.arcsin(numpy.sqrt(a))
+
+
+def rank_by_distance(latitude, longitude, rows, radius_km, limit=None):
+    """
+    `rows` are (owner, lat, lng). Return [(owner, km), ...] of the rows
+    within `radius_km` of the point, nearest first.
+    """
+    if not rows:
+        return []
+    owners, latitudes, longitudes = zip(*rows)
+    distances = haversine_km(latitude, longitude, latitudes, longitudes)
+
+    if numpy is None:
+        ranked = sorted(
+            (distance, i) for i, distance in enumerate(distances)
+            if distance <= radius_km
+        )
+        return [(owners[i], distance) for distance, i in ranked[:limit]]
+
+    inside = numpy.flatnonzero(distances <= radius_km)
+    nearest = inside[numpy.argsort(distances[inside], kind="stable")]
+    return [(owners[i], float(distances[i])) for i in nearest[:limit]]
+
+
+def _haversine(lat1, lng1, lat2, lng2):
+    lat1, lat2 = math.radians(lat1), math.radians(lat2)
+    a = (
+        math.sin((lat2 - lat1) / 2) ** 2 +
+        math.cos(lat1) * math.cos(lat2) *
+        math.sin(math.radians(lng2 - lng1) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
@@ -0,0 +1,109 @@
+import hashlib
+import json
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse
+from rest_framework import status
+from rest_framework.response import Response
+
+IDEMPOTENCY_CACHE = getattr(settings, "IDEMPOTENCY_CACHE", "default")
+IDEMPOTENCY_KEY_TTL = getattr(settings, "IDEMPOTENCY_KEY_TTL", 60 * 60 * 24)
+IDEMPOTENCY_PENDING_TTL = getattr(settings, "IDEMPOTENCY_PENDING_TTL", 60)
+
+PENDING = "pending"
+DONE = "done"
+
+
+def _digest(value):
+    return hashlib.sha1(value.encode("utf-8")).hexdigest()
+
+
+def idempotent(view):
+    """
+    Replay the first response of a request for retries that send the
+    same Idempotency-Key header.
+
+    Entries are (state, request digest, status, data) tuples keyed by
+    user and a hash of the key, and expire after IDEMPOTENCY_KEY_TTL.
+    A retry arriving while the first request still runs gets a 409, and
+    reusing a key with a different body a 422. Server errors aren't
+    kept, so they can be retried.
+    """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        key = request.META.get("HTTP_IDEMPOTENCY_KEY")
+        if not key:
+            return view(request, *args, **kwargs)
+        if len(key) > 255:
+            return Response(
+                {"detail": "Idempotency-Key is too long."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        store = caches[IDEMPOTENCY_CACHE]
+        cache_key = "idempotency:%s:%s" % (request.user.pk, _digest(key))
+        fingerprint = _digest(
+            json.dumps(request.data, sort_keys=True, default=str)
+        )
+
+        if not store.add(
+                cache_key, (PENDING, fingerprint, None, None),
+                IDEMPOTENCY_PENDING_TTL):
+            entry = store.get(cache_key)
+            if entry is not None:
+                return replay(entry, fingerprint)
+            # the entry expired in between, run the request
+            store.set(
+                cache_key, (PENDING, fingerprint, None, None),
+                IDEMPOTENCY_PENDING_TTL
+            )
+
+        try:
+            response = view(request, *args, **kwargs)
+        except Exception:
+            store.delete(cache_key)
+            raise
+
+        if response.status_code >= 500:
+            store.delete(cache_key)
+            return response
+
+        if isinstance(response, Response):
+            data = response.data
+        else:
+            data = json.loads(response.content.decode("utf-8") or "null")
+        store.set(
+            cache_key, (DONE, fingerprint, response.status_code, data),
+            IDEMPOTENCY_KEY_TTL
+        )
+        return response
+
+    return wrapper
+
+
+def replay(entry, fingerprint):
+    state, stored_fingerprint, status_code, data = entry
+
+    if stored_fingerprint != fingerprint:
+        return Response(
+            {"detail": "Idempotency-Key was used with another request."},
+            status=status.HTTP_422_UNPROCESSABLE_ENTITY
+        )
+
+    if state == PENDING:
+        response = Response(
+            {"detail": "A request with this Idempotency-Key is running."},
+            status=status.HTTP_409_CONFLICT
+        )
+        response["Retry-After"] = "1"
+        return response
+
+    response = HttpResponse(
+        json.dumps(data, default=str),
+        status=status_code,
+        content_type="application/json"
+    )
+    response["Idempotent-Replayed"] = "true"
+    return response
@@ -0,0 +1,124 @@
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+from eatplusapp.models import Restaurant
+
+LISTING_VERSION_KEY = "listing:version:%s"
+LISTING_CARDS_KEY = "listing:cards:%s"
+LISTING_CACHE_TIMEOUT = getattr(
+    settings, "LISTING_CACHE_TIMEOUT", 60 * 60 * 24
+)
+
+
+# CITY VERSIONS
+def get_listing_versions(city_slugs):
+    """
+    Return {city_slug: listing version}, started from the current time
+    in milliseconds for cities the cache doesn't know
+    """
+    keys = dict((LISTING_VERSION_KEY % slug, slug) for slug in city_slugs)
+    found = cache.get_many(list(keys))
+    versions = dict((keys[key], version) for key, version in found.items())
+
+    for key, slug in keys.items():
+        if slug not in versions:
+            cache.add(key, int(time.time() * 1000), None)
+            versions[slug] = cache.get(key, int(time.time() * 1000))
+    return versions
+
+
+def bump_listing_versions(city_slugs):
+    for slug in set(city_slugs):
+        key = LISTING_VERSION_KEY % slug
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, int(time.time() * 1000), None)
+
+
+# CARDS
+def build_city_cards(city_slug):
+    """
+    Return the cards of the listed restaurants of a city, newest first.
+
+    Costs three queries whatever the number of restaurants.
+    """
+    restaurants = list(Restaurant.objects.filter(
+        address__city_slug=city_slug, verified=True, available=True
+    ).order_by("-id").only(
+        "id", "name", "phone", "logo", "restaurant_slug", "address_id",
+        "minimum_delivery_order", "delivery_fee"
+    ))
+
+    payment_methods = {}
+    for field in ("pickup_payment_methods", "delivery_payment_methods"):
+        through = getattr(Restaurant, field).through
+        for restaurant_id, method_id in through.objects.filter(
+                restaurant_id__in=[r.id for r in restaurants]
+        ).order_by("paymentmethod_id").values_list(
+                "restaurant_id", "paymentmethod_id"):
+            payment_methods.setdefault(
+                (restaurant_id, field), []
+            ).append(method_id)
+
+    return [
+        {
+            "id": restaurant.id,
+            "name": restaurant.name,
+            "phone": restaurant.phone,
+            "address": restaurant.address_id,
+            "restaurant_slug": restaurant.restaurant_slug,
+            "logo": restaurant.logo.url if restaurant.logo else "",
+            "minimum_delivery_order": restaurant.minimum_delivery_order,
+            "delivery_fee": restaurant.delivery_fee,
+            "pickup_payment_methods": payment_methods.get(
+                (restaurant.id, "pickup_payment_methods"), []
+            ),
+            "delivery_payment_methods": payment_methods.get(
+                (restaurant.id, "delivery_payment_methods"), []
+            ),
+        }
+        for restaurant in restaurants
+    ]
+
+
+def get_city_cards(city_slugs):
+    """
+    Return {city_slug: [card, ...]}, rebuilding the cards of a city
+    only when its listing version moved on. Logo urls are relative.
+    """
+    city_slugs = set(city_slugs)
+    versions = get_listing_versions(city_slugs)
+    found = cache.get_many([LISTING_CARDS_KEY % slug for slug in city_slugs])
+
+    cards = {}
+    for slug in city_slugs:
+        snapshot = found.get(LISTING_CARDS_KEY % slug)
+        if snapshot is not None and snapshot[0] == versions[slug]:
+            cards[slug] = snapshot[1]
+            continue
+        cards[slug] = build_city_cards(slug)
+        cache.set(
+            LISTING_CARDS_KEY % slug, (versions[slug], cards[slug]),
+            LISTING_CACHE_TIMEOUT
+        )
+    return cards
+
+
+def listed_city_slugs():
+    return set(Restaurant.objects.filter(
+        verified=True, available=True
+    ).values_list("address__city_slug", flat=True).distinct())
+
+
+def absolute_logos(cards, request):
+    """
+    Copies of `cards` with absolute logo urls for API clients
+    """
+    return [
+        dict(card, logo=request.build_absolute_uri(card["logo"])
+             if card["logo"] else "")
+        for card in cards
+    ]
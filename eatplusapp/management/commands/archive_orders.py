@@ -0,0 +1,30 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from eatplusapp.archive import ORDER_ARCHIVE_AFTER_DAYS, archive_orders
+
+
+class Command(BaseCommand):
+    help = (
+        "Move completed and cancelled orders to the archive tables"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--days", type=int, default=ORDER_ARCHIVE_AFTER_DAYS,
+            help="Archive orders last changed more than this many days ago"
+        )
+        parser.add_argument("--chunk-size", type=int, default=500)
+        parser.add_argument(
+            "--every", type=int, default=0,
+            help="Keep running and archive every this many seconds"
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            archived = archive_orders(options["days"], options["chunk_size"])
+            self.stdout.write("%s orders archived" % archived)
+            if not options["every"]:
+                return
+            time.sleep(options["every"])
@@ -0,0 +1,494 @@
+import json
+import random
+import socket
+import socketserver
+import subprocess
+import threading
+import time
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, make_server
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from rest_framework_jwt.settings import api_settings
+
+from eatplusapp.models import (
+    Customer,
+    Manager,
+    PaymentMethod,
+    Restaurant,
+    Item,
+    Order
+)
+from eatplusapp.options import get_option_schema
+
+WORKLOADS = ("browse", "menu", "cart", "order", "kitchen")
+DEFAULT_MIX = "browse=30,menu=30,cart=20,order=10,kitchen=10"
+DEFAULT_BASELINE = "benchmarks/http.json"
+# how much worse than the baseline rps or p95 may get before --compare
+# fails, in percent
+DEFAULT_TOLERANCE = 20
+
+
+class ThreadingWSGIServer(socketserver.ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+
+class QuietHandler(WSGIRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+def percentile(timings, percent):
+    if not timings:
+        return None
+    rank = max(int(round(percent / 100.0 * len(timings))) - 1, 0)
+    return round(timings[rank], 2)
+
+
+def parse_mix(mix):
+    weights = {}
+    for part in mix.split(","):
+        name, _, weight = part.partition("=")
+        if name not in WORKLOADS:
+            raise CommandError("Unknown workload %r." % name)
+        weights[name] = int(weight or 1)
+    return weights
+
+
+def jwt_header(user):
+    token = api_settings.JWT_ENCODE_HANDLER(
+        api_settings.JWT_PAYLOAD_HANDLER(user)
+    )
+    return "JWT %s" % token
+
+
+class VirtualUser(object):
+    """
+    One client thread: a customer with an open cart, a second customer
+    placing orders and the kitchen of a restaurant
+    """
+
+    def __init__(self, base_url, fixture, index, seed):
+        self.base_url = base_url
+        self.fixture = fixture
+        self.random = random.Random(seed + index)
+        self.customer = fixture["customers"][index]
+        self.buyer = fixture["buyers"][index]
+        self.since = None
+
+    def request(self, method, path, auth, data=None):
+        body = None
+        headers = {"Authorization": auth}
+        if data is not None:
+            body = json.dumps(data).encode()
+            headers["Content-Type"] = "application/json"
+        response = urlopen(Request(
+            self.base_url + path, data=body, headers=headers, method=method
+        ), timeout=30)
+        return json.loads(response.read().decode() or "null")
+
+    def pick_line(self, restaurant=None):
+        restaurant = restaurant or self.random.choice(
+            self.fixture["restaurants"]
+        )
+        item_id, choices = self.random.choice(restaurant["items"])
+        return restaurant, {
+            "item_id": item_id, "quantity": self.random.randint(1, 3),
+            "choices": choices
+        }
+
+    def browse(self):
+        self.request(
+            "GET", "/api/v1/customer/restaurants/", self.customer["auth"]
+        )
+
+    def menu(self):
+        restaurant = self.random.choice(self.fixture["restaurants"])
+        self.request(
+            "GET", "/api/v1/customer/restaurants/%s/menu-tree/" %
+            restaurant["id"], self.customer["auth"]
+        )
+
+    def cart(self):
+        # carts belong to the first restaurant, the kitchen
+        line = self.pick_line(self.fixture["restaurants"][0])[1]
+        line["order_id"] = self.customer["cart_id"]
+        self.request(
+            "POST", "/api/v1/customer/orderitems/", self.customer["auth"],
+            line
+        )
+
+    def order(self):
+        restaurant, line = self.pick_line()
+        self.request(
+            "POST", "/api/v1/customer/orders/", self.buyer["auth"], {
+                "order_items": [line],
+                "address": "1 Main St",
+                "restaurant_id": restaurant["id"],
+                "payment_method_id": self.fixture["payment_method_id"],
+            }
+        )
+
+    def kitchen(self):
+        path = "/api/v1/restaurant/orders/changes/"
+        if self.since:
+            path += "?since=%s" % self.since
+        changes = self.request("GET", path, self.fixture["manager_auth"])
+        self.since = changes["watermark"]
+
+
+class Command(BaseCommand):
+    help = (
+        "Load test the customer and restaurant APIs over HTTP and report "
+        "latency percentiles and throughput per workload"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--server", choices=("inprocess", "gunicorn"),
+            default="inprocess",
+            help="Serve eatplus.wsgi from a thread of this process or "
+                 "from gunicorn"
+        )
+        parser.add_argument("--workers", type=int, default=4,
+                            help="gunicorn workers")
+        parser.add_argument("--bind", default="127.0.0.1:8765")
+        parser.add_argument("--concurrency", type=int, default=8)
+        parser.add_argument("--duration", type=float, default=30,
+                            help="Seconds of measured load")
+        parser.add_argument("--warmup", type=float, default=3,
+                            help="Seconds of unmeasured load first")
+        parser.add_argument(
+            "--mix", default=DEFAULT_MIX,
+            help="Weights of the workloads: %s" % ", ".join(WORKLOADS)
+        )
+        parser.add_argument("--restaurants", type=int, default=20,
+                            help="Restaurants the clients order from")
+        parser.add_argument("--seed", type=int, default=1)
+        parser.add_argument(
+            "--save",
+            help="Write the results to this JSON, e.g. to update the "
+                 "baseline kept in %s. Not written when a request "
+                 "failed." % DEFAULT_BASELINE
+        )
+        parser.add_argument(
+            "--compare", nargs="?", const=DEFAULT_BASELINE,
+            help="Compare with the results in this JSON (default %s) "
+                 "and fail on a regression" % DEFAULT_BASELINE
+        )
+        parser.add_argument(
+            "--tolerance", type=float, default=DEFAULT_TOLERANCE,
+            help="Percent rps or p95 may get worse than the baseline"
+        )
+
+    def handle(self, *args, **options):
+        mix = parse_mix(options["mix"])
+        fixture = self.prepare(options["restaurants"], options["concurrency"])
+        host, port = options["bind"].rsplit(":", 1)
+
+        stop_server = self.start_server(
+            options["server"], host, int(port), options["workers"]
+        )
+        try:
+            base_url = "http://%s:%s" % (host, port)
+            if options["warmup"]:
+                self.run_load(base_url, fixture, mix, options["concurrency"],
+                              options["warmup"], options["seed"])
+            timings, failures, elapsed = self.run_load(
+                base_url, fixture, mix, options["concurrency"],
+                options["duration"], options["seed"]
+            )
+        finally:
+            stop_server()
+
+        results = self.summarize(timings, failures, elapsed)
+        results["config"] = {
+            key: options[key] for key in (
+                "server", "workers", "concurrency", "duration", "mix",
+                "restaurants", "seed"
+            )
+        }
+        results["config"]["database"] = connection.vendor
+        self.report(results)
+
+        self.check_failures(results)
+
+        if options["save"]:
+            with open(options["save"], "w") as output:
+                json.dump(results, output, indent=2, sort_keys=True)
+                output.write("\n")
+        if options["compare"]:
+            with open(options["compare"]) as baseline:
+                regressions = self.compare(
+                    json.load(baseline), results, options["tolerance"]
+                )
+            if regressions:
+                raise CommandError(
+                    "Slower than the baseline: %s" % ", ".join(regressions)
+                )
+
+    def prepare(self, restaurant_count, concurrency):
+        restaurants = []
+        for restaurant in Restaurant.objects.filter(
+                verified=True, available=True).order_by("id"):
+            items = []
+            for item_id in Item.objects.filter(
+                    restaurant=restaurant, available=True
+            ).order_by("id").values_list("id", flat=True)[:20]:
+                # the first choice of every required option
+                choices = [
+                    option["choices"][0]["id"]
+                    for option in get_option_schema(item_id)["options"]
+                    if option["required"] and option["choices"]
+                ]
+                items.append((item_id, choices))
+            if items:
+                restaurants.append({
+                    "id": restaurant.id, "address_id": restaurant.address_id,
+                    "items": items
+                })
+            if len(restaurants) == restaurant_count:
+                break
+        if not restaurants:
+            raise CommandError(
+                "No listed restaurant with available items, "
+                "run seed_scale first."
+            )
+
+        kitchen = Restaurant.objects.get(id=restaurants[0]["id"])
+        manager = Manager.objects.filter(restaurant=kitchen).first()
+        if manager is None:
+            manager = Manager.objects.create(
+                restaurant=kitchen,
+                user=User.objects.create_user("bench-manager-%s" % kitchen.id)
+            )
+
+        fixture = {
+            "restaurants": restaurants,
+            "manager_auth": jwt_header(manager.user),
+            "payment_method_id": PaymentMethod.objects.order_by(
+                "id").values_list("id", flat=True).first(),
+            "customers": [],
+            "buyers": [],
+        }
+        for i in range(concurrency):
+            for kind in ("customers", "buyers"):
+                user, _ = User.objects.get_or_create(
+                    username="bench-%s-%s" % (kind, i)
+                )
+                customer, _ = Customer.objects.get_or_create(
+                    user=user, defaults={
+                        "address_id": restaurants[0]["address_id"],
+                        "image": "images/customers/bench.png",
+                    }
+                )
+                client = {"auth": jwt_header(user), "id": customer.id}
+                if kind == "customers":
+                    client["cart_id"] = Order.objects.get_or_create(
+                        customer=customer, status=Order.OPEN,
+                        defaults={"restaurant": kitchen}
+                    )[0].id
+                else:
+                    self.finish_orders(customer.id)
+                fixture[kind].append(client)
+        return fixture
+
+    @staticmethod
+    def finish_orders(customer_id):
+        # a customer may have a single unfinished order at a time
+        Order.objects.filter(customer_id=customer_id).exclude(
+            status=Order.COMPLETED
+        ).update(status=Order.COMPLETED)
+
+    def start_server(self, kind, host, port, workers):
+        """
+        Start serving eatplus.wsgi, return a function stopping it
+        """
+        if kind == "gunicorn":
+            process = subprocess.Popen([
+                "gunicorn", "eatplus.wsgi", "--bind", "%s:%s" % (host, port),
+                "--workers", str(workers), "--log-level", "warning"
+            ])
+            deadline = time.time() + 30
+            while True:
+                try:
+                    socket.create_connection((host, port), timeout=1).close()
+                    break
+                except OSError:
+                    if process.poll() is not None or time.time() > deadline:
+                        process.kill()
+                        raise CommandError("gunicorn did not start.")
+                    time.sleep(0.2)
+
+            def stop():
+                process.terminate()
+                process.wait()
+            return stop
+
+        from eatplus.wsgi import application
+        server = make_server(
+            host, port, application, server_class=ThreadingWSGIServer,
+            handler_class=QuietHandler
+        )
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+        def stop():
+            server.shutdown()
+            server.server_close()
+        return stop
+
+    def run_load(self, base_url, fixture, mix, concurrency, duration, seed):
+        """
+        Return the timings of the successful requests and the failures,
+        {status or "connection": count}, of each workload
+        """
+        names = sorted(mix)
+        weights = [mix[name] for name in names]
+        timings = dict((name, []) for name in names)
+        failures = dict((name, {}) for name in names)
+        lock = threading.Lock()
+        stop_at = time.time() + duration
+
+        def worker(index):
+            user = VirtualUser(base_url, fixture, index, seed)
+            while time.time() < stop_at:
+                name = user.random.choices(names, weights)[0]
+                started = time.perf_counter()
+                failure = None
+                try:
+                    getattr(user, name)()
+                except HTTPError as error:
+                    # 4xx and 5xx, redirects were followed
+                    failure = str(error.code)
+                except (OSError, ValueError):
+                    failure = "connection"
+                elapsed = (time.perf_counter() - started) * 1000
+                with lock:
+                    if failure is None:
+                        timings[name].append(elapsed)
+                    else:
+                        failed = failures[name]
+                        failed[failure] = failed.get(failure, 0) + 1
+                if name == "order":
+                    # outside of the measured request
+                    self.finish_orders(user.buyer["id"])
+            connection.close()
+
+        started = time.time()
+        threads = [
+            threading.Thread(target=worker, args=(i, ))
+            for i in range(concurrency)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return timings, failures, time.time() - started
+
+    def summarize(self, timings, failures, elapsed):
+        """
+        Throughput and percentiles count successful requests only, a
+        fast error page would flatter them; failures are listed apart
+        """
+        def stats(samples, failed):
+            samples = sorted(samples)
+            return {
+                "requests": len(samples),
+                "errors": sum(failed.values()),
+                "error_statuses": failed,
+                "rps": round(len(samples) / elapsed, 2),
+                "p50_ms": percentile(samples, 50),
+                "p95_ms": percentile(samples, 95),
+                "p99_ms": percentile(samples, 99),
+            }
+
+        total_failures = {}
+        for failed in failures.values():
+            for failure, count in failed.items():
+                total_failures[failure] = (
+                    total_failures.get(failure, 0) + count
+                )
+        return {
+            "workloads": dict(
+                (name, stats(timings[name], failures[name]))
+                for name in timings
+            ),
+            "total": stats(
+                [t for samples in timings.values() for t in samples],
+                total_failures
+            ),
+        }
+
+    def report(self, results):
+        self.stdout.write("%-10s %9s %7s %9s %9s %9s %9s" % (
+            "workload", "requests", "errors", "rps", "p50 ms", "p95 ms",
+            "p99 ms"
+        ))
+        rows = sorted(results["workloads"].items())
+        for name, stats in rows + [("total", results["total"])]:
+            self.stdout.write("%-10s %9s %7s %9s %9s %9s %9s" % (
+                name, stats["requests"], stats["errors"], stats["rps"],
+                stats["p50_ms"], stats["p95_ms"], stats["p99_ms"]
+            ))
+        for name, stats in rows:
+            if stats["errors"]:
+                self.stdout.write("%s errors: %s" % (name, ", ".join(
+                    "%s x%s" % item
+                    for item in sorted(stats["error_statuses"].items())
+                )))
+
+    def check_failures(self, results):
+        """
+        Fail when a request failed: errors are bugs to fix, not part of
+        a baseline
+        """
+        total = results["total"]
+        if total["errors"]:
+            raise CommandError("%s requests failed: %s" % (
+                total["errors"], ", ".join(
+                    "%s x%s" % item
+                    for item in sorted(total["error_statuses"].items())
+                )
+            ))
+
+    def compare(self, baseline, results, tolerance):
+        """
+        Print the change of rps and p95 from `baseline` and return the
+        workloads that got worse by more than `tolerance` percent
+        """
+        regressions = []
+        self.stdout.write("\nchange from baseline")
+        self.stdout.write("%-10s %9s %9s" % ("workload", "rps", "p95 ms"))
+        rows = sorted(results["workloads"].items())
+        for name, stats in rows + [("total", results["total"])]:
+            before = baseline["workloads"].get(name) if name != "total" \
+                else baseline.get("total")
+            if not before:
+                continue
+            rps = change(before["rps"], stats["rps"])
+            p95 = change(before["p95_ms"], stats["p95_ms"])
+            self.stdout.write("%-10s %9s %9s" % (
+                name, format_change(rps), format_change(p95)
+            ))
+            if (rps is not None and rps < -tolerance) or (
+                    p95 is not None and p95 > tolerance):
+                regressions.append(name)
+        return regressions
+
+
+def change(before, after):
+    """
+    Percent change from `before` to `after`, None if unknown
+    """
+    if not before or after is None:
+        return None
+    return (after - before) * 100.0 / before
+
+
+def format_change(percent):
+    return "-" if percent is None else "%+.1f%%" % percent
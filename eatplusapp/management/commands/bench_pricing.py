@@ -0,0 +1,89 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from eatplusapp.models import (
+    Address,
+    Restaurant,
+    MenuSection,
+    Item,
+    Option,
+    Choice
+)
+from eatplusapp.pricing import quote_cart
+
+
+class Command(BaseCommand):
+    help = "Benchmark the pricing engine on 1, 10 and 100-line carts"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--sizes", default="1,10,100",
+            help="Comma separated cart sizes"
+        )
+        parser.add_argument(
+            "--repeat", type=int, default=200,
+            help="Quotes per cart size"
+        )
+
+    def handle(self, *args, **options):
+        sizes = [int(size) for size in options["sizes"].split(",")]
+
+        # fixtures are rolled back once the benchmark is over
+        with transaction.atomic():
+            restaurant, items = self.create_menu(max(sizes))
+
+            self.stdout.write("%8s %8s %12s" % ("lines", "queries", "ms/quote"))
+            for size in sizes:
+                lines = [
+                    {
+                        "item_id": item.id,
+                        "quantity": 2,
+                        "choices": [item.choice_ids[0]],
+                    }
+                    for item in items[:size]
+                ]
+
+                with CaptureQueriesContext(connection) as queries:
+                    quote_cart(restaurant.id, lines)
+
+                started = time.perf_counter()
+                for _ in range(options["repeat"]):
+                    quote_cart(restaurant.id, lines)
+                elapsed = time.perf_counter() - started
+
+                self.stdout.write("%8s %8s %12.3f" % (
+                    size, len(queries), elapsed * 1000 / options["repeat"]
+                ))
+
+            transaction.set_rollback(True)
+
+    @staticmethod
+    def create_menu(size):
+        address = Address.objects.create(country="Canada", city="Bench")
+        restaurant = Restaurant.objects.create(
+            name="Pricing bench", phone="0", address=address
+        )
+        section = MenuSection.objects.create(
+            restaurant=restaurant, title="Bench", order=1
+        )
+
+        items = []
+        for i in range(size):
+            item = Item.objects.create(
+                restaurant=restaurant, menu_section=section, order=i + 1,
+                name="Item %s" % i, short_description="", image="",
+                price=10, available=True
+            )
+            option = Option.objects.create(item=item, name="Size", type=0)
+            item.choice_ids = [
+                Choice.objects.create(
+                    item=item, option=option, name=name, extra_charge=charge
+                ).id
+                for name, charge in (("Small", 0), ("Large", "1.50"))
+            ]
+            items.append(item)
+
+        return restaurant, items
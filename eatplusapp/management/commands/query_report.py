@@ -0,0 +1,56 @@
+from django.core.management.base import BaseCommand
+
+from eatplusapp.querylog import clear, collect, percentile_ms
+
+ORDERINGS = {
+    "total": lambda stats: stats["total_ms"],
+    "count": lambda stats: stats["count"],
+    "p95": lambda stats: percentile_ms(stats, 95),
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "List the SQL fingerprints costing the most time, per view, from "
+        "the query log of every worker"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--top", type=int, default=20)
+        parser.add_argument(
+            "--by", choices=sorted(ORDERINGS), default="total",
+            help="Rank by total time (default), query count or p95"
+        )
+        parser.add_argument("--view", help="Only queries of this view")
+        parser.add_argument(
+            "--sql", action="store_true",
+            help="Print a sample query under each fingerprint"
+        )
+        parser.add_argument(
+            "--reset", action="store_true",
+            help="Clear the collected statistics afterwards"
+        )
+
+    def handle(self, *args, **options):
+        rows = [
+            (view, sql, stats) for (view, sql), stats in collect().items()
+            if not options["view"] or view == options["view"]
+        ]
+        rows.sort(key=lambda row: ORDERINGS[options["by"]](row[2]),
+                  reverse=True)
+
+        self.stdout.write("%10s %8s %8s %8s  %s" % (
+            "total ms", "count", "avg ms", "p95 ms", "view / fingerprint"
+        ))
+        for view, sql, stats in rows[:options["top"]]:
+            self.stdout.write("%10.1f %8s %8.2f %8s  %s" % (
+                stats["total_ms"], stats["count"],
+                stats["total_ms"] / stats["count"],
+                percentile_ms(stats, 95), view
+            ))
+            self.stdout.write("%38s  %s" % ("", sql[:200]))
+            if options["sql"]:
+                self.stdout.write("%38s  %s" % ("", stats["sample"]))
+
+        if options["reset"]:
+            clear()
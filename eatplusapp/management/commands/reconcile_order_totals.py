@@ -0,0 +1,98 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count, Sum
+
+from eatplusapp.models import Order, OrderItem
+from eatplusapp.pricing import line_cents, order_total_cents
+
+
+class Command(BaseCommand):
+    help = (
+        "Fix drift between stored order totals and the sum of their lines"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--status", default=str(Order.OPEN),
+            help="Comma separated statuses of the orders to check "
+                 "(default: open carts, placed orders include fees)"
+        )
+        parser.add_argument(
+            "--lines", action="store_true",
+            help="Reprice line unit prices and totals from item prices "
+                 "and choices first"
+        )
+        parser.add_argument("--chunk-size", type=int, default=1000)
+        parser.add_argument("--dry-run", action="store_true")
+
+    def handle(self, *args, **options):
+        statuses = [int(status) for status in options["status"].split(",")]
+        self.chunk_size = options["chunk_size"]
+        self.dry_run = options["dry_run"]
+
+        if options["lines"]:
+            fixed = self.reconcile_lines(statuses)
+            self.stdout.write("%s line totals fixed" % fixed)
+
+        fixed = self.reconcile_orders(statuses)
+        self.stdout.write("%s order totals fixed" % fixed)
+
+    def reconcile_lines(self, statuses):
+        fixed = 0
+        last_id = 0
+        while True:
+            lines = list(OrderItem.objects.filter(
+                order__status__in=statuses, id__gt=last_id
+            ).order_by("id").values_list(
+                "id", "item__price", "quantity", "unit_price", "sub_total"
+            )[:self.chunk_size])
+            if not lines:
+                return fixed
+            last_id = lines[-1][0]
+
+            extra_charges = {}
+            for order_item_id, charge in (
+                OrderItem.choices.through.objects.filter(
+                    orderitem_id__in=[line[0] for line in lines]
+                ).values_list("orderitem_id", "choice__extra_charge")
+            ):
+                extra_charges.setdefault(order_item_id, []).append(charge)
+
+            for (order_item_id, price, quantity, unit_price,
+                 sub_total) in lines:
+                expected = line_cents(
+                    price, extra_charges.get(order_item_id, ()), quantity
+                )
+                if expected == (unit_price, sub_total):
+                    continue
+                fixed += 1
+                if not self.dry_run:
+                    OrderItem.objects.filter(id=order_item_id).update(
+                        unit_price=expected[0], sub_total=expected[1]
+                    )
+
+    def reconcile_orders(self, statuses):
+        fixed = 0
+        last_id = 0
+        while True:
+            # orders placed through the API have no lines to sum
+            orders = list(Order.objects.filter(
+                status__in=statuses, id__gt=last_id
+            ).annotate(
+                lines=Count("order_orderitem"),
+                lines_total=Sum("order_orderitem__sub_total")
+            ).filter(lines__gt=0).order_by("id").values_list(
+                "id", "sub_total", "total", "lines_total"
+            )[:self.chunk_size])
+            if not orders:
+                return fixed
+            last_id = orders[-1][0]
+
+            for order_id, sub_total, total, lines_total in orders:
+                expected_total = order_total_cents(lines_total)
+                if sub_total == lines_total and total == expected_total:
+                    continue
+                fixed += 1
+                if not self.dry_run:
+                    Order.objects.filter(id=order_id).update(
+                        sub_total=lines_total, total=expected_total
+                    )
@@ -0,0 +1,413 @@
+import random
+from contextlib import contextmanager
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import Max
+from django.template.defaultfilters import slugify
+from django.utils import timezone
+
+from eatplusapp.delivery import (
+    bump_areas_version,
+    bump_zones_version,
+    sync_delivery_zones
+)
+from eatplusapp.geo import geohash
+from eatplusapp.listings import bump_listing_versions
+from eatplusapp.models import (
+    GEOHASH_PRECISIONS,
+    Address,
+    PaymentMethod,
+    Restaurant,
+    MenuSection,
+    Customer,
+    Item,
+    Option,
+    Choice,
+    Order,
+    OrderItem
+)
+from eatplusapp.pricing import order_total_cents, to_cents
+
+CITIES = (
+    "Toronto", "Montreal", "Vancouver", "Calgary", "Edmonton", "Ottawa",
+    "Winnipeg", "Quebec City", "Hamilton", "Kitchener", "London",
+    "Victoria", "Halifax", "Oshawa", "Windsor", "Saskatoon", "Regina",
+    "Sherbrooke", "Barrie", "Kelowna",
+)
+CITY_CENTRES = (
+    (43.65, -79.38), (45.50, -73.57), (49.28, -123.12), (51.05, -114.07),
+    (53.55, -113.49), (45.42, -75.70), (49.90, -97.14), (46.81, -71.21),
+    (43.26, -79.87), (43.45, -80.49), (42.98, -81.25), (48.43, -123.37),
+    (44.65, -63.58), (43.90, -78.86), (42.31, -83.04), (52.13, -106.67),
+    (50.45, -104.61), (45.40, -71.89), (44.39, -79.69), (49.89, -119.50),
+)
+EXTRA_CHARGES = (Decimal("0"), Decimal("0.50"), Decimal("1"), Decimal("1.50"))
+
+# status of orders from past days, today's are still in the kitchen
+PAST_STATUSES = (Order.COMPLETED, ) * 9 + (Order.CANCELLED, )
+TODAY_STATUSES = (
+    Order.PLACED, Order.RECEIVED, Order.READY, Order.ONTHEWAY,
+    Order.COMPLETED
+)
+
+
+@contextmanager
+def explicit_timestamps(model):
+    """
+    Let bulk_create store the given created/updated times instead of now
+    """
+    fields = [
+        field for field in model._meta.concrete_fields
+        if getattr(field, "auto_now", False) or
+        getattr(field, "auto_now_add", False)
+    ]
+    saved = [(field.auto_now, field.auto_now_add) for field in fields]
+    for field in fields:
+        field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, (auto_now, auto_now_add) in zip(fields, saved):
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+class Writer(object):
+    """
+    Buffer rows of one model and insert them with bulk_create.
+
+    Ids are handed out here, since bulk_create doesn't return them on
+    every database, so related rows can point at unsaved ones.
+    """
+
+    def __init__(self, model, chunk_size):
+        self.model = model
+        self.chunk_size = chunk_size
+        self.rows = []
+        self.count = 0
+        self.next_id = (
+            model.objects.aggregate(last=Max("id"))["last"] or 0
+        ) + 1
+
+    def add(self, **fields):
+        fields["id"] = self.next_id
+        self.next_id += 1
+        self.rows.append(self.model(**fields))
+        return fields["id"]
+
+    def flush(self):
+        if self.rows:
+            self.model.objects.bulk_create(self.rows)
+            self.count += len(self.rows)
+            self.rows = []
+
+
+def flush(*writers, **kwargs):
+    """
+    Insert the buffered rows of `writers`, parents first, in one
+    transaction; only once one of them is full unless `force`
+    """
+    if not kwargs.get("force") and all(
+            len(writer.rows) < writer.chunk_size for writer in writers):
+        return
+    with transaction.atomic():
+        for writer in writers:
+            writer.flush()
+
+
+class Command(BaseCommand):
+    help = (
+        "Generate a large synthetic dataset of restaurants, menus and "
+        "orders for capacity planning"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--cities", type=int, default=10)
+        parser.add_argument("--restaurants-per-city", type=int, default=100)
+        parser.add_argument("--sections", type=int, default=5,
+                            help="Menu sections per restaurant")
+        parser.add_argument("--items-per-section", type=int, default=20)
+        parser.add_argument("--options-per-item", type=int, default=2)
+        parser.add_argument("--choices-per-option", type=int, default=3)
+        parser.add_argument("--customers", type=int, default=10000)
+        parser.add_argument("--orders-per-day", type=int, default=10000)
+        parser.add_argument("--days", type=int, default=30)
+        parser.add_argument("--max-lines", type=int, default=4,
+                            help="Most lines in one order")
+        parser.add_argument("--seed", type=int, default=1)
+        parser.add_argument("--chunk-size", type=int, default=5000)
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options["seed"])
+        self.chunk_size = options["chunk_size"]
+
+        payment_methods = list(
+            PaymentMethod.objects.values_list("id", flat=True)
+        ) or [PaymentMethod.objects.create(method="Cash").id]
+
+        addresses, restaurants = self.seed_restaurants(
+            options["cities"], options["restaurants_per_city"]
+        )
+        menus = self.seed_menus(
+            restaurants, options["sections"], options["items_per_section"],
+            options["options_per_item"], options["choices_per_option"]
+        )
+        customers = self.seed_customers(options["customers"], addresses)
+        self.seed_orders(
+            restaurants, menus, customers, payment_methods,
+            options["orders_per_day"], options["days"], options["max_lines"]
+        )
+
+        # sequences still point at the first free id of the old data
+        models = [
+            User, Address, Restaurant, MenuSection, Customer, Item, Option,
+            Choice, Order, OrderItem, OrderItem.choices.through
+        ]
+        with connection.cursor() as cursor:
+            for sql in connection.ops.sequence_reset_sql(no_style(), models):
+                cursor.execute(sql)
+
+        self.refresh_derived(restaurants)
+
+    def refresh_derived(self, restaurant_cities):
+        """
+        bulk_create sends no signals: build the DeliveryZone rows of the
+        new restaurants and move the delivery and listing versions on,
+        as saving them one by one would have
+        """
+        zones = 0
+        if restaurant_cities:
+            # the new ids are contiguous, and too many for an IN ()
+            for restaurant in Restaurant.objects.filter(
+                    id__range=(min(restaurant_cities),
+                               max(restaurant_cities))).exclude(
+                    boundaries="").only("id", "boundaries").iterator():
+                zones += sync_delivery_zones(restaurant)
+        bump_zones_version()
+        bump_areas_version()
+        bump_listing_versions(
+            slugify(city) for city in set(restaurant_cities.values())
+        )
+        self.stdout.write("%10s restaurants with delivery zones" % zones)
+
+    def report(self, writer):
+        self.stdout.write("%10s %s" % (writer.count, writer.model.__name__))
+
+    def seed_restaurants(self, cities, per_city):
+        addresses = Writer(Address, self.chunk_size)
+        restaurants = Writer(Restaurant, self.chunk_size)
+
+        city_addresses = {}
+        restaurant_cities = {}
+        for c in range(cities):
+            city = CITIES[c % len(CITIES)]
+            centre_lat, centre_lng = CITY_CENTRES[c % len(CITIES)]
+            if c >= len(CITIES):
+                city = "%s %s" % (city, c // len(CITIES) + 1)
+                # copies of a city sit a degree further east each time
+                centre_lng += c // len(CITIES)
+            for r in range(per_city):
+                latitude = self.random.gauss(centre_lat, 0.05)
+                longitude = self.random.gauss(centre_lng, 0.07)
+                code = geohash(latitude, longitude, max(GEOHASH_PRECISIONS))
+                geohashes = dict(
+                    ("geohash_%s" % precision, code[:precision])
+                    for precision in GEOHASH_PRECISIONS
+                )
+                # forward sortation area, e.g. "K3B", the restaurant
+                # delivers to its own
+                fsa = "%s%s%s" % (
+                    "KLMNP"[c % 5], self.random.randint(1, 9),
+                    self.random.choice("ABCEG")
+                )
+                address_id = addresses.add(
+                    country="Canada", city=city, city_slug=slugify(city),
+                    postal_code="%s %s" % (
+                        fsa, self.random.randint(100, 999)
+                    ),
+                    street_address="%s Main St" % (r + 1),
+                    latitude=latitude, longitude=longitude, **geohashes
+                )
+                city_addresses.setdefault(city, []).append(address_id)
+
+                name = "%s restaurant %s" % (city, restaurants.next_id)
+                restaurant_id = restaurants.add(
+                    name=name, restaurant_slug=slugify(name), phone="0",
+                    logo="images/restaurants/logo.png",
+                    minimum_delivery_order=self.random.choice((10, 15, 20)),
+                    delivery_fee=self.random.choice((0, 2, 5)),
+                    verified=self.random.random() < 0.9,
+                    available=self.random.random() < 0.8,
+                    boundaries=fsa, address_id=address_id, referral_code=""
+                )
+                restaurant_cities[restaurant_id] = city
+                flush(addresses, restaurants)
+
+        flush(addresses, restaurants, force=True)
+        self.report(addresses)
+        self.report(restaurants)
+        return city_addresses, restaurant_cities
+
+    def seed_menus(self, restaurants, sections, items_per_section,
+                   options_per_item, choices_per_option):
+        """
+        Return {restaurant_id: [(item_id, price_cents, [[(choice_id,
+        extra_cents), ...] per option]), ...]} of the available items
+        """
+        writers = [
+            Writer(model, self.chunk_size)
+            for model in (MenuSection, Item, Option, Choice)
+        ]
+        section_writer, item_writer, option_writer, choice_writer = writers
+
+        menus = {}
+        for restaurant_id in sorted(restaurants):
+            menu = menus[restaurant_id] = []
+            for s in range(sections):
+                section_id = section_writer.add(
+                    restaurant_id=restaurant_id, title="Section %s" % (s + 1),
+                    order=s + 1
+                )
+                for i in range(items_per_section):
+                    price = self.random.randint(5, 30)
+                    available = self.random.random() < 0.95
+                    item_id = item_writer.add(
+                        restaurant_id=restaurant_id,
+                        menu_section_id=section_id, order=i + 1, name="Item %s-%s" % (s + 1, i + 1),
+                        short_description="", image="images/items/item.jpg",
+                        price=price, available=available,
+                        delivery=self.random.random() < 0.7, takeout=True
+                    )
+
+                    item_options = []
+                    for o in range(options_per_item):
+                        option_id = option_writer.add(
+                            item_id=item_id, name="Option %s" % (o + 1),
+                            type=o % 2
+                        )
+                        option_choices = []
+                        for k in range(choices_per_option):
+                            extra_charge = self.random.choice(EXTRA_CHARGES)
+                            option_choices.append((choice_writer.add(
+                                item_id=item_id, option_id=option_id,
+                                name="Choice %s" % (k + 1), default=k == 0,
+                                extra_charge=extra_charge
+                            ), to_cents(extra_charge)))
+                        item_options.append(option_choices)
+
+                    if available:
+                        menu.append((item_id, to_cents(price), item_options))
+                    flush(*writers)
+
+        flush(*writers, force=True)
+        for writer in writers:
+            self.report(writer)
+        return menus
+
+    def seed_customers(self, count, addresses):
+        users = Writer(User, self.chunk_size)
+        customers = Writer(Customer, self.chunk_size)
+        cities = sorted(addresses)
+
+        customer_cities = {}
+        for c in range(count):
+            user_id = users.add(
+                username="seed-customer-%s" % users.next_id,
+                password="!", email=""
+            )
+            city = cities[c % len(cities)]
+            customer_cities.setdefault(city, []).append(customers.add(
+                user_id=user_id, image="images/customers/customer.png",
+                address_id=self.random.choice(addresses[city])
+            ))
+            flush(users, customers)
+
+        flush(users, customers, force=True)
+        self.report(users)
+        self.report(customers)
+        return customer_cities
+
+    def seed_orders(self, restaurants, menus, customers, payment_methods,
+                    per_day, days, max_lines):
+        orders = Writer(Order, self.chunk_size)
+        order_items = Writer(OrderItem, self.chunk_size)
+        choices = Writer(OrderItem.choices.through, self.chunk_size)
+
+        # customers order from restaurants of their own city
+        city_restaurants = {}
+        for restaurant_id, city in sorted(restaurants.items()):
+            if menus[restaurant_id]:
+                city_restaurants.setdefault(city, []).append(restaurant_id)
+        cities = [
+            city for city in sorted(customers) if city in city_restaurants
+        ]
+        if not cities:
+            return
+
+        today = timezone.now().replace(hour=0, minute=0, second=0,
+                                       microsecond=0)
+        with explicit_timestamps(Order):
+            for day in range(days, -1, -1):
+                statuses = TODAY_STATUSES if day == 0 else PAST_STATUSES
+                for n in range(per_day):
+                    city = cities[n % len(cities)]
+                    restaurant_id = self.random.choice(city_restaurants[city])
+                    created_at = today - timedelta(
+                        days=day, seconds=self.random.randint(0, 86399)
+                    )
+                    order_status = self.random.choice(statuses)
+                    order_for = self.random.choice(
+                        (Order.PICKUP, Order.DELIVERY)
+                    )
+                    order_id = orders.next_id
+
+                    sub_total = 0
+                    for _ in range(self.random.randint(1, max_lines)):
+                        item_id, price, item_options = self.random.choice(
+                            menus[restaurant_id]
+                        )
+                        picked = [
+                            self.random.choice(option_choices)
+                            for option_choices in item_options
+                            if option_choices
+                        ]
+                        quantity = self.random.randint(1, 3)
+                        line_total = (
+                            price + sum(extra for _, extra in picked)
+                        ) * quantity
+                        sub_total += line_total
+
+                        order_item_id = order_items.add(
+                            order_id=order_id, item_id=item_id,
+                            quantity=quantity, sub_total=line_total
+                        )
+                        for choice_id, _ in picked:
+                            choices.add(
+                                orderitem_id=order_item_id, choice_id=choice_id
+                            )
+
+                    orders.add(
+                        customer_id=self.random.choice(customers[city]),
+                        restaurant_id=restaurant_id, address="",
+                        sub_total=sub_total,
+                        total=order_total_cents(sub_total),
+                        order_for=order_for, status=order_status,
+                        created_at=created_at,
+                        updated_at=created_at + timedelta(minutes=40),
+                        picked_at=created_at + timedelta(minutes=30)
+                        if order_status == Order.COMPLETED else None,
+                        note="", payment_method_id=self.random.choice(
+                            payment_methods
+                        )
+                    )
+                    flush(orders, order_items, choices)
+
+            flush(orders, order_items, choices, force=True)
+
+        self.report(orders)
+        self.report(order_items)
+        self.report(choices)
@@ -6,6 +6,8 @@ from django.shortcuts import render, redirect, get_object_or_404
 from allauth.account.views import SignupView
 from django.urls import reverse
 from eatplusapp.forms import AddressForm, RestaurantForm
+from eatplusapp.pagination import InvalidPage, paginate_orders_for_request
+from eatplusapp.order_states import advance
 
 @login_required(login_url='/restaurant/sign-in/')
 def restaurant_manager(request):
@@ -64,11 +66,12 @@ def menu(request):
     section = MenuSection.objects.filter(
         restaurant=request.user.manager.restaurant
     ).order_by("order")
-    items = [
-        list(Item.objects.filter(menu_section=c).order_by('order'))
-        for c in section
-    ]
-    items = filter(lambda l: len(l) > 0, items)
+    # one query for the items of every section
+    section_items = {}
+    for item in Item.objects.filter(
+            menu_section__in=section).order_by('order'):
+        section_items.setdefault(item.menu_section_id, []).append(item)
+    items = [section_items[c.id] for c in section if c.id in section_items]
 
     return render(
         request,
@@ -158,35 +161,32 @@ def create_choice(request, option_id):
 @login_required(login_url='/restaurant/sign-in/')
 def restaurant_order(request):
     if request.method == "POST":
-        order = Order.objects.get(
-            id=request.POST["id"], restaurant=request.user.restaurant
+        advance(request.user.manager.restaurant.id, request.POST["id"])
+
+    try:
+        orders, next_cursor = paginate_orders_for_request(
+            Order.objects.filter(
+                restaurant=request.user.manager.restaurant
+            ).exclude(status__lte=2).select_related(
+                "customer__user", "payment_method"
+            ),
+            request.GET
         )
+    except InvalidPage:
+        return redirect('manager_orders')
 
-        if order.status == Order.PLACED:
-            order.status = Order.RECEIVED
-            order.save()
+    # the next page keeps the page size and status filter
+    next_query = None
+    if next_cursor is not None:
+        params = request.GET.copy()
+        params["cursor"] = next_cursor
+        next_query = params.urlencode()
 
-        elif order.status == Order.RECEIVED:
-            order.status = Order.READY
-            order.save()
-
-        elif order.status == Order.READY and order.order_for == 1:
-            order.status = Order.COMPLETED
-            order.save()
-
-        elif order.status == Order.READY and order.order_for == 2:
-            order.status = Order.ONTHEWAY
-            order.save()
-
-        elif order.status == Order.ONTHEWAY and order.order_for == 2:
-            order.status = Order.COMPLETED
-            order.save()
-
-    orders = Order.objects.filter(
-        restaurant=request.user.restaurant
-    ).order_by("-created_at").exclude(status__lte=2)
-
-    return render(request, 'restaurant/order.html', {"orders": orders})
+    return render(
+        request,
+        'manager/order.html',
+        {"orders": orders, "next_query": next_query}
+    )
 
 
 def create_restaurant(request):
@@ -0,0 +1,286 @@
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Prefetch
+from django.http import Http404, JsonResponse, HttpResponseNotModified
+
+from eatplusapp.models import (
+    MenuSection,
+    Item,
+    Option,
+    Choice,
+    PaymentMethod,
+    Restaurant
+)
+from eatplusapp.pricing import from_cents, line_cents, order_total_cents
+from eatplusapp.serializers import (
+    MenuSectionSerializer,
+    ItemSerializer,
+    MenuTreeSectionSerializer
+)
+
+MENU_VERSION_KEY = "menu:version:%s"
+MENU_SNAPSHOT_KEY = "menu:snapshot:%s:%s:%s"
+MENU_CACHE_TIMEOUT = getattr(settings, "MENU_CACHE_TIMEOUT", 60 * 60 * 24)
+
+
+def get_menu_tree_queryset(restaurant_id):
+    """
+    Sections of a restaurant with items, options and choices prefetched.
+
+    Costs four queries whatever the size of the menu.
+    """
+    return MenuSection.objects.filter(
+        restaurant_id=restaurant_id
+    ).order_by("order").prefetch_related(
+        Prefetch("meal_section", queryset=Item.objects.order_by("order")),
+        Prefetch(
+            "meal_section__meal_option",
+            queryset=Option.objects.order_by("id")
+        ),
+        Prefetch(
+            "meal_section__meal_option__option_choice",
+            queryset=Choice.objects.order_by("id")
+        ),
+    )
+
+
+def build_menu_tree(restaurant_id, request=None):
+    """
+    Return sections -> items -> options -> choices as one nested list
+    """
+    return MenuTreeSectionSerializer(
+        get_menu_tree_queryset(restaurant_id),
+        many=True,
+        context={"request": request}
+    ).data
+
+
+def build_menus(restaurant_id, request=None):
+    return MenuSectionSerializer(
+        MenuSection.objects.filter(
+            restaurant_id=restaurant_id).order_by("-id"),
+        many=True
+    ).data
+
+
+def build_meals(restaurant_id, request=None):
+    return ItemSerializer(
+        Item.objects.filter(restaurant_id=restaurant_id).order_by("-id"),
+        many=True,
+        context={"request": request}
+    ).data
+
+
+MENU_BUILDERS = {
+    "menus": build_menus,
+    "meals": build_meals,
+    "tree": build_menu_tree,
+}
+
+
+# MENU CACHE
+def get_menu_version(restaurant_id):
+    """
+    Return the current menu version of a restaurant.
+
+    Versions start from the current time in milliseconds so that they
+    keep growing even if the cache drops the key.
+    """
+    key = MENU_VERSION_KEY % restaurant_id
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, int(time.time() * 1000), None)
+        version = cache.get(key, int(time.time() * 1000))
+    return version
+
+
+def bump_menu_version(restaurant_id):
+    key = MENU_VERSION_KEY % restaurant_id
+    try:
+        return cache.incr(key)
+    except ValueError:
+        version = int(time.time() * 1000)
+        cache.set(key, version, None)
+        return version
+
+
+def get_menu_snapshot(restaurant_id, part, version, request=None):
+    """
+    Return the serialized `part` of a restaurant menu for `version`.
+
+    Image urls are absolute, so snapshots are kept per host.
+    """
+    host = request.get_host() if request is not None else ""
+    key = MENU_SNAPSHOT_KEY % (restaurant_id, part, host)
+    snapshot = cache.get(key)
+    if snapshot is not None and snapshot[0] == version:
+        return snapshot[1]
+
+    data = MENU_BUILDERS[part](restaurant_id, request=request)
+    cache.set(key, (version, data), MENU_CACHE_TIMEOUT)
+    return data
+
+
+def menu_etag(restaurant_id, version):
+    return '"menu-%s-%s"' % (restaurant_id, version)
+
+
+def etag_matches(request, etag):
+    if_none_match = request.META.get("HTTP_IF_NONE_MATCH")
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return etag in [
+        tag.strip().replace("W/", "", 1) for tag in if_none_match.split(",")
+    ]
+
+
+def menu_response(request, restaurant_id, part, key):
+    """
+    Serve `part` of the menu from the cache under `key`.
+
+    Answers 304 when the client already holds the current version, and
+    404 for an unknown restaurant whatever the client holds.
+    """
+    if not Restaurant.objects.filter(id=restaurant_id).exists():
+        raise Http404
+
+    version = get_menu_version(restaurant_id)
+    etag = menu_etag(restaurant_id, version)
+
+    if etag_matches(request, etag):
+        response = HttpResponseNotModified()
+        response["ETag"] = etag
+        return response
+
+    data = get_menu_snapshot(restaurant_id, part, version, request=request)
+    response = JsonResponse({key: data})
+    response["ETag"] = etag
+    return response
+
+
+def get_menu_options(restaurant):
+    """
+    Return {item_id: [option, ...]} for every item of a restaurant.
+
+    Options and choices are plain dicts, loaded with two queries.
+    """
+    options = Option.objects.filter(
+        item__restaurant=restaurant
+    ).order_by("id").prefetch_related(
+        Prefetch("option_choice", queryset=Choice.objects.order_by("id"))
+    )
+
+    item_options = {}
+    for option in options:
+        item_options.setdefault(option.item_id, []).append({
+            "id": option.id,
+            "name": option.name,
+            "type": option.type,
+            "choices": [
+                {
+                    "id": choice.id,
+                    "name": choice.name,
+                    "extra_charge": choice.extra_charge,
+                }
+                for choice in option.option_choice.all()
+            ],
+        })
+    return item_options
+
+
+def get_cart_lines(cart, items, item_options):
+    """
+    Return the lines of a session `cart` as plain dicts with their cost.
+
+    Prices come from the `items` and `item_options` already loaded for
+    the page, so no query runs for the cart. Lines of items that left
+    the menu are skipped.
+    """
+    choices = {}
+    for options in item_options.values():
+        for option in options:
+            for choice in option["choices"]:
+                choices[choice["id"]] = choice
+
+    lines = []
+    for line in cart.lines:
+        item = items.get(line["item_id"])
+        if item is None or not item.available:
+            continue
+
+        chosen = set(line["choices"])
+        unit, cost = line_cents(
+            item.price,
+            [
+                choices[choice_id]["extra_charge"]
+                for choice_id in line["choices"] if choice_id in choices
+            ],
+            line["quantity"]
+        )
+
+        lines.append({
+            "id": line["id"],
+            "item_id": item.id,
+            "name": item.name,
+            "quantity": line["quantity"],
+            "cost": from_cents(cost),
+            "cost_cents": cost,
+            "choices": [
+                choices[choice_id]["name"]
+                for choice_id in line["choices"] if choice_id in choices
+            ],
+            "options": [
+                dict(option, choices=[
+                    dict(choice, selected=choice["id"] in chosen)
+                    for choice in option["choices"]
+                ])
+                for option in item_options.get(item.id, [])
+            ],
+        })
+    return lines
+
+
+def build_menu_page_context(restaurant, cart, delivery=False):
+    """
+    Context of the customer menu page.
+
+    Items, options, choices and payment methods are loaded up front and
+    the cart is read from the session, so rendering costs the same few
+    queries for any menu and cart size and writes nothing.
+    """
+    item_options = get_menu_options(restaurant)
+    items = {
+        item.id: item
+        for item in Item.objects.filter(restaurant=restaurant).order_by("id")
+    }
+
+    menu_items = [
+        {
+            "id": item.id,
+            "name": item.name,
+            "short_description": item.short_description,
+            "image_url": item.image.url if item.image else "",
+            "price": item.price,
+            "options": item_options.get(item.id, []),
+        }
+        for item in items.values()
+        if item.delivery or not delivery
+    ]
+
+    cart_lines = get_cart_lines(cart, items, item_options)
+    sub_total = sum(line["cost_cents"] for line in cart_lines)
+
+    return {
+        "restaurant": restaurant,
+        "cart": cart,
+        "items": menu_items,
+        "cart_lines": cart_lines,
+        "sub_total": from_cents(sub_total),
+        "total": from_cents(order_total_cents(sub_total)),
+        "payment_methods": list(PaymentMethod.objects.all()),
+        "add_for": "delivery" if delivery else "pickup",
+    }
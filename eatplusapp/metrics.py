@@ -0,0 +1,349 @@
+import atexit
+import glob
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from functools import lru_cache, wraps
+
+from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
+from django.core.cache.backends.base import BaseCache
+from django.core.exceptions import MiddlewareNotUsed
+from django.http import HttpResponse
+from django.urls import get_resolver
+
+from eatplusapp.dbhooks import execute_wrapper
+
+METRICS_ENABLED = getattr(settings, "METRICS_ENABLED", False)
+# Every worker writes its metrics here, the endpoint adds them up
+METRICS_DIR = getattr(
+    settings, "METRICS_DIR",
+    os.path.join(tempfile.gettempdir(), "eatplus-metrics")
+)
+METRICS_FLUSH_INTERVAL = getattr(settings, "METRICS_FLUSH_INTERVAL", 5)
+
+LATENCY_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10
+)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+# name: (type, help, buckets)
+METRICS = {
+    "http_requests_total": (
+        "counter", "Requests served, by route, method and status class",
+        None
+    ),
+    "http_request_duration_seconds": (
+        "histogram", "Request latency, by route and method", LATENCY_BUCKETS
+    ),
+    "db_queries_total": ("counter", "SQL queries run, by route", None),
+    "db_queries_per_request": (
+        "histogram", "SQL queries of one request, by route", QUERY_BUCKETS
+    ),
+    "cache_hits_total": ("counter", "Cache reads that found a value", None),
+    "cache_misses_total": ("counter", "Cache reads that found nothing", None),
+}
+
+
+class Registry(object):
+    """
+    Counters and fixed-bucket histograms of this process.
+
+    Values are kept per process id, so a worker forked from a process
+    that already counted something starts from zero.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.pid = os.getpid()
+        self.values = {}
+        self.flushed_at = time.time()
+
+    def _key(self, name, labels):
+        if os.getpid() != self.pid:
+            self.reset()
+        return name, tuple(sorted(labels.items()))
+
+    def inc(self, name, labels, amount=1):
+        with self.lock:
+            key = self._key(name, labels)
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def observe(self, name, labels, value):
+        buckets = METRICS[name][2]
+        with self.lock:
+            key = self._key(name, labels)
+            histogram = self.values.get(key)
+            if histogram is None:
+                histogram = self.values[key] = {
+                    "buckets": [0] * len(buckets), "sum": 0, "count": 0
+                }
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    histogram["buckets"][i] += 1
+                    break
+            histogram["sum"] += value
+            histogram["count"] += 1
+
+    def dump(self):
+        with self.lock:
+            return [
+                [name, dict(labels), value]
+                for (name, labels), value in self.values.items()
+            ]
+
+    def flush(self, force=False):
+        """
+        Write this worker's values to METRICS_DIR, at most once per
+        METRICS_FLUSH_INTERVAL unless `force`
+        """
+        now = time.time()
+        if not force and now - self.flushed_at < METRICS_FLUSH_INTERVAL:
+            return
+        self.flushed_at = now
+        if not self.values:
+            return
+
+        os.makedirs(METRICS_DIR, exist_ok=True)
+        path = os.path.join(METRICS_DIR, "worker-%s.json" % self.pid)
+        temporary = "%s.tmp" % path
+        with open(temporary, "w") as output:
+            json.dump(self.dump(), output)
+        os.replace(temporary, path)
+
+
+registry = Registry()
+
+
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def collect():
+    """
+    Add up the values written by every worker, this one included.
+
+    Files of workers that exited are removed, so their counts drop out
+    and the counters restart from the live workers, which Prometheus
+    rate() reads as a counter reset. A new worker that reuses the pid of
+    a dead one overwrites its file, with the same effect.
+    """
+    registry.flush(force=True)
+
+    values = {}
+    for path in glob.glob(os.path.join(METRICS_DIR, "worker-*.json")):
+        pid = re.search(r"worker-(\d+)\.json$", path)
+        if pid and not pid_alive(int(pid.group(1))):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            continue
+        try:
+            with open(path) as source:
+                rows = json.load(source)
+        except (OSError, ValueError):
+            continue
+
+        for name, labels, value in rows:
+            if name not in METRICS:
+                continue
+            key = name, tuple(sorted(labels.items()))
+            if isinstance(value, dict):
+                total = values.setdefault(key, {
+                    "buckets": [0] * len(value["buckets"]),
+                    "sum": 0, "count": 0
+                })
+                for i, count in enumerate(value["buckets"]):
+                    total["buckets"][i] += count
+                total["sum"] += value["sum"]
+                total["count"] += value["count"]
+            else:
+                values[key] = values.get(key, 0) + value
+    return values
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    return "{%s}" % ",".join(
+        '%s="%s"' % (name, str(value).replace("\\", "\\\\").replace(
+            '"', '\\"').replace("\n", "\\n"))
+        for name, value in labels
+    )
+
+
+def render_prometheus(values):
+    lines = []
+    for name in sorted(METRICS):
+        kind, help_text, buckets = METRICS[name]
+        lines.append("# HELP %s %s" % (name, help_text))
+        lines.append("# TYPE %s %s" % (name, kind))
+        for (metric, labels), value in sorted(values.items()):
+            if metric != name:
+                continue
+            if kind == "counter":
+                lines.append("%s%s %s" % (name, format_labels(labels), value))
+                continue
+
+            cumulative = 0
+            for bound, count in zip(buckets, value["buckets"]):
+                cumulative += count
+                lines.append("%s_bucket%s %s" % (
+                    name, format_labels(labels + (("le", bound), )),
+                    cumulative
+                ))
+            lines.append("%s_bucket%s %s" % (
+                name, format_labels(labels + (("le", "+Inf"), )),
+                value["count"]
+            ))
+            lines.append("%s_sum%s %s" % (
+                name, format_labels(labels), value["sum"]
+            ))
+            lines.append("%s_count%s %s" % (
+                name, format_labels(labels), value["count"]
+            ))
+
+    # derived from the counters of every worker
+    hits = sum(v for (n, _), v in values.items() if n == "cache_hits_total")
+    misses = sum(
+        v for (n, _), v in values.items() if n == "cache_misses_total"
+    )
+    lines.append("# HELP cache_hit_ratio Share of cache reads that hit")
+    lines.append("# TYPE cache_hit_ratio gauge")
+    lines.append("cache_hit_ratio %s" % (
+        round(hits / float(hits + misses), 4) if hits + misses else 0
+    ))
+    return "\n".join(lines) + "\n"
+
+
+@staff_member_required
+def metrics_view(request):
+    """
+    Metrics of all workers in the Prometheus text format, staff only
+    """
+    return HttpResponse(
+        render_prometheus(collect()),
+        content_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+
+# ROUTES
+def route_pattern(patterns, path, prefix=""):
+    for pattern in patterns:
+        match = pattern.regex.search(path)
+        if not match:
+            continue
+        route = prefix + pattern.regex.pattern.lstrip("^").rstrip("$")
+        if hasattr(pattern, "url_patterns"):
+            found = route_pattern(
+                pattern.url_patterns, path[match.end():], route
+            )
+            if found:
+                return found
+        else:
+            return route
+
+
+@lru_cache(maxsize=4096)
+def route_of(path):
+    """
+    The URL pattern serving `path`, e.g. "api/v1/customer/orders/" or
+    "<restaurant_slug>/pickup-menu/"
+    """
+    route = route_pattern(get_resolver().url_patterns, path.lstrip("/"))
+    if route is None:
+        return "unmatched"
+    return re.sub(r"\(\?P<(\w+)>[^)]*\)", r"<\1>", route)
+
+
+# CACHE
+_missing = object()
+
+
+def count_cache_reads(cache_class):
+    """
+    Count hits and misses of get() and get_many() of a cache backend
+    """
+    if getattr(cache_class, "_metrics_counted", False):
+        return
+    cache_class._metrics_counted = True
+    get, get_many = cache_class.get, cache_class.get_many
+    # the default get_many() reads through get(), don't count twice
+    own_get_many = get_many is not BaseCache.get_many
+
+    @wraps(get)
+    def counted_get(self, key, default=None, version=None, **kwargs):
+        # locmem's incr() reads through get(acquire_lock=False)
+        value = get(self, key, _missing, version=version, **kwargs)
+        if value is _missing:
+            registry.inc("cache_misses_total", {})
+            return default
+        registry.inc("cache_hits_total", {})
+        return value
+
+    @wraps(get_many)
+    def counted_get_many(self, keys, version=None):
+        keys = list(keys)
+        found = get_many(self, keys, version=version)
+        registry.inc("cache_hits_total", {}, len(found))
+        registry.inc("cache_misses_total", {}, len(keys) - len(found))
+        return found
+
+    cache_class.get = counted_get
+    if own_get_many:
+        cache_class.get_many = counted_get_many
+
+
+class MetricsMiddleware(object):
+    """
+    Count requests, their latency and SQL queries per URL pattern
+    """
+
+    def __init__(self, get_response):
+        if not METRICS_ENABLED:
+            raise MiddlewareNotUsed
+        from django.core.cache import caches
+        for alias in settings.CACHES:
+            count_cache_reads(type(caches[alias]))
+        atexit.register(registry.flush, force=True)
+        self.get_response = get_response
+
+    def __call__(self, request):
+        queries = [0]
+
+        def count_query(execute, sql, params, many, context):
+            queries[0] += 1
+            return execute(sql, params, many, context)
+
+        started = time.perf_counter()
+        with execute_wrapper(count_query):
+            response = self.get_response(request)
+        elapsed = time.perf_counter() - started
+
+        route = route_of(request.path_info)
+        registry.inc("http_requests_total", {
+            "route": route, "method": request.method,
+            "status": "%sxx" % (response.status_code // 100)
+        })
+        registry.observe("http_request_duration_seconds", {
+            "route": route, "method": request.method
+        }, elapsed)
+        registry.inc("db_queries_total", {"route": route}, queries[0])
+        registry.observe(
+            "db_queries_per_request", {"route": route}, queries[0]
+        )
+        registry.flush()
+        return response
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def totals_to_cents(apps, schema_editor):
+    Order = apps.get_model('eatplusapp', 'Order')
+    OrderItem = apps.get_model('eatplusapp', 'OrderItem')
+    Order.objects.update(sub_total=F('sub_total') * 100, total=F('total') * 100)
+    OrderItem.objects.update(sub_total=F('sub_total') * 100)
+
+
+def totals_to_units(apps, schema_editor):
+    Order = apps.get_model('eatplusapp', 'Order')
+    OrderItem = apps.get_model('eatplusapp', 'OrderItem')
+    Order.objects.update(sub_total=F('sub_total') / 100, total=F('total') / 100)
+    OrderItem.objects.update(sub_total=F('sub_total') / 100)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('eatplusapp', '0011_order_updated_at'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='orderitem',
+            name='sub_total',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(totals_to_cents, totals_to_units),
+    ]
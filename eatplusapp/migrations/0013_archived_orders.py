@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('eatplusapp', '0012_order_totals_in_cents'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedOrder',
+            fields=[
+                ('id', models.IntegerField(primary_key=True, serialize=False)),
+                ('address', models.CharField(blank=True, max_length=500)),
+                ('total', models.IntegerField(default=0)),
+                ('sub_total', models.IntegerField(default=0)),
+                ('order_for', models.IntegerField(blank=True, choices=[(1, 'Pick up'), (2, 'Delivery')], null=True)),
+                ('status', models.IntegerField(choices=[(1, 'Open'), (2, 'Placed'), (3, 'Received'), (4, 'Ready'), (5, 'On the way'), (6, 'Completed'), (7, 'Cancelled')])),
+                ('created_at', models.DateTimeField()),
+                ('updated_at', models.DateTimeField()),
+                ('picked_at', models.DateTimeField(blank=True, null=True)),
+                ('note', models.CharField(blank=True, max_length=1000)),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+                ('customer', models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='eatplusapp.Customer')),
+                ('payment_method', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='eatplusapp.PaymentMethod')),
+                ('restaurant', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='eatplusapp.Restaurant')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ArchivedOrderItem',
+            fields=[
+                ('id', models.IntegerField(primary_key=True, serialize=False)),
+                ('quantity', models.DecimalField(decimal_places=2, default=0, max_digits=10)),
+                ('sub_total', models.IntegerField(default=0)),
+                ('choices', models.ManyToManyField(blank=True, db_constraint=False, related_name='_archivedorderitem_choices_+', to='eatplusapp.Choice')),
+                ('item', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='eatplusapp.Item')),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='order_orderitem', to='eatplusapp.ArchivedOrder')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='archivedorder',
+            index=models.Index(fields=['restaurant', 'created_at', 'id'], name='archived_restaurant_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='archivedorder',
+            index=models.Index(fields=['customer', 'created_at', 'id'], name='archived_customer_idx'),
+        ),
+    ]
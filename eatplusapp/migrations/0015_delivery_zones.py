@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import re
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def boundaries_to_zones(apps, schema_editor):
+    Restaurant = apps.get_model('eatplusapp', 'Restaurant')
+    DeliveryZone = apps.get_model('eatplusapp', 'DeliveryZone')
+    prefix_re = re.compile(r"(?<![A-Z0-9])[A-Z]\d[A-Z]")
+
+    zones = []
+    for restaurant_id, boundaries in Restaurant.objects.exclude(
+            boundaries='').values_list('id', 'boundaries').iterator():
+        for prefix in sorted(set(prefix_re.findall(boundaries.upper()))):
+            zones.append(DeliveryZone(
+                restaurant_id=restaurant_id, postal_prefix=prefix
+            ))
+    DeliveryZone.objects.bulk_create(zones, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('eatplusapp', '0014_hot_query_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DeliveryZone',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('postal_prefix', models.CharField(max_length=3)),
+                ('restaurant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='delivery_zones', to='eatplusapp.Restaurant')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='deliveryzone',
+            unique_together=set([('restaurant', 'postal_prefix')]),
+        ),
+        migrations.AddIndex(
+            model_name='deliveryzone',
+            index=models.Index(fields=['postal_prefix', 'restaurant'], name='delivery_zone_prefix_idx'),
+        ),
+        migrations.RunPython(boundaries_to_zones, migrations.RunPython.noop),
+    ]
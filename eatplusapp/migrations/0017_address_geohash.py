@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+GEOHASH_ALPHABET = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+
+def geohash(latitude, longitude, precision):
+    lat_range = [-90.0, 90.0]
+    lng_range = [-180.0, 180.0]
+    chars = []
+    bits = value = 0
+    even = True
+    while len(chars) < precision:
+        bounds, coordinate = (
+            (lng_range, longitude) if even else (lat_range, latitude)
+        )
+        middle = (bounds[0] + bounds[1]) / 2
+        value <<= 1
+        if coordinate >= middle:
+            value |= 1
+            bounds[0] = middle
+        else:
+            bounds[1] = middle
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(GEOHASH_ALPHABET[value])
+            bits = value = 0
+    return "".join(chars)
+
+
+def fill_geohashes(apps, schema_editor):
+    Address = apps.get_model('eatplusapp', 'Address')
+    for address in Address.objects.filter(
+            latitude__isnull=False, longitude__isnull=False).iterator():
+        code = geohash(address.latitude, address.longitude, 6)
+        Address.objects.filter(id=address.id).update(
+            geohash_4=code[:4], geohash_5=code[:5], geohash_6=code
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('eatplusapp', '0016_delivery_areas'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='address',
+            name='geohash_4',
+            field=models.CharField(blank=True, max_length=4, null=True),
+        ),
+        migrations.AddField(
+            model_name='address',
+            name='geohash_5',
+            field=models.CharField(blank=True, max_length=5, null=True),
+        ),
+        migrations.AddField(
+            model_name='address',
+            name='geohash_6',
+            field=models.CharField(blank=True, max_length=6, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='address',
+            index=models.Index(fields=['geohash_4'], name='address_geohash_4_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='address',
+            index=models.Index(fields=['geohash_5'], name='address_geohash_5_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='address',
+            index=models.Index(fields=['geohash_6'], name='address_geohash_6_idx'),
+        ),
+        migrations.RunPython(fill_geohashes, migrations.RunPython.noop),
+    ]
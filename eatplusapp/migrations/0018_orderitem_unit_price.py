@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.db import migrations, models
+
+
+def fill_unit_prices(apps, schema_editor):
+    OrderItem = apps.get_model('eatplusapp', 'OrderItem')
+    for order_item in OrderItem.objects.select_related('item').iterator():
+        unit = Decimal(order_item.item.price) + sum(
+            choice.extra_charge for choice in order_item.choices.all()
+        )
+        OrderItem.objects.filter(id=order_item.id).update(unit_price=int(
+            (unit * 100).quantize(Decimal('1'), rounding=ROUND_HALF_UP)
+        ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('eatplusapp', '0017_address_geohash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='orderitem',
+            name='unit_price',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(fill_unit_prices, migrations.RunPython.noop),
+    ]
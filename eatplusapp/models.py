@@ -3,6 +3,12 @@ from django.contrib.auth.models import User
 from django.core.validators import MinValueValidator, MaxValueValidator
 from django.template.defaultfilters import slugify
 
+from eatplusapp.geo import geohash
+
+# precisions of the geohash prefix columns of Address, about 20km,
+# 5km and 600m tall cells
+GEOHASH_PRECISIONS = (4, 5, 6)
+
 
 # Create your models here.
 class Address(models.Model):
@@ -12,16 +18,38 @@ class Address(models.Model):
     city_slug = models.CharField(max_length=100, blank=True, null=True)
     postal_code = models.CharField(max_length=100, blank=True, null=True)
     street_address = models.CharField(max_length=200, blank=True, null=True)
+    latitude = models.FloatField(blank=True, null=True)
+    longitude = models.FloatField(blank=True, null=True)
+    # prefixes of the geohash of (latitude, longitude)
+    geohash_4 = models.CharField(max_length=4, blank=True, null=True)
+    geohash_5 = models.CharField(max_length=5, blank=True, null=True)
+    geohash_6 = models.CharField(max_length=6, blank=True, null=True)
 
     class Meta:
         verbose_name = 'Address'
         verbose_name_plural = 'Address'
+        indexes = [
+            models.Index(fields=['city_slug'], name='address_city_slug_idx'),
+            models.Index(fields=['geohash_4'], name='address_geohash_4_idx'),
+            models.Index(fields=['geohash_5'], name='address_geohash_5_idx'),
+            models.Index(fields=['geohash_6'], name='address_geohash_6_idx'),
+        ]
 
     def __str__(self):
         return self.country
 
     def save(self, *args, **kwargs):
         self.city_slug = slugify(self.city)
+        if self.latitude is None or self.longitude is None:
+            code = ""
+        else:
+            code = geohash(
+                self.latitude, self.longitude, max(GEOHASH_PRECISIONS)
+            )
+        for precision in GEOHASH_PRECISIONS:
+            setattr(
+                self, "geohash_%s" % precision, code[:precision] or None
+            )
         super(Address, self).save(*args, **kwargs)
 
 
@@ -54,9 +82,20 @@ class Restaurant(models.Model):
     verified = models.BooleanField(default=False)
     available = models.BooleanField(default=False)
     boundaries = models.TextField(blank=True)
+    # JSON polygons [[lng, lat], ...], see eatplusapp.geo.parse_area
+    delivery_area = models.TextField(blank=True)
     address = models.ForeignKey(Address, related_name='address_restaurant')
     referral_code = models.CharField(max_length=10)
 
+    class Meta:
+        indexes = [
+            # listings only show verified, available restaurants
+            models.Index(
+                fields=['verified', 'available'],
+                name='restaurant_listed_idx'
+            ),
+        ]
+
     def __str__(self):
         return self.name
 
@@ -65,6 +104,27 @@ class Restaurant(models.Model):
         super(Restaurant, self).save(*args, **kwargs)
 
 
+# One row per postal prefix listed in Restaurant.boundaries, kept in
+# sync by eatplusapp.signals
+class DeliveryZone(models.Model):
+    restaurant = models.ForeignKey(
+        Restaurant, on_delete=models.CASCADE, related_name='delivery_zones'
+    )
+    postal_prefix = models.CharField(max_length=3)
+
+    class Meta:
+        unique_together = ('restaurant', 'postal_prefix')
+        indexes = [
+            models.Index(
+                fields=['postal_prefix', 'restaurant'],
+                name='delivery_zone_prefix_idx'
+            ),
+        ]
+
+    def __str__(self):
+        return self.postal_prefix
+
+
 class MenuSection(models.Model):
     restaurant = models.ForeignKey(Restaurant, related_name="restaurant_menu")
     title = models.CharField(max_length=250)
@@ -124,6 +184,12 @@ class Item(models.Model):
 
     class Meta:
         unique_together = ('menu_section', 'order')
+        indexes = [
+            models.Index(
+                fields=['restaurant', 'available', 'delivery'],
+                name='item_restaurant_available_idx'
+            ),
+        ]
 
 
 class Option(models.Model):
@@ -188,6 +254,7 @@ class Order(models.Model):
     )
     status = models.IntegerField(choices=STATUS_CHOICES, default=PLACED)
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
     picked_at = models.DateTimeField(blank=True, null=True)
     note = models.CharField(max_length=1000, blank=True)
     payment_method = models.ForeignKey(
@@ -196,17 +263,43 @@ class Order(models.Model):
         default=1
     )
 
+    class Meta:
+        indexes = [
+            # keyset pagination of restaurant orders
+            models.Index(
+                fields=['restaurant', 'created_at', 'id'],
+                name='order_restaurant_created_idx'
+            ),
+            # changed-since feed of restaurant orders
+            models.Index(
+                fields=['restaurant', 'updated_at', 'id'],
+                name='order_restaurant_updated_idx'
+            ),
+            # status filtered restaurant orders and kitchen screens
+            models.Index(
+                fields=['restaurant', 'status', 'created_at'],
+                name='order_restaurant_status_idx'
+            ),
+            # open cart / last order of a customer
+            models.Index(
+                fields=['customer', 'status'],
+                name='order_customer_status_idx'
+            ),
+        ]
+
     def __str__(self):
         return 'Order {}'.format(self.id)
 
+    # sub_total and total are integer cents, kept up to date by
+    # eatplusapp.pricing whenever a line changes
     def get_sub_total(self):
-        sub_total = sum(item.get_cost() for item in self.order_orderitem.all())
-        return sub_total
+        from eatplusapp.pricing import from_cents
+        return from_cents(self.sub_total)
 
 # todo: make list of taxes
     def get_total_cost(self):
-        total = self.get_sub_total() / 100 * 13
-        return total
+        from eatplusapp.pricing import from_cents
+        return from_cents(self.total)
 
 
 class OrderItem(models.Model):
@@ -218,16 +311,81 @@ class OrderItem(models.Model):
         blank=True
     )
     quantity = models.DecimalField(max_digits=10, decimal_places=2, default=0)
-    sub_total = models.IntegerField(default=1)
+    # cents of one unit, choices included, so quantity changes don't
+    # price the line again
+    unit_price = models.IntegerField(default=0)
+    sub_total = models.IntegerField(default=0)
 
     def __str__(self):
         return str(self.id)
 
     def get_cost(self):
-        cost = sum(
-            [self.item.price] + [
-                choices.extra_charge for choices in self.choices.all()
-            ]
-        ) * self.quantity
+        from eatplusapp.pricing import from_cents
+        return from_cents(self.sub_total)
+
+
+# Archive tier: finished orders are moved here by
+# `manage.py archive_orders`, keeping their ids. References to the hot
+# tables are not enforced, so menus and customers can change freely.
+class ArchivedOrder(models.Model):
+    id = models.IntegerField(primary_key=True)
+    customer = models.ForeignKey(
+        Customer, related_name='+', null=True, blank=True,
+        on_delete=models.DO_NOTHING, db_constraint=False
+    )
+    restaurant = models.ForeignKey(
+        Restaurant, related_name='+',
+        on_delete=models.DO_NOTHING, db_constraint=False
+    )
+    address = models.CharField(max_length=500, blank=True)
+    total = models.IntegerField(default=0)
+    sub_total = models.IntegerField(default=0)
+    order_for = models.IntegerField(
+        choices=Order.ORDER_CHOICES,
+        blank=True, null=True
+    )
+    status = models.IntegerField(choices=Order.STATUS_CHOICES)
+    created_at = models.DateTimeField()
+    updated_at = models.DateTimeField()
+    picked_at = models.DateTimeField(blank=True, null=True)
+    note = models.CharField(max_length=1000, blank=True)
+    payment_method = models.ForeignKey(
+        PaymentMethod, related_name='+',
+        on_delete=models.DO_NOTHING, db_constraint=False
+    )
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['restaurant', 'created_at', 'id'],
+                name='archived_restaurant_idx'
+            ),
+            models.Index(
+                fields=['customer', 'created_at', 'id'],
+                name='archived_customer_idx'
+            ),
+        ]
+
+    def __str__(self):
+        return 'Order {}'.format(self.id)
 
-        return round(cost, 2)
+
+class ArchivedOrderItem(models.Model):
+    id = models.IntegerField(primary_key=True)
+    order = models.ForeignKey(ArchivedOrder, related_name='order_orderitem')
+    item = models.ForeignKey(
+        Item, related_name='+',
+        on_delete=models.DO_NOTHING, db_constraint=False
+    )
+    choices = models.ManyToManyField(
+        Choice,
+        related_name='+',
+        blank=True,
+        db_constraint=False
+    )
+    quantity = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    sub_total = models.IntegerField(default=0)
+
+    def __str__(self):
+        return str(self.id)
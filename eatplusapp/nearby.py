@@ -0,0 +1,131 @@
+import math
+
+from django.conf import settings
+
+from eatplusapp.geo import (
+    geohash_block,
+    geohash_cell_size,
+    rank_by_distance
+)
+from eatplusapp.models import GEOHASH_PRECISIONS, Restaurant
+
+NEARBY_RADIUS_KM = getattr(settings, "NEARBY_RADIUS_KM", 5)
+NEARBY_MAX_RADIUS_KM = getattr(settings, "NEARBY_MAX_RADIUS_KM", 15)
+NEARBY_LIMIT = getattr(settings, "NEARBY_LIMIT", 50)
+
+KM_PER_DEGREE = 111.2
+
+
+def parse_point(params):
+    """
+    Return (lat, lng) of query params, None when they have neither.
+    Raise ValueError when they aren't a valid point.
+    """
+    lat, lng = params.get("lat"), params.get("lng")
+    if lat is None and lng is None:
+        return None
+    try:
+        lat, lng = float(lat), float(lng)
+    except (TypeError, ValueError):
+        raise ValueError("lat and lng must both be numbers")
+    # float() accepts "inf", "nan" and overflows like "1e400"
+    if not (math.isfinite(lat) and math.isfinite(lng)):
+        raise ValueError("lat and lng must be finite")
+    if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+        raise ValueError("lat and lng are out of range")
+    return lat, lng
+
+
+def parse_radius(value):
+    """
+    Return the radius in km of a query param, NEARBY_RADIUS_KM when
+    missing and at most NEARBY_MAX_RADIUS_KM
+    """
+    if value is None:
+        return NEARBY_RADIUS_KM
+    try:
+        radius = float(value)
+    except ValueError:
+        raise ValueError("radius must be a number")
+    if radius <= 0:
+        raise ValueError("radius must be positive")
+    return min(radius, NEARBY_MAX_RADIUS_KM)
+
+
+def search_precision(latitude, radius_km):
+    """
+    Finest geohash precision whose cells are at least `radius_km` on
+    each side at `latitude`, so the block of 3x3 cells around a point
+    holds the whole circle. None when even the coarsest is too small.
+    """
+    for precision in sorted(GEOHASH_PRECISIONS, reverse=True):
+        lat_size, lng_size = geohash_cell_size(precision)
+        height = lat_size * KM_PER_DEGREE
+        width = lng_size * KM_PER_DEGREE * math.cos(math.radians(latitude))
+        if min(height, width) >= radius_km:
+            return precision
+    return None
+
+
+def candidates(latitude, longitude, radius_km):
+    """
+    Listed restaurants around a point, a superset of those within
+    `radius_km`, found through the geohash prefix indexes
+    """
+    listed = Restaurant.objects.filter(verified=True, available=True)
+    precision = search_precision(latitude, radius_km)
+    if precision is not None:
+        return listed.filter(**{
+            "address__geohash_%s__in" % precision: sorted(
+                geohash_block(latitude, longitude, precision)
+            )
+        })
+
+    # too close to a pole for the cells, use a bounding box
+    d_lat = radius_km / KM_PER_DEGREE
+    d_lng = d_lat / max(math.cos(math.radians(latitude)), 0.01)
+    return listed.filter(
+        address__latitude__range=(latitude - d_lat, latitude + d_lat),
+        address__longitude__range=(longitude - d_lng, longitude + d_lng)
+    )
+
+
+def rank_restaurants(latitude, longitude, radius_km=None, limit=None):
+    """
+    Return [((restaurant_id, city_slug), km), ...] of the listed
+    restaurants within `radius_km` of a point, nearest first
+    """
+    if radius_km is None:
+        radius_km = NEARBY_RADIUS_KM
+    rows = [
+        ((restaurant_id, city_slug), lat, lng)
+        for restaurant_id, city_slug, lat, lng in candidates(
+            latitude, longitude, radius_km
+        ).values_list(
+            "id", "address__city_slug", "address__latitude",
+            "address__longitude"
+        )
+    ]
+    return rank_by_distance(
+        latitude, longitude, rows, radius_km, limit or NEARBY_LIMIT
+    )
+
+
+def nearest_restaurants(latitude, longitude, radius_km=None, limit=None):
+    """
+    Return the listed restaurants within `radius_km` of a point,
+    nearest first, each with a `distance_km` attribute
+    """
+    ranked = rank_restaurants(latitude, longitude, radius_km, limit)
+    if not ranked:
+        return []
+
+    restaurants = Restaurant.objects.in_bulk(
+        [restaurant_id for (restaurant_id, _), _ in ranked]
+    )
+    nearest = []
+    for (restaurant_id, _), distance in ranked:
+        restaurant = restaurants[restaurant_id]
+        restaurant.distance_km = round(distance, 2)
+        nearest.append(restaurant)
+    return nearest
@@ -0,0 +1,105 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.db.models import Prefetch
+
+from eatplusapp.models import Option, Choice
+
+OPTION_SCHEMA_KEY = "option-schema:%s"
+OPTION_SCHEMA_TIMEOUT = getattr(settings, "MENU_CACHE_TIMEOUT", 60 * 60 * 24)
+
+RADIO = 0
+SELECT = 1
+
+
+def compile_option_schema(item_id):
+    """
+    Compile the options of an item into a plain schema:
+
+        {
+            "options": [
+                {
+                    "id": int,
+                    "name": string,
+                    "widget": "radio" | "select",
+                    "required": bool,
+                    "choices": [
+                        {"id": int, "name": string, "extra_charge": decimal},
+                        ...
+                    ]
+                },
+                ...
+            ],
+            "choice_options": {choice_id: option_id, ...},
+            "extra_charges": {choice_id: decimal, ...}
+        }
+    """
+    options = Option.objects.filter(item_id=item_id).order_by(
+        "id"
+    ).prefetch_related(
+        Prefetch("option_choice", queryset=Choice.objects.order_by("id"))
+    )
+
+    schema = {"options": [], "choice_options": {}, "extra_charges": {}}
+    for option in options:
+        choices = []
+        for choice in option.option_choice.all():
+            choices.append({
+                "id": choice.id,
+                "name": choice.name,
+                "extra_charge": choice.extra_charge,
+            })
+            schema["choice_options"][choice.id] = option.id
+            schema["extra_charges"][choice.id] = choice.extra_charge
+
+        schema["options"].append({
+            "id": option.id,
+            "name": option.name,
+            "widget": "radio" if option.type == RADIO else "select",
+            "required": option.type == RADIO,
+            "choices": choices,
+        })
+    return schema
+
+
+def get_option_schema(item_id):
+    key = OPTION_SCHEMA_KEY % item_id
+    schema = cache.get(key)
+    if schema is None:
+        schema = compile_option_schema(item_id)
+        cache.set(key, schema, OPTION_SCHEMA_TIMEOUT)
+    return schema
+
+
+def invalidate_option_schema(item_id):
+    cache.delete(OPTION_SCHEMA_KEY % item_id)
+
+
+def validate_choices(schema, choice_ids):
+    """
+    Check submitted choice ids against an item schema.
+
+    Every choice must belong to the item and each radio option takes
+    exactly one choice. Returns the ids as a list of ints.
+    """
+    try:
+        choice_ids = [int(choice_id) for choice_id in choice_ids]
+    except (TypeError, ValueError):
+        raise ValidationError("Choices must be ids.")
+
+    picked = {}
+    for choice_id in choice_ids:
+        option_id = schema["choice_options"].get(choice_id)
+        if option_id is None:
+            raise ValidationError(
+                "Choice %s is not available for this item." % choice_id)
+        picked[option_id] = picked.get(option_id, 0) + 1
+
+    for option in schema["options"]:
+        if option["widget"] != "radio":
+            continue
+        if picked.get(option["id"], 0) != 1:
+            raise ValidationError(
+                "Pick one choice for %s." % option["name"])
+
+    return choice_ids
@@ -0,0 +1,157 @@
+from collections import namedtuple
+
+from django.db import transaction
+from django.utils import timezone
+
+from eatplusapp.models import Order
+from eatplusapp.pubsub import publish_order_event
+
+# (from, to) -> order_for the transition is limited to, None for any
+TRANSITIONS = {
+    (Order.PLACED, Order.RECEIVED): None,
+    (Order.RECEIVED, Order.READY): None,
+    (Order.READY, Order.COMPLETED): Order.PICKUP,
+    (Order.READY, Order.ONTHEWAY): Order.DELIVERY,
+    (Order.ONTHEWAY, Order.COMPLETED): Order.DELIVERY,
+    (Order.PLACED, Order.CANCELLED): None,
+    (Order.RECEIVED, Order.CANCELLED): None,
+    (Order.READY, Order.CANCELLED): None,
+}
+
+# next step of the kitchen workflow, by (status, order_for)
+NEXT_STATUS = {
+    (Order.PLACED, Order.PICKUP): Order.RECEIVED,
+    (Order.PLACED, Order.DELIVERY): Order.RECEIVED,
+    (Order.RECEIVED, Order.PICKUP): Order.READY,
+    (Order.RECEIVED, Order.DELIVERY): Order.READY,
+    (Order.READY, Order.PICKUP): Order.COMPLETED,
+    (Order.READY, Order.DELIVERY): Order.ONTHEWAY,
+    (Order.ONTHEWAY, Order.DELIVERY): Order.COMPLETED,
+}
+
+Transition = namedtuple("Transition", "updated conflicts")
+
+
+class InvalidTransition(ValueError):
+    pass
+
+
+def check_transition(from_status, to_status):
+    """
+    Return the order_for a transition is limited to, None for any.
+    Raises InvalidTransition if the state machine doesn't allow it.
+    """
+    if (from_status, to_status) not in TRANSITIONS:
+        raise InvalidTransition(
+            "Can't move an order from %s to %s." % (
+                dict(Order.STATUS_CHOICES).get(from_status, from_status),
+                dict(Order.STATUS_CHOICES).get(to_status, to_status)
+            )
+        )
+    return TRANSITIONS[(from_status, to_status)]
+
+
+def bulk_transition(restaurant_id, order_ids, from_status, to_status):
+    """
+    Move orders of a restaurant from `from_status` to `to_status`.
+
+    The orders still in `from_status` are locked and moved in one
+    transaction, a SELECT ... FOR UPDATE and an UPDATE whatever the
+    number of orders. The others, or those whose order_for doesn't allow
+    the move, are returned as conflicts.
+    """
+    order_for = check_transition(from_status, to_status)
+    return _move_orders(
+        restaurant_id, order_ids, from_status, to_status, order_for
+    )
+
+
+def check_out(order):
+    """
+    Send a web cart, an open order, to the kitchen. Returns True on
+    success, False if it isn't open anymore.
+
+    Kept out of TRANSITIONS: kitchens can't receive an open cart.
+    """
+    result = _move_orders(
+        order.restaurant_id, [order.id], Order.OPEN, Order.RECEIVED,
+        event="created"
+    )
+    if not result.updated:
+        return False
+    order.status = Order.RECEIVED
+    return True
+
+
+def _move_orders(restaurant_id, order_ids, from_status, to_status,
+                 order_for=None, event="updated"):
+    order_ids = sorted(set(int(order_id) for order_id in order_ids))
+    if not order_ids:
+        return Transition([], [])
+
+    now = timezone.now()
+    orders = Order.objects.filter(
+        restaurant_id=restaurant_id, id__in=order_ids, status=from_status
+    )
+    if order_for is not None:
+        orders = orders.filter(order_for=order_for)
+
+    changes = {"status": to_status, "updated_at": now}
+    if to_status == Order.COMPLETED:
+        changes["picked_at"] = now
+
+    with transaction.atomic():
+        moved = set(
+            orders.select_for_update().values_list("id", flat=True)
+        )
+        if moved:
+            Order.objects.filter(id__in=moved).update(**changes)
+
+    updated = [order_id for order_id in order_ids if order_id in moved]
+    conflicts = [order_id for order_id in order_ids if order_id not in moved]
+
+    for order_id in updated:
+        publish_order_event(Order(
+            id=order_id, restaurant_id=restaurant_id, status=to_status,
+            updated_at=now
+        ), event)
+    return Transition(updated, conflicts)
+
+
+def transition(order, to_status):
+    """
+    Move one loaded order to `to_status` if it is still in the status
+    it was loaded with. Returns True on success, False on a conflict.
+    """
+    order_for = check_transition(order.status, to_status)
+    if order_for is not None and order.order_for != order_for:
+        raise InvalidTransition("Wrong status.")
+
+    result = bulk_transition(
+        order.restaurant_id, [order.id], order.status, to_status
+    )
+    if not result.updated:
+        return False
+    order.status = to_status
+    return True
+
+
+def advance(restaurant_id, order_id):
+    """
+    Move an order to the next step of the kitchen workflow.
+
+    Returns the new status, or None if the order is missing, finished or
+    changed by someone else in the meantime.
+    """
+    row = Order.objects.filter(
+        restaurant_id=restaurant_id, id=order_id
+    ).values_list("status", "order_for").first()
+    if row is None:
+        return None
+
+    to_status = NEXT_STATUS.get(row)
+    if to_status is None:
+        return None
+
+    result = bulk_transition(restaurant_id, [order_id], row[0], to_status)
+    return to_status if result.updated else None
@@ -0,0 +1,147 @@
+import base64
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from eatplusapp.models import Order
+
+ORDER_PAGE_SIZE = getattr(settings, "ORDER_PAGE_SIZE", 50)
+ORDER_MAX_PAGE_SIZE = getattr(settings, "ORDER_MAX_PAGE_SIZE", 200)
+# updated_at is stamped before commit, so a change may become visible
+# after a later one; the feed only hands out changes older than this
+ORDER_CHANGES_SETTLE_SECONDS = getattr(
+    settings, "ORDER_CHANGES_SETTLE_SECONDS", 5
+)
+
+
+class InvalidPage(ValueError):
+    pass
+
+
+def encode_cursor(order, field="created_at"):
+    value = "%s|%s" % (getattr(order, field).isoformat(), order.id)
+    return base64.urlsafe_b64encode(value.encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        value = base64.urlsafe_b64decode(cursor.encode()).decode()
+        created_at, order_id = value.rsplit("|", 1)
+        created_at = parse_datetime(created_at)
+        order_id = int(order_id)
+    except (TypeError, ValueError, UnicodeError):
+        raise InvalidPage("Invalid cursor.")
+
+    if created_at is None:
+        raise InvalidPage("Invalid cursor.")
+    return created_at, order_id
+
+
+def parse_page_size(value):
+    if value in (None, ""):
+        return ORDER_PAGE_SIZE
+    try:
+        page_size = int(value)
+    except (TypeError, ValueError):
+        raise InvalidPage("Invalid page size.")
+    if page_size < 1:
+        raise InvalidPage("Invalid page size.")
+    return min(page_size, ORDER_MAX_PAGE_SIZE)
+
+
+def parse_statuses(value):
+    """
+    Parse a comma separated list of status ids, e.g. "3,4"
+    """
+    if not value:
+        return None
+
+    valid = dict(Order.STATUS_CHOICES)
+    try:
+        statuses = [int(status) for status in value.split(",")]
+    except ValueError:
+        raise InvalidPage("Invalid status.")
+    if any(status not in valid for status in statuses):
+        raise InvalidPage("Invalid status.")
+    return statuses
+
+
+def paginate_orders(queryset, cursor=None, page_size=None, statuses=None):
+    """
+    Return one page of orders, newest first, and the cursor of the next.
+
+    Pages are keyed on (created_at, id), so each one is an index range
+    scan no matter how deep into the history it is.
+    """
+    page_size = page_size or ORDER_PAGE_SIZE
+
+    if statuses:
+        queryset = queryset.filter(status__in=statuses)
+
+    if cursor:
+        created_at, order_id = decode_cursor(cursor)
+        queryset = queryset.filter(
+            Q(created_at__lt=created_at) |
+            Q(created_at=created_at, id__lt=order_id)
+        )
+
+    orders = list(queryset.order_by("-created_at", "-id")[:page_size + 1])
+
+    next_cursor = None
+    if len(orders) > page_size:
+        orders = orders[:page_size]
+        next_cursor = encode_cursor(orders[-1])
+
+    return orders, next_cursor
+
+
+def paginate_orders_for_request(queryset, params):
+    """
+    Paginate orders using the `cursor`, `page_size` and `status`
+    parameters of a request
+    """
+    return paginate_orders(
+        queryset,
+        cursor=params.get("cursor"),
+        page_size=parse_page_size(params.get("page_size")),
+        statuses=parse_statuses(params.get("status"))
+    )
+
+
+def changed_orders(queryset, watermark=None, page_size=None, settle=None):
+    """
+    Return orders created or changed after `watermark`, oldest change
+    first, with the watermark to send on the next poll and whether more
+    changes are waiting.
+
+    Changes stamped in the last `settle` seconds are held back: an
+    order stamped earlier may still be in an uncommitted transaction,
+    and once the watermark passed it, it would never be sent. Changes
+    are read from the (restaurant, updated_at, id) index, so a poll
+    costs as much as the changes it returns.
+    """
+    page_size = page_size or ORDER_PAGE_SIZE
+    if settle is None:
+        settle = ORDER_CHANGES_SETTLE_SECONDS
+
+    queryset = queryset.filter(
+        updated_at__lte=timezone.now() - timedelta(seconds=settle)
+    )
+    if watermark:
+        updated_at, order_id = decode_cursor(watermark)
+        queryset = queryset.filter(
+            Q(updated_at__gt=updated_at) |
+            Q(updated_at=updated_at, id__gt=order_id)
+        )
+
+    orders = list(queryset.order_by("updated_at", "id")[:page_size + 1])
+
+    has_more = len(orders) > page_size
+    orders = orders[:page_size]
+    if orders:
+        watermark = encode_cursor(orders[-1], field="updated_at")
+
+    return orders, watermark, has_more
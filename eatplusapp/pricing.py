@@ -0,0 +1,206 @@
+from collections import namedtuple
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Subquery
+from django.utils import timezone
+
+from eatplusapp.models import Item, Choice, Order, OrderItem
+
+ORDER_TAX_PERCENT = getattr(settings, "ORDER_TAX_PERCENT", 13)
+
+PricedLine = namedtuple(
+    "PricedLine", "item_id quantity choice_ids unit_cents total_cents"
+)
+Quote = namedtuple("Quote", "restaurant_id lines sub_total_cents")
+
+
+class PricingError(ValueError):
+    pass
+
+
+def to_cents(amount):
+    """
+    Convert a price in currency units (int or Decimal) to integer cents
+    """
+    return int(
+        (Decimal(amount) * 100).quantize(Decimal("1"), rounding=ROUND_HALF_UP)
+    )
+
+
+def from_cents(cents):
+    """
+    Convert integer cents to a Decimal amount with two places
+    """
+    return (Decimal(cents) / 100).quantize(Decimal("0.01"))
+
+
+def cents_to_units(cents):
+    """
+    Round integer cents to whole currency units, for IntegerField totals
+    """
+    return int(
+        (Decimal(cents) / 100).quantize(Decimal("1"), rounding=ROUND_HALF_UP)
+    )
+
+
+def line_cents(price, extra_charges, quantity):
+    """
+    Return (unit, total) cents of a line: the item price plus the extra
+    charge of each choice, times the quantity
+    """
+    unit = to_cents(price) + sum(to_cents(charge) for charge in extra_charges)
+    total = int(
+        (unit * Decimal(quantity)).quantize(
+            Decimal("1"), rounding=ROUND_HALF_UP
+        )
+    )
+    return unit, total
+
+
+def quote_cart(restaurant_id, lines):
+    """
+    Price a cart of `lines`, each {"item_id": int, "quantity": int,
+    "choices": [choice_id, ...]}.
+
+    All items and choices are fetched with two `in_bulk` queries
+    whatever the size of the cart. Raises PricingError if an item is
+    unknown, unavailable or from another restaurant, or if a choice
+    doesn't belong to its item.
+    """
+    item_ids = set()
+    choice_ids = set()
+    for line in lines:
+        try:
+            item_ids.add(int(line["item_id"]))
+            choice_ids.update(int(choice) for choice in line.get("choices") or ())
+        except (KeyError, TypeError, ValueError):
+            raise PricingError("Invalid order item.")
+
+    items = Item.objects.in_bulk(item_ids) if item_ids else {}
+    choices = Choice.objects.in_bulk(choice_ids) if choice_ids else {}
+
+    priced = []
+    for line in lines:
+        item = items.get(int(line["item_id"]))
+        if item is None or item.restaurant_id != int(restaurant_id):
+            raise PricingError(
+                "Item %s is not on this menu." % line["item_id"])
+        if not item.available:
+            raise PricingError("%s is not available." % item.name)
+
+        try:
+            quantity = int(line.get("quantity", 1))
+        except (TypeError, ValueError):
+            raise PricingError("Invalid quantity.")
+        if quantity < 1:
+            raise PricingError("Invalid quantity.")
+
+        line_choices = []
+        for choice_id in line.get("choices") or ():
+            choice = choices.get(int(choice_id))
+            if choice is None or choice.item_id != item.id:
+                raise PricingError(
+                    "Choice %s is not available for %s." % (
+                        choice_id, item.name))
+            line_choices.append(choice)
+
+        unit, total = line_cents(
+            item.price, [choice.extra_charge for choice in line_choices],
+            quantity
+        )
+        priced.append(PricedLine(
+            item.id, quantity, [choice.id for choice in line_choices],
+            unit, total
+        ))
+
+    return Quote(
+        int(restaurant_id), priced, sum(line.total_cents for line in priced)
+    )
+
+
+# STORED TOTALS
+# Order.sub_total, Order.total and OrderItem.sub_total hold integer
+# cents. They are moved by the difference each time a line changes, so
+# reading an order never prices it again. Only open carts are repriced:
+# once placed, an order keeps the totals it was placed with.
+#
+# Cart code prices a line before it writes it and moves the order in
+# the same transaction. On SQLite a transaction that reads before it
+# writes can't wait for a busy writer and fails with "database is
+# locked", so every change here starts with its UPDATE.
+def order_total_cents(sub_total_cents):
+    """
+    Total of an order, taxes included
+    """
+    return sub_total_cents * (100 + ORDER_TAX_PERCENT) // 100
+
+
+def move_order_totals(orders, delta):
+    """
+    Move the stored totals of the open orders of `orders` by `delta`
+    cents, an int or an expression, in one UPDATE
+    """
+    sub_total = F("sub_total") + delta
+    return orders.filter(status=Order.OPEN).update(
+        sub_total=sub_total,
+        total=sub_total * (100 + ORDER_TAX_PERCENT) / 100,
+        updated_at=timezone.now()
+    )
+
+
+def apply_order_delta(order_id, delta):
+    """
+    Move the stored totals of an open order by `delta` cents in one
+    UPDATE
+    """
+    if not delta:
+        return
+    move_order_totals(Order.objects.filter(id=order_id), delta)
+
+
+def saved_line_cents(order_item_id):
+    """
+    Return (unit, total) cents of one saved line from its item price,
+    choices and quantity
+    """
+    row = OrderItem.objects.filter(id=order_item_id).values_list(
+        "item__price", "quantity"
+    ).first()
+    if row is None:
+        return None
+
+    price, quantity = row
+    extra_charges = OrderItem.choices.through.objects.filter(
+        orderitem_id=order_item_id
+    ).values_list("choice__extra_charge", flat=True)
+    return line_cents(price, extra_charges, quantity)
+
+
+def reprice_order_item(order_item):
+    """
+    Price a saved line again and move its order by the difference, for
+    lines changed outside the cart code, e.g. in the admin.
+
+    Lines of orders past the cart are left as they are.
+    """
+    orders = Order.objects.filter(order_orderitem=order_item.id)
+    with transaction.atomic():
+        # take the line out of its order first, which also locks it
+        old_sub_total = Subquery(
+            OrderItem.objects.filter(id=order_item.id).values("sub_total")
+        )
+        if not move_order_totals(orders, old_sub_total * -1):
+            return None
+
+        unit_price, sub_total = saved_line_cents(order_item.id)
+        OrderItem.objects.filter(id=order_item.id).update(
+            unit_price=unit_price, sub_total=sub_total
+        )
+        move_order_totals(orders, sub_total)
+
+    order_item.unit_price = unit_price
+    order_item.sub_total = sub_total
+    return sub_total
+
@@ -0,0 +1,150 @@
+import json
+import logging
+import random
+import threading
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+
+from eatplusapp.dbhooks import execute_wrapper
+
+# Share of requests profiled, 0 disables the middleware entirely
+PROFILING_SAMPLE_RATE = getattr(settings, "PROFILING_SAMPLE_RATE", 0)
+
+logger = logging.getLogger("eatplusapp.profiling")
+_local = threading.local()
+_installed = []
+
+
+class Profile(object):
+    """
+    Time spent by one request, per category, in milliseconds
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.timings = {}
+        self.depth = {}
+        self.sql_count = 0
+
+    def add(self, category, started):
+        elapsed = (time.perf_counter() - started) * 1000
+        self.timings[category] = self.timings.get(category, 0) + elapsed
+
+    def record_sql(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.sql_count += 1
+            self.add("sql", started)
+
+    def server_timing(self):
+        parts = []
+        for category in ("total", "view", "auth", "serializer", "template",
+                         "sql"):
+            if category not in self.timings:
+                continue
+            part = "%s;dur=%.1f" % (category, self.timings[category])
+            if category == "sql":
+                part += ';desc="%s queries"' % self.sql_count
+            parts.append(part)
+        return ", ".join(parts)
+
+
+def timed(category, function):
+    """
+    Add the time of `function` to `category` of the profiled request.
+
+    Nested calls, e.g. included templates or nested serializers, are
+    counted once.
+    """
+    @wraps(function)
+    def wrapper(*args, **kwargs):
+        profile = getattr(_local, "profile", None)
+        if profile is None or profile.depth.get(category):
+            return function(*args, **kwargs)
+
+        profile.depth[category] = 1
+        started = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            profile.depth[category] = 0
+            profile.add(category, started)
+    return wrapper
+
+
+def install_timers():
+    """
+    Wrap DRF authentication and serializers and template rendering,
+    once per process. The wrappers only look up a thread local when
+    the request isn't profiled.
+    """
+    if _installed:
+        return
+    _installed.append(True)
+
+    from django.template.base import Template
+    from rest_framework.serializers import BaseSerializer
+    from rest_framework.views import APIView
+
+    Template.render = timed("template", Template.render)
+    APIView.perform_authentication = timed(
+        "auth", APIView.perform_authentication
+    )
+    BaseSerializer.is_valid = timed("serializer", BaseSerializer.is_valid)
+    BaseSerializer.data = property(
+        timed("serializer", BaseSerializer.data.fget)
+    )
+
+
+class ProfilingMiddleware(object):
+    """
+    Profile a sample of requests: SQL count and time, view, auth,
+    serializer and template time go to a Server-Timing header and to
+    the "eatplusapp.profiling" logger as JSON.
+
+    Put it first in MIDDLEWARE so "total" covers the other middleware.
+    """
+
+    def __init__(self, get_response):
+        if not PROFILING_SAMPLE_RATE:
+            raise MiddlewareNotUsed
+        install_timers()
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if random.random() >= PROFILING_SAMPLE_RATE:
+            return self.get_response(request)
+
+        profile = _local.profile = Profile()
+        try:
+            with execute_wrapper(profile.record_sql):
+                response = self.get_response(request)
+        finally:
+            _local.profile = None
+
+        if hasattr(request, "_profile_view_started"):
+            profile.add("view", request._profile_view_started)
+        profile.add("total", profile.started)
+
+        response["Server-Timing"] = profile.server_timing()
+        logger.info(json.dumps({
+            "method": request.method,
+            "path": request.path,
+            "view": getattr(request.resolver_match, "view_name", None),
+            "status": response.status_code,
+            "sql_count": profile.sql_count,
+            "timings_ms": dict(
+                (category, round(elapsed, 2))
+                for category, elapsed in profile.timings.items()
+            ),
+        }, sort_keys=True))
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if getattr(_local, "profile", None) is not None:
+            request._profile_view_started = time.perf_counter()
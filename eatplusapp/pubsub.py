@@ -0,0 +1,171 @@
+import json
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils.module_loading import import_string
+
+ORDER_PUBSUB_BACKEND = getattr(
+    settings, "ORDER_PUBSUB_BACKEND", "eatplusapp.pubsub.LocalPubSub"
+)
+ORDER_STREAM_HEARTBEAT = getattr(settings, "ORDER_STREAM_HEARTBEAT", 15)
+ORDER_POLL_TIMEOUT = getattr(settings, "ORDER_POLL_TIMEOUT", 25)
+
+
+class BasePubSub(object):
+    """
+    Interface of order event backends.
+
+    Events of a channel carry increasing integer ids, so a subscriber
+    resumes with the id of the last event it has seen.
+    """
+
+    def resume_id(self, last_id=None):
+        """
+        Return the id to wait from for a subscriber that last saw
+        `last_id`. Ids this backend hasn't handed out yet were issued
+        by another worker or before a restart; those subscribers, like
+        new ones, resume from now.
+        """
+        current = self.last_id()
+        if last_id is None or last_id > current:
+            return current
+        return last_id
+
+    def publish(self, channel, message):
+        """
+        Publish `message` on `channel` and return its event id
+        """
+        raise NotImplementedError
+
+    def wait(self, channel, last_id=None, timeout=None):
+        """
+        Block until `channel` has events after `last_id` or `timeout`
+        seconds pass. Return a list of (event_id, message), empty on
+        timeout. With no `last_id` only events published from now on
+        are returned.
+        """
+        raise NotImplementedError
+
+    def last_id(self):
+        raise NotImplementedError
+
+
+class LocalPubSub(BasePubSub):
+    """
+    In-process backend.
+
+    Subscribers wait on a condition variable, so an idle stream costs
+    no queries and no CPU. Events only reach subscribers of the same
+    process; plug a shared backend in ORDER_PUBSUB_BACKEND when running
+    several workers.
+
+    Ids start at the time the backend was created, in milliseconds, so
+    after a restart they continue above the ids handed out before it,
+    unless it published more than one event per millisecond, and
+    reconnecting subscribers get every event they missed since.
+    """
+
+    def __init__(self, buffer_size=1000):
+        self.buffer_size = buffer_size
+        self._condition = threading.Condition()
+        self._channels = {}
+        self._last_id = int(time.time() * 1000)
+
+    def publish(self, channel, message):
+        with self._condition:
+            self._last_id += 1
+            events = self._channels.setdefault(
+                channel, deque(maxlen=self.buffer_size)
+            )
+            events.append((self._last_id, message))
+            self._condition.notify_all()
+            return self._last_id
+
+    def wait(self, channel, last_id=None, timeout=None):
+        deadline = time.time() + timeout if timeout is not None else None
+
+        with self._condition:
+            if last_id is None:
+                last_id = self._last_id
+
+            while True:
+                events = [
+                    event for event in self._channels.get(channel, ())
+                    if event[0] > last_id
+                ]
+                if events:
+                    return events
+
+                if deadline is None:
+                    self._condition.wait()
+                    continue
+
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return []
+                self._condition.wait(remaining)
+
+    def last_id(self):
+        return self._last_id
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = import_string(ORDER_PUBSUB_BACKEND)()
+    return _backend
+
+
+def restaurant_channel(restaurant_id):
+    return "restaurant:%s" % restaurant_id
+
+
+def publish_order_event(order, event="updated"):
+    """
+    Tell the kitchens of the order's restaurant that it changed.
+
+    The event goes out once the current transaction commits.
+    """
+    message = {
+        "event": event,
+        "id": order.id,
+        "status": order.status,
+        "updated_at": (
+            order.updated_at.isoformat() if order.updated_at else None
+        ),
+    }
+    channel = restaurant_channel(order.restaurant_id)
+    transaction.on_commit(lambda: get_backend().publish(channel, message))
+
+
+def stream_events(channel, last_id=None, heartbeat=ORDER_STREAM_HEARTBEAT):
+    """
+    Yield Server-Sent Events of `channel`, with a comment line every
+    `heartbeat` seconds to keep idle connections open.
+    """
+    # the stream never touches the database again
+    connection.close()
+    backend = get_backend()
+    last_id = backend.resume_id(last_id)
+
+    yield "retry: 3000\n\n"
+    while True:
+        events = backend.wait(channel, last_id, timeout=heartbeat)
+        if not events:
+            yield ": keepalive\n\n"
+            continue
+
+        for event_id, message in events:
+            last_id = event_id
+            yield "id: %s\nevent: order\ndata: %s\n\n" % (
+                event_id, json.dumps(message)
+            )
@@ -0,0 +1,210 @@
+import atexit
+import glob
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+
+from eatplusapp.dbhooks import execute_wrapper
+
+QUERYLOG_ENABLED = getattr(settings, "QUERYLOG_ENABLED", False)
+# Queries slower than this are logged one by one
+QUERYLOG_SLOW_MS = getattr(settings, "QUERYLOG_SLOW_MS", 100)
+# Every worker writes its statistics here, query_report adds them up
+QUERYLOG_DIR = getattr(
+    settings, "QUERYLOG_DIR",
+    os.path.join(tempfile.gettempdir(), "eatplus-querylog")
+)
+QUERYLOG_FLUSH_INTERVAL = getattr(settings, "QUERYLOG_FLUSH_INTERVAL", 5)
+
+# upper bounds of the duration buckets p95 is estimated from, in ms
+BUCKETS_MS = (
+    0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000
+)
+
+logger = logging.getLogger("eatplusapp.querylog")
+
+STRING_RE = re.compile(r"'(?:[^']|'')*'")
+NUMBER_RE = re.compile(r"\b\d+(?:\.\d+)?\b")
+PARAM_RE = re.compile(r"%s|\?")
+LIST_RE = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)")
+SPACE_RE = re.compile(r"\s+")
+
+
+@lru_cache(maxsize=4096)
+def fingerprint(sql):
+    """
+    Normalize SQL so queries differing only by their values match:
+
+        SELECT ... WHERE "id" IN (%s, %s, %s) LIMIT 21
+        -> SELECT ... WHERE "id" IN (...) LIMIT ?
+
+    Lists of one value collapse too, so IN (%s) and IN (%s, %s) are the
+    same query.
+    """
+    sql = STRING_RE.sub("?", sql)
+    sql = NUMBER_RE.sub("?", sql)
+    sql = PARAM_RE.sub("?", sql)
+    sql = LIST_RE.sub("(...)", sql)
+    return SPACE_RE.sub(" ", sql).strip()
+
+
+def new_stats(sql):
+    return {
+        "count": 0, "total_ms": 0.0, "max_ms": 0.0,
+        "buckets": [0] * (len(BUCKETS_MS) + 1), "sample": sql,
+    }
+
+
+def add_duration(stats, elapsed_ms):
+    stats["count"] += 1
+    stats["total_ms"] += elapsed_ms
+    stats["max_ms"] = max(stats["max_ms"], elapsed_ms)
+    for i, bound in enumerate(BUCKETS_MS):
+        if elapsed_ms <= bound:
+            stats["buckets"][i] += 1
+            return
+    stats["buckets"][-1] += 1
+
+
+def merge_stats(total, stats):
+    total["count"] += stats["count"]
+    total["total_ms"] += stats["total_ms"]
+    total["max_ms"] = max(total["max_ms"], stats["max_ms"])
+    for i, count in enumerate(stats["buckets"]):
+        total["buckets"][i] += count
+
+
+def percentile_ms(stats, percent):
+    """
+    Upper bound of the bucket holding the `percent` percentile
+    """
+    rank = stats["count"] * percent / 100.0
+    seen = 0
+    for i, count in enumerate(stats["buckets"]):
+        seen += count
+        if count and seen >= rank:
+            return BUCKETS_MS[i] if i < len(BUCKETS_MS) else stats["max_ms"]
+    return stats["max_ms"]
+
+
+class QueryStats(object):
+    """
+    Count, total and duration buckets per (view, fingerprint) of this
+    process, written to QUERYLOG_DIR now and then
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.pid = os.getpid()
+        self.stats = {}
+        self.flushed_at = time.time()
+
+    def add(self, view, queries):
+        with self.lock:
+            if os.getpid() != self.pid:
+                self.reset()
+            for sql, elapsed_ms in queries:
+                key = view, fingerprint(sql)
+                stats = self.stats.get(key)
+                if stats is None:
+                    stats = self.stats[key] = new_stats(sql)
+                add_duration(stats, elapsed_ms)
+
+    def flush(self, force=False):
+        now = time.time()
+        if not force and now - self.flushed_at < QUERYLOG_FLUSH_INTERVAL:
+            return
+        self.flushed_at = now
+        if not self.stats:
+            return
+
+        with self.lock:
+            rows = [
+                [view, sql, stats]
+                for (view, sql), stats in self.stats.items()
+            ]
+        os.makedirs(QUERYLOG_DIR, exist_ok=True)
+        path = os.path.join(QUERYLOG_DIR, "worker-%s.json" % self.pid)
+        temporary = "%s.tmp" % path
+        with open(temporary, "w") as output:
+            json.dump(rows, output)
+        os.replace(temporary, path)
+
+
+query_stats = QueryStats()
+
+
+def collect():
+    """
+    Return {(view, fingerprint): stats} added up over every worker
+    """
+    collected = {}
+    for path in glob.glob(os.path.join(QUERYLOG_DIR, "worker-*.json")):
+        try:
+            with open(path) as source:
+                rows = json.load(source)
+        except (OSError, ValueError):
+            continue
+        for view, sql, stats in rows:
+            total = collected.get((view, sql))
+            if total is None:
+                total = collected[view, sql] = new_stats(stats["sample"])
+            merge_stats(total, stats)
+    return collected
+
+
+def clear():
+    for path in glob.glob(os.path.join(QUERYLOG_DIR, "worker-*.json")):
+        os.remove(path)
+
+
+class QueryLogMiddleware(object):
+    """
+    Time every query of a request and add it to the statistics of its
+    fingerprint and view. Queries over QUERYLOG_SLOW_MS are logged to
+    "eatplusapp.querylog".
+    """
+
+    def __init__(self, get_response):
+        if not QUERYLOG_ENABLED:
+            raise MiddlewareNotUsed
+        atexit.register(query_stats.flush, force=True)
+        self.get_response = get_response
+
+    def __call__(self, request):
+        queries = []
+
+        def time_query(execute, sql, params, many, context):
+            started = time.perf_counter()
+            try:
+                return execute(sql, params, many, context)
+            finally:
+                queries.append(
+                    (sql, (time.perf_counter() - started) * 1000)
+                )
+
+        with execute_wrapper(time_query):
+            response = self.get_response(request)
+
+        view = getattr(request.resolver_match, "view_name", None) or "-"
+        for sql, elapsed_ms in queries:
+            if elapsed_ms >= QUERYLOG_SLOW_MS:
+                logger.warning(json.dumps({
+                    "view": view, "path": request.path,
+                    "duration_ms": round(elapsed_ms, 2), "sql": sql,
+                }))
+
+        query_stats.add(view, queries)
+        query_stats.flush()
+        return response
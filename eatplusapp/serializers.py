@@ -1,5 +1,7 @@
 from datetime import datetime
-from rest_framework import serializers
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db import transaction
+from rest_framework import exceptions, serializers
 
 from eatplusapp.models import (
     Restaurant,
@@ -12,6 +14,10 @@ from eatplusapp.models import (
     OrderItem,
     PaymentMethod
 )
+from eatplusapp.options import get_option_schema, validate_choices
+from eatplusapp.order_states import InvalidTransition, transition
+from eatplusapp.pricing import line_cents
+from eatplusapp.pubsub import publish_order_event
 
 
 class RestaurantSerializer(serializers.ModelSerializer):
@@ -64,6 +70,40 @@ class ItemSerializer(serializers.ModelSerializer):
         fields = ("id", "name", "short_description", "image", "price")
 
 
+# MENU TREE SERIALIZER
+class MenuTreeChoiceSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Choice
+        fields = ("id", "name", "default", "extra_charge")
+
+
+class MenuTreeOptionSerializer(serializers.ModelSerializer):
+    choices = MenuTreeChoiceSerializer(source="option_choice", many=True)
+
+    class Meta:
+        model = Option
+        fields = ("id", "name", "type", "choices")
+
+
+class MenuTreeItemSerializer(ItemSerializer):
+    options = MenuTreeOptionSerializer(source="meal_option", many=True)
+
+    class Meta:
+        model = Item
+        fields = (
+            "id", "name", "short_description", "image", "price", "order",
+            "available", "delivery", "takeout", "options"
+        )
+
+
+class MenuTreeSectionSerializer(serializers.ModelSerializer):
+    items = MenuTreeItemSerializer(source="meal_section", many=True)
+
+    class Meta:
+        model = MenuSection
+        fields = ("id", "title", "order", "items")
+
+
 # ORDER SERIALIZER
 class OrderCustomerSerializer(serializers.ModelSerializer):
     name = serializers.ReadOnlyField(source="user.get_full_name")
@@ -121,6 +161,11 @@ class OrderListSerializer(serializers.ModelSerializer):
         )
 
 
+class StatusConflict(exceptions.APIException):
+    status_code = 409
+    default_detail = "The order status changed meanwhile, reload it."
+
+
 class UpdateOrderStatusSerializer(serializers.ModelSerializer):
     status = serializers.ChoiceField(Order.STATUS_CHOICES)
 
@@ -131,22 +176,27 @@ class UpdateOrderStatusSerializer(serializers.ModelSerializer):
     def update(self, instance, validated_data):
         status = validated_data.get('status', instance.status)
 
-        # if status is 'On the way' and order_for is not 'Delivery'
-        if status == 5 and instance.order_for != 2:
-            raise serializers.ValidationError("Wrong status.")
+        # UPDATE ... WHERE status = <status the order was loaded with>
+        try:
+            moved = transition(instance, status)
+        except InvalidTransition as error:
+            raise serializers.ValidationError(str(error))
 
-        instance.status = status
-        instance.save()
+        if not moved:
+            raise StatusConflict()
         return instance
 
 
 class PlaceOrderItemSerializer(serializers.ModelSerializer):
     item_id = serializers.IntegerField()
-    quantity = serializers.IntegerField()
+    quantity = serializers.IntegerField(min_value=1)
+    choices = serializers.ListField(
+        child=serializers.IntegerField(), required=False, default=list
+    )
 
     class Meta:
         model = OrderItem
-        fields = ("item_id", "quantity")
+        fields = ("item_id", "quantity", "choices")
 
 
 class CustomerPlaceOrderSerializer(serializers.ModelSerializer):
@@ -154,12 +204,13 @@ class CustomerPlaceOrderSerializer(serializers.ModelSerializer):
     restaurant_id = serializers.IntegerField()
     payment_method_id = serializers.IntegerField()
     customer_id = serializers.IntegerField()
+    sub_total = serializers.IntegerField(required=False, default=0)
     total = serializers.IntegerField()
 
     class Meta:
         model = Order
         fields = (
-            "customer_id", "address", "total",
+            "customer_id", "address", "sub_total", "total",
             "restaurant_id", "payment_method_id"
         )
 
@@ -179,13 +230,80 @@ class CustomerPlaceOrderSerializer(serializers.ModelSerializer):
             customer_id=customer,
             restaurant_id=validated_data['restaurant_id'],
             address=validated_data['address'],
+            sub_total=validated_data['sub_total'],
             total=validated_data['total'],
             payment_method_id=validated_data['payment_method_id']
         )
+        publish_order_event(order, "created")
 
         return order
 
 
+class CartItemSerializer(serializers.Serializer):
+    id = serializers.ReadOnlyField()
+    item_id = serializers.IntegerField()
+    quantity = serializers.IntegerField(min_value=1, default=1)
+    choices = serializers.ListField(
+        child=serializers.IntegerField(), required=False, default=list
+    )
+
+    def validate(self, data):
+        order = self.context['order']
+        try:
+            item = Item.objects.get(
+                id=data['item_id'], restaurant_id=order.restaurant_id
+            )
+        except Item.DoesNotExist:
+            raise serializers.ValidationError(
+                {'item_id': "Item is not on this menu."})
+
+        # choices are checked against the cached option schema of the item
+        schema = get_option_schema(item.id)
+        try:
+            data['choices'] = validate_choices(schema, data['choices'])
+        except DjangoValidationError as error:
+            raise serializers.ValidationError({'choices': error.messages})
+
+        data['item'] = item
+        data['extra_charges'] = [
+            schema['extra_charges'][choice_id] for choice_id in data['choices']
+        ]
+        return data
+
+    def create(self, validated_data):
+        unit_price, sub_total = line_cents(
+            validated_data['item'].price,
+            validated_data['extra_charges'],
+            validated_data['quantity']
+        )
+        # the line goes in priced, its order moves in the same
+        # transaction and its choices don't reprice it
+        with transaction.atomic():
+            order_item = OrderItem.objects.create(
+                order=self.context['order'],
+                item=validated_data['item'],
+                quantity=validated_data['quantity'],
+                unit_price=unit_price,
+                sub_total=sub_total
+            )
+            OrderItem.choices.through.objects.bulk_create([
+                OrderItem.choices.through(
+                    orderitem_id=order_item.id, choice_id=choice_id
+                )
+                for choice_id in validated_data['choices']
+            ])
+        order_item.choice_ids = validated_data['choices']
+        return order_item
+
+    def to_representation(self, instance):
+        return {
+            'id': instance.id,
+            'item_id': instance.item_id,
+            'quantity': instance.quantity,
+            'choices': getattr(instance, 'choice_ids', []),
+        }
+
+
 class AddOrdeItemSerializer(serializers.ModelSerializer):
     choices = ChoiceSerializer()
 
@@ -0,0 +1,190 @@
+from functools import partial
+
+from django.db import transaction
+from django.db.models.signals import (
+    pre_save,
+    post_save,
+    pre_delete,
+    post_delete,
+    m2m_changed
+)
+from django.dispatch import receiver
+
+from eatplusapp.delivery import (
+    bump_areas_version,
+    bump_zones_version,
+    sync_delivery_zones
+)
+from eatplusapp.listings import bump_listing_versions
+from eatplusapp.menus import bump_menu_version
+from eatplusapp.models import (
+    Address,
+    PaymentMethod,
+    Restaurant,
+    MenuSection,
+    Item,
+    Option,
+    Choice,
+    OrderItem
+)
+from eatplusapp.options import invalidate_option_schema
+from eatplusapp.pricing import apply_order_delta, reprice_order_item
+
+
+@receiver(post_save, sender=MenuSection)
+@receiver(post_delete, sender=MenuSection)
+@receiver(post_save, sender=Item)
+@receiver(post_delete, sender=Item)
+def menu_section_or_item_changed(sender, instance, **kwargs):
+    # readers must not cache uncommitted data under the new version
+    transaction.on_commit(partial(bump_menu_version, instance.restaurant_id))
+    if sender is Item:
+        transaction.on_commit(partial(invalidate_option_schema, instance.id))
+
+
+@receiver(post_save, sender=Option)
+@receiver(post_delete, sender=Option)
+@receiver(post_save, sender=Choice)
+@receiver(post_delete, sender=Choice)
+def option_or_choice_changed(sender, instance, **kwargs):
+    transaction.on_commit(partial(invalidate_option_schema, instance.item_id))
+
+    restaurant_id = Item.objects.filter(
+        id=instance.item_id
+    ).values_list("restaurant_id", flat=True).first()
+
+    if restaurant_id is not None:
+        transaction.on_commit(partial(bump_menu_version, restaurant_id))
+
+
+# DELIVERY ZONES AND CITY LISTINGS
+def city_of(address_id):
+    return Address.objects.filter(
+        id=address_id
+    ).values_list("city_slug", flat=True).first()
+
+
+@receiver(pre_save, sender=Restaurant)
+def restaurant_saving(sender, instance, **kwargs):
+    instance._previous_city = None
+    if instance.pk is None:
+        instance._delivery_area_changed = bool(instance.delivery_area)
+        return
+    previous = Restaurant.objects.filter(pk=instance.pk).values_list(
+        "delivery_area", "address__city_slug"
+    ).first() or (None, None)
+    instance._delivery_area_changed = previous[0] != instance.delivery_area
+    instance._previous_city = previous[1]
+
+
+@receiver(post_save, sender=Restaurant)
+def restaurant_saved(sender, instance, **kwargs):
+    sync_delivery_zones(instance)
+    if getattr(instance, "_delivery_area_changed", True):
+        transaction.on_commit(bump_areas_version)
+
+    cities = [city_of(instance.address_id)]
+    if getattr(instance, "_previous_city", None) is not None:
+        cities.append(instance._previous_city)
+    transaction.on_commit(partial(bump_listing_versions, cities))
+
+
+@receiver(post_delete, sender=Restaurant)
+def restaurant_deleted(sender, instance, **kwargs):
+    transaction.on_commit(bump_zones_version)
+    if instance.delivery_area:
+        transaction.on_commit(bump_areas_version)
+    # restaurants are deleted before the address they cascade from
+    transaction.on_commit(
+        partial(bump_listing_versions, [city_of(instance.address_id)])
+    )
+
+
+@receiver(pre_save, sender=Address)
+def address_saving(sender, instance, **kwargs):
+    instance._previous_city = None
+    if instance.pk is not None:
+        instance._previous_city = city_of(instance.pk)
+
+
+@receiver(post_save, sender=Address)
+def address_saved(sender, instance, **kwargs):
+    if not Restaurant.objects.filter(address_id=instance.pk).exists():
+        return
+    transaction.on_commit(partial(
+        bump_listing_versions, [instance.city_slug, instance._previous_city]
+    ))
+
+
+@receiver(m2m_changed, sender=Restaurant.pickup_payment_methods.through)
+@receiver(m2m_changed, sender=Restaurant.delivery_payment_methods.through)
+def restaurant_payment_methods_changed(sender, instance, action, reverse,
+                                       pk_set, **kwargs):
+    if not reverse:
+        if action in ("post_add", "post_remove", "post_clear"):
+            transaction.on_commit(partial(
+                bump_listing_versions, [city_of(instance.address_id)]
+            ))
+        return
+
+    # payment_method.pickup_restaurant_payment.add(...)
+    if action == "pre_clear":
+        cities = sender.objects.filter(
+            paymentmethod_id=instance.pk
+        ).values_list("restaurant__address__city_slug", flat=True)
+    elif action in ("post_add", "post_remove"):
+        cities = Restaurant.objects.filter(
+            id__in=pk_set
+        ).values_list("address__city_slug", flat=True)
+    else:
+        return
+    transaction.on_commit(partial(bump_listing_versions, list(cities)))
+
+
+@receiver(pre_delete, sender=PaymentMethod)
+def payment_method_deleting(sender, instance, **kwargs):
+    cities = set()
+    for field in ("pickup_payment_methods", "delivery_payment_methods"):
+        cities.update(getattr(Restaurant, field).through.objects.filter(
+            paymentmethod_id=instance.pk
+        ).values_list("restaurant__address__city_slug", flat=True))
+    transaction.on_commit(partial(bump_listing_versions, cities))
+
+
+# ORDER TOTALS
+@receiver(post_save, sender=OrderItem)
+def order_item_saved(sender, instance, created, **kwargs):
+    if created and instance.unit_price:
+        # priced by the cart code before the INSERT
+        apply_order_delta(instance.order_id, instance.sub_total)
+        return
+    reprice_order_item(instance)
+
+
+@receiver(post_delete, sender=OrderItem)
+def order_item_deleted(sender, instance, **kwargs):
+    apply_order_delta(instance.order_id, -instance.sub_total)
+
+
+@receiver(m2m_changed, sender=OrderItem.choices.through)
+def order_item_choices_changed(sender, instance, action, reverse, pk_set,
+                               **kwargs):
+    if reverse and action == "pre_clear":
+        # remember the lines a choice is cleared from
+        instance._cleared_order_items = list(
+            instance.choices_orderitem.values_list("id", flat=True)
+        )
+        return
+
+    if action not in ("post_add", "post_remove", "post_clear"):
+        return
+
+    if not reverse:
+        reprice_order_item(instance)
+        return
+
+    # choice.choices_orderitem.add(...) changes the lines in pk_set
+    if action == "post_clear":
+        pk_set = getattr(instance, "_cleared_order_items", ())
+    for order_item in OrderItem.objects.filter(id__in=pk_set):
+        reprice_order_item(order_item)
@@ -1,3 +1,2357 @@
-from django.test import TestCase
+import json
+import os
+import shutil
+import tempfile
+import time
+from io import StringIO
+from contextlib import contextmanager
+from datetime import timedelta
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.core.exceptions import ValidationError
+from django.db import DatabaseError, connection, transaction
+from django.db.models import F
+from django.http import HttpResponse
+from django.template import Context, Template
+from django.test import Client, RequestFactory, TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import get_resolver, reverse
+from django.utils import timezone
+from rest_framework_jwt.settings import api_settings
+
+from eatplusapp import archive, metrics, querylog
+from eatplusapp.management.commands import bench_http
+from eatplusapp.cart import (
+    Cart, SessionCartStorage, change_quantity, checkout_cart
+)
+from eatplusapp.delivery import (
+    get_areas_version,
+    get_zones_version,
+    parse_boundaries,
+    postal_prefix,
+    restaurants_delivering_to,
+    restaurants_delivering_to_point
+)
+from eatplusapp.forms import ItemForm
+from eatplusapp.listings import get_city_cards, get_listing_versions
+from eatplusapp.menus import (
+    MENU_VERSION_KEY, get_menu_snapshot, get_menu_version
+)
+from eatplusapp.models import (
+    Address,
+    PaymentMethod,
+    Restaurant,
+    MenuSection,
+    Customer,
+    DeliveryZone,
+    Item,
+    Option,
+    Choice,
+    Manager,
+    Order,
+    OrderItem,
+    ArchivedOrder,
+    ArchivedOrderItem
+)
+from eatplusapp.nearby import (
+    candidates, nearest_restaurants, search_precision
+)
+from eatplusapp.pagination import changed_orders
+from eatplusapp.pricing import (
+    PricingError, quote_cart, reprice_order_item
+)
+from eatplusapp import profiling
+from eatplusapp.options import get_option_schema, validate_choices
+from eatplusapp.order_states import InvalidTransition, bulk_transition
+from eatplusapp.pubsub import LocalPubSub, get_backend, restaurant_channel
+from eatplusapp.serializers import CartItemSerializer
+
+
+# metrics and query statistics of the requests made by the tests go to
+# a scratch directory
+_patches = []
+
+
+def setUpModule():
+    scratch = tempfile.mkdtemp(prefix="eatplus-tests-")
+    _patches.append(mock.patch.object(
+        metrics, "METRICS_DIR", os.path.join(scratch, "metrics")
+    ))
+    _patches.append(mock.patch.object(
+        querylog, "QUERYLOG_DIR", os.path.join(scratch, "querylog")
+    ))
+    for patch in _patches:
+        patch.start()
+    _patches.append(scratch)
+
+
+def tearDownModule():
+    # or the exit flush would write them to the real directory
+    metrics.registry.reset()
+    querylog.query_stats.reset()
+    scratch = _patches.pop()
+    for patch in _patches:
+        patch.stop()
+    del _patches[:]
+    shutil.rmtree(scratch, ignore_errors=True)
+
+
+@contextmanager
+def run_on_commit():
+    """
+    Run the on_commit callbacks registered in the block when it ends,
+    as if its transaction had committed; TestCase never commits
+    """
+    start = len(connection.run_on_commit)
+    try:
+        yield
+    finally:
+        callbacks = connection.run_on_commit[start:]
+        del connection.run_on_commit[start:]
+        for _, callback in callbacks:
+            callback()
+
+
+def create_restaurant(name="Spice Bite", address=None, **fields):
+    if address is None:
+        address = Address.objects.create(
+            country="Canada", city="Toronto", postal_code="M5V 2T6"
+        )
+    fields.setdefault("verified", True)
+    fields.setdefault("available", True)
+    return Restaurant.objects.create(
+        name=name, phone="123", address=address, **fields
+    )
+
+
+def create_menu(restaurant, sections=2, items=3, options=2, choices=3):
+    """
+    Return the items of a new menu, `options` options of `choices`
+    choices each; even options are radios, odd ones selects
+    """
+    created = []
+    first = MenuSection.objects.filter(restaurant=restaurant).count() + 1
+    for s in range(sections):
+        section = MenuSection.objects.create(
+            restaurant=restaurant, title="Section %s" % (first + s),
+            order=first + s
+        )
+        for i in range(items):
+            item = Item.objects.create(
+                restaurant=restaurant, menu_section=section, order=i + 1,
+                name="Item %s-%s" % (first + s, i), short_description="",
+                image="images/items/pizza.jpg", price=10,
+                available=True, delivery=True
+            )
+            for j in range(options):
+                option = Option.objects.create(
+                    item=item, name="Option %s" % j, type=j % 2
+                )
+                for k in range(choices):
+                    Choice.objects.create(
+                        item=item, option=option, name="Choice %s" % k,
+                        extra_charge=k
+                    )
+            created.append(item)
+    return created
+
+
+def create_customer(username, address=None):
+    if address is None:
+        address = Address.objects.create(country="Canada", city="Toronto")
+    user = User.objects.create_user(username, password="secret")
+    return Customer.objects.create(
+        user=user, address=address, image="images/customers/a.png"
+    )
+
+
+def jwt_headers(user):
+    token = api_settings.JWT_ENCODE_HANDLER(
+        api_settings.JWT_PAYLOAD_HANDLER(user)
+    )
+    return {"HTTP_AUTHORIZATION": "JWT %s" % token}
+
+
+class MenuTreeTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.restaurant = create_restaurant()
+        cls.items = create_menu(cls.restaurant)
+        cls.customer = create_customer("customer")
+
+    def setUp(self):
+        cache.clear()
+
+    def get_tree(self, restaurant_id):
+        return self.client.get(
+            "/api/v1/customer/restaurants/%s/menu-tree/" % restaurant_id,
+            **jwt_headers(self.customer.user)
+        )
+
+    def test_nested_menu(self):
+        response = self.get_tree(self.restaurant.id)
+        self.assertEqual(response.status_code, 200)
+
+        menu = response.json()["menu"]
+        self.assertEqual([section["order"] for section in menu], [1, 2])
+        item = menu[0]["items"][0]
+        self.assertEqual(item["id"], self.items[0].id)
+        self.assertEqual(
+            [option["name"] for option in item["options"]],
+            ["Option 0", "Option 1"]
+        )
+        self.assertEqual(
+            [choice["name"] for choice in item["options"][0]["choices"]],
+            ["Choice 0", "Choice 1", "Choice 2"]
+        )
+
+    def test_query_count_does_not_grow_with_the_menu(self):
+        with CaptureQueriesContext(connection) as small:
+            self.get_tree(self.restaurant.id)
+        create_menu(self.restaurant, sections=5, items=10)
+        cache.clear()
+        with CaptureQueriesContext(connection) as large:
+            self.get_tree(self.restaurant.id)
+        self.assertEqual(len(small), len(large))
+
+    def test_unknown_restaurant(self):
+        self.assertEqual(self.get_tree(0).status_code, 404)
+
+
+class MenuCacheTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.restaurant = create_restaurant()
+        cls.items = create_menu(cls.restaurant, sections=1)
+        cls.customer = create_customer("customer")
+
+    def setUp(self):
+        cache.clear()
+
+    def get_items(self, restaurant_id=None, **headers):
+        headers.update(jwt_headers(self.customer.user))
+        return self.client.get(
+            "/api/v1/customer/restaurants/%s/items/" % (
+                self.restaurant.id if restaurant_id is None else restaurant_id
+            ),
+            **headers
+        )
+
+    def test_snapshot_is_served_from_the_cache(self):
+        version = get_menu_version(self.restaurant.id)
+        menus = get_menu_snapshot(self.restaurant.id, "menus", version)
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                get_menu_snapshot(self.restaurant.id, "menus", version), menus
+            )
+
+    def test_not_modified(self):
+        etag = self.get_items()["ETag"]
+        response = self.get_items(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["ETag"], etag)
+
+    def test_unknown_restaurant(self):
+        for headers in ({}, {"HTTP_IF_NONE_MATCH": "*"}):
+            with self.subTest(headers=headers):
+                response = self.get_items(0, **headers)
+                self.assertEqual(response.status_code, 404)
+        self.assertIsNone(cache.get(MENU_VERSION_KEY % 0))
+
+    def test_version_moves_on_after_commit(self):
+        etag = self.get_items()["ETag"]
+        version = get_menu_version(self.restaurant.id)
+
+        item = self.items[0]
+        with run_on_commit():
+            item.name = "Renamed"
+            item.save()
+            self.assertEqual(get_menu_version(self.restaurant.id), version)
+        self.assertGreater(get_menu_version(self.restaurant.id), version)
+
+        response = self.get_items(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(
+            "Renamed", [meal["name"] for meal in response.json()["meals"]]
+        )
+
+    def test_choice_change_moves_the_version_on(self):
+        version = get_menu_version(self.restaurant.id)
+        with run_on_commit():
+            Choice.objects.filter(item=self.items[0]).first().delete()
+        self.assertGreater(get_menu_version(self.restaurant.id), version)
+
+
+class OptionSchemaTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        restaurant = create_restaurant()
+        cls.item, cls.other_item = create_menu(
+            restaurant, sections=1, items=2
+        )
+        # Option 0 is a radio, Option 1 a select
+        cls.radio, cls.select = cls.item.meal_option.order_by("id")
+
+    def setUp(self):
+        cache.clear()
+
+    def choice(self, option, index=0, item=None):
+        return Choice.objects.filter(
+            item=item or self.item, option__name=option.name
+        ).order_by("id")[index]
+
+    def form(self, data):
+        return ItemForm(data, item=self.item)
+
+    def test_schema_is_cached(self):
+        schema = get_option_schema(self.item.id)
+        self.assertEqual(
+            [option["widget"] for option in schema["options"]],
+            ["radio", "select"]
+        )
+        with self.assertNumQueries(0):
+            self.assertEqual(get_option_schema(self.item.id), schema)
+
+    def test_schema_is_invalidated_after_commit(self):
+        get_option_schema(self.item.id)
+        with run_on_commit():
+            Choice.objects.create(
+                item=self.item, option=self.select, name="Extra cheese",
+                extra_charge=2
+            )
+        names = [
+            choice["name"]
+            for choice in get_option_schema(self.item.id)["options"][1][
+                "choices"]
+        ]
+        self.assertIn("Extra cheese", names)
+
+    def test_valid_choices(self):
+        radio, select = self.choice(self.radio), self.choice(self.select)
+        form = self.form({
+            self.radio.name: radio.id, self.select.name: [select.id]
+        })
+        self.assertTrue(form.is_valid(), form.errors)
+        self.assertEqual(form.selected_choices(), [radio.id, select.id])
+
+    def test_radio_is_required(self):
+        form = self.form({self.select.name: [self.choice(self.select).id]})
+        self.assertFalse(form.is_valid())
+
+    def test_choice_of_another_item(self):
+        with self.assertRaises(ValidationError):
+            validate_choices(
+                get_option_schema(self.item.id),
+                [
+                    self.choice(self.radio).id,
+                    self.choice(self.radio, item=self.other_item).id
+                ]
+            )
+
+
+class MenuPageQueryCountTests(TestCase):
+
+    def setUp(self):
+        PaymentMethod.objects.create(method="Cash")
+        address = Address.objects.create(
+            country="Canada", city="Toronto", postal_code="M5V 2T6"
+        )
+        self.restaurant = Restaurant.objects.create(
+            name="Spice Bite", phone="123", address=address,
+            verified=True, available=True
+        )
+        user = User.objects.create_user("customer", password="secret")
+        self.customer = Customer.objects.create(
+            user=user, address=address, image="images/customers/a.png"
+        )
+        self.client.login(username="customer", password="secret")
+
+    def add_section(self, items, options=2, choices=3):
+        section = MenuSection.objects.create(
+            restaurant=self.restaurant, title="Section",
+            order=MenuSection.objects.count() + 1
+        )
+        created = []
+        for i in range(items):
+            item = Item.objects.create(
+                restaurant=self.restaurant, menu_section=section,
+                order=i + 1, name="Item %s" % i, short_description="",
+                image="images/items/pizza.jpg", price=10,
+                available=True, delivery=True
+            )
+            for j in range(options):
+                option = Option.objects.create(
+                    item=item, name="Option %s" % j, type=j % 2
+                )
+                for k in range(choices):
+                    Choice.objects.create(
+                        item=item, option=option, name="Choice %s" % k,
+                        extra_charge=1
+                    )
+            created.append(item)
+        return created
+
+    def add_to_cart(self, items):
+        session = self.client.session
+        key = "cart:%s" % self.restaurant.id
+        cart = session.get(key, {"lines": [], "next_id": 1})
+        for item in items:
+            cart["lines"].append({
+                "id": cart["next_id"],
+                "item_id": item.id,
+                "quantity": 2,
+                "choices": list(
+                    item.item_choice.values_list("id", flat=True)[:2]
+                ),
+            })
+            cart["next_id"] += 1
+        session[key] = cart
+        session.save()
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def assert_constant_queries(self, url_name):
+        url = reverse(url_name, args=[self.restaurant.restaurant_slug])
+        self.add_to_cart(self.add_section(1))
+        small = self.count_queries(url)
+
+        self.add_to_cart(self.add_section(30))
+        large = self.count_queries(url)
+
+        self.assertEqual(small, large)
+        self.assertLessEqual(large, 10)
+
+    def test_pickup_menu_query_count(self):
+        self.assert_constant_queries("pickup_menu")
+
+    def test_delivery_menu_query_count(self):
+        self.assert_constant_queries("delivery_menu")
+
+    def test_browsing_menus_writes_no_orders(self):
+        self.add_section(3)
+        for url_name in ("pickup_menu", "delivery_menu"):
+            self.client.get(
+                reverse(url_name, args=[self.restaurant.restaurant_slug])
+            )
+        self.assertFalse(Order.objects.exists())
+
+
+class QuoteCartTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.restaurant = create_restaurant()
+        cls.items = create_menu(cls.restaurant, sections=1, items=2)
+        cls.other = create_menu(create_restaurant("Other"), sections=1)[0]
+
+    def choice(self, item, name):
+        return item.item_choice.get(option__name="Option 0", name=name).id
+
+    def test_quote(self):
+        first, second = self.items
+        quote = quote_cart(self.restaurant.id, [
+            {"item_id": first.id, "quantity": 2}
+        ])
+        self.assertEqual(quote.sub_total_cents, 2000)
+
+        choices = [
+            self.choice(first, "Choice 1"), self.choice(first, "Choice 2")
+        ]
+        with self.assertNumQueries(2):
+            quote = quote_cart(self.restaurant.id, [
+                {"item_id": first.id, "quantity": 2, "choices": choices},
+                {"item_id": second.id},
+            ])
+        self.assertEqual(
+            [(line.unit_cents, line.total_cents) for line in quote.lines],
+            [(1300, 2600), (1000, 1000)]
+        )
+        self.assertEqual(quote.lines[0].choice_ids, choices)
+        self.assertEqual(quote.sub_total_cents, 3600)
+
+    def test_rejects(self):
+        first, second = self.items
+        Item.objects.filter(id=second.id).update(available=False)
+        other_choice = self.other.item_choice.first().id
+
+        for line in (
+            {"item_id": self.other.id},
+            {"item_id": second.id},
+            {"item_id": first.id, "choices": [other_choice]},
+            {"item_id": first.id, "quantity": 0},
+            {"item_id": first.id, "quantity": "two"},
+            {"quantity": 1},
+        ):
+            with self.subTest(line=line):
+                with self.assertRaises(PricingError):
+                    quote_cart(self.restaurant.id, [line])
+
+    def test_place_order_with_invalid_ids(self):
+        PaymentMethod.objects.create(method="Cash")
+        customer = create_customer("customer")
+        valid = {
+            "order_items": [{"item_id": self.items[0].id, "quantity": 1}],
+            "address": "1 King St",
+            "restaurant_id": self.restaurant.id,
+            "payment_method_id": 1,
+        }
+        for field, value in (
+                ("restaurant_id", None), ("restaurant_id", "x"),
+                ("payment_method_id", None), ("payment_method_id", "cash")):
+            with self.subTest(field=field, value=value):
+                data = dict(valid)
+                if value is None:
+                    del data[field]
+                else:
+                    data[field] = value
+                response = self.client.post(
+                    reverse("customer_add_order"), json.dumps(data),
+                    content_type="application/json",
+                    **jwt_headers(customer.user)
+                )
+                self.assertEqual(response.status_code, 400)
+                self.assertIn(field, response.json())
+        self.assertFalse(Order.objects.exists())
+
+
+class OrderTotalTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.restaurant = create_restaurant()
+        cls.item = create_menu(cls.restaurant, sections=1, items=1)[0]
+        cls.choice = cls.item.item_choice.get(
+            option__name="Option 0", name="Choice 1"
+        )
+        cls.customer = create_customer("customer")
+
+    def setUp(self):
+        self.order = Order.objects.create(
+            customer=self.customer, restaurant=self.restaurant,
+            status=Order.OPEN
+        )
+
+    def assertTotals(self, sub_total, total, line=None):
+        self.order.refresh_from_db()
+        self.assertEqual(
+            (self.order.sub_total, self.order.total), (sub_total, total)
+        )
+        if line is not None:
+            line.refresh_from_db()
+            self.assertEqual(line.sub_total, sub_total)
+
+    def test_line_changes(self):
+        line = OrderItem.objects.create(
+            order=self.order, item=self.item, quantity=2
+        )
+        self.assertTotals(2000, 2260, line)
+
+        line.quantity = 3
+        line.save()
+        self.assertTotals(3000, 3390, line)
+
+        line.delete()
+        self.assertTotals(0, 0)
+
+    def test_choice_changes(self):
+        line = OrderItem.objects.create(
+            order=self.order, item=self.item, quantity=2
+        )
+        line.choices.add(self.choice)
+        self.assertTotals(2200, 2486, line)
+        line.choices.remove(self.choice)
+        self.assertTotals(2000, 2260, line)
+
+        self.choice.choices_orderitem.add(line)
+        self.assertTotals(2200, 2486, line)
+        self.choice.choices_orderitem.clear()
+        self.assertTotals(2000, 2260, line)
+
+    def test_placed_order_keeps_its_totals(self):
+        line = OrderItem.objects.create(
+            order=self.order, item=self.item, quantity=2
+        )
+        Order.objects.filter(id=self.order.id).update(status=Order.PLACED)
+
+        line.choices.add(self.choice)
+        line.quantity = 5
+        line.save()
+        self.assertTotals(2000, 2260, line)
+
+        OrderItem.objects.create(order=self.order, item=self.item, quantity=1)
+        line.delete()
+        self.assertTotals(2000, 2260)
+
+    def test_priced_line_moves_its_order_in_one_update(self):
+        with self.assertNumQueries(2):
+            OrderItem.objects.create(
+                order=self.order, item=self.item, quantity=2,
+                unit_price=1000, sub_total=2000
+            )
+        self.assertTotals(2000, 2260)
+
+    def test_reprice_writes_before_reading(self):
+        line = OrderItem.objects.create(
+            order=self.order, item=self.item, quantity=2
+        )
+        OrderItem.objects.filter(id=line.id).update(quantity=4)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(reprice_order_item(line), 4000)
+        statements = [
+            query["sql"] for query in queries
+            if "SAVEPOINT" not in query["sql"]
+        ]
+        self.assertTrue(statements[0].startswith("UPDATE"), statements[0])
+        self.assertTotals(4000, 4520, line)
+
+
+class CartOpTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        restaurant = create_restaurant()
+        cls.items = create_menu(restaurant, sections=1, items=2)
+        cls.customer = create_customer("customer")
+        cls.order = Order.objects.create(
+            customer=cls.customer, restaurant=restaurant, status=Order.OPEN
+        )
+        cls.other = create_customer("other")
+
+    def setUp(self):
+        self.line = OrderItem.objects.create(
+            order=self.order, item=self.items[0], quantity=1
+        )
+        self.headers = jwt_headers(self.customer.user)
+
+    def quantity(self, direction, line_id, user=None):
+        headers = jwt_headers(user) if user else self.headers
+        return self.client.post(
+            reverse("orderitem_quantity_%s" % direction, args=[line_id]),
+            **headers
+        )
+
+    def batch(self, ops):
+        return self.client.post(
+            reverse("batch_order_items"),
+            json.dumps({"order_id": self.order.id, "ops": ops}),
+            content_type="application/json", **self.headers
+        )
+
+    def test_quantity(self):
+        self.assertEqual(self.quantity("up", self.line.id).status_code, 204)
+        self.line.refresh_from_db()
+        self.assertEqual((self.line.quantity, self.line.sub_total), (2, 2000))
+
+        self.quantity("down", self.line.id)
+        self.quantity("down", self.line.id)
+        self.assertEqual(self.quantity("down", self.line.id).status_code, 204)
+        self.line.refresh_from_db()
+        self.assertEqual((self.line.quantity, self.line.sub_total), (0, 0))
+
+    def test_quantity_of_missing_or_foreign_line(self):
+        self.assertEqual(self.quantity("up", 0).status_code, 404)
+        response = self.quantity("up", self.line.id, self.other.user)
+        self.assertEqual(response.status_code, 403)
+        response = self.quantity("down", self.line.id, self.other.user)
+        self.assertEqual(response.status_code, 403)
+        self.line.refresh_from_db()
+        self.assertEqual(self.line.quantity, 1)
+
+    def test_batch(self):
+        # the first option is a radio, it needs a choice
+        choice = self.items[1].item_choice.get(
+            option__name="Option 0", name="Choice 0"
+        )
+        response = self.batch([
+            {"op": "add", "item_id": self.items[1].id, "quantity": 2,
+             "choices": [choice.id]},
+            {"op": "inc", "id": self.line.id, "by": 2},
+            {"op": "dec", "id": self.line.id},
+        ])
+        self.assertEqual(response.status_code, 200)
+        added, line_id, _ = response.json()["order_items"]
+        self.assertEqual(line_id, self.line.id)
+
+        self.line.refresh_from_db()
+        self.assertEqual(self.line.quantity, 2)
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.sub_total, 4000)
+
+        response = self.batch([{"op": "remove", "id": added}])
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(OrderItem.objects.filter(id=added).exists())
+
+    def test_batch_is_all_or_nothing(self):
+        response = self.batch([
+            {"op": "inc", "id": self.line.id},
+            {"op": "dec", "id": self.line.id, "by": 5},
+        ])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(list(response.json()["ops"]), ["1"])
+        self.line.refresh_from_db()
+        self.assertEqual(self.line.quantity, 1)
+
+        response = self.batch([{"op": "drop", "id": self.line.id}])
+        self.assertEqual(response.status_code, 400)
+
+    def test_quantity_change_writes_line_and_order_only(self):
+        # SAVEPOINT, UPDATE line, UPDATE order, RELEASE
+        with self.assertNumQueries(4):
+            self.assertEqual(
+                change_quantity(OrderItem.objects, self.line.id, 2), 1
+            )
+        self.line.refresh_from_db()
+        self.assertEqual((self.line.quantity, self.line.sub_total), (3, 3000))
+        self.order.refresh_from_db()
+        self.assertEqual(
+            (self.order.sub_total, self.order.total), (3000, 3390)
+        )
+
+    def test_quantity_of_placed_order(self):
+        Order.objects.filter(id=self.order.id).update(status=Order.PLACED)
+        self.assertEqual(
+            change_quantity(OrderItem.objects, self.line.id, 1), 0
+        )
+        self.line.refresh_from_db()
+        self.assertEqual((self.line.quantity, self.line.sub_total), (1, 1000))
+
+    def test_failed_add_leaves_no_line(self):
+        choice = self.items[1].item_choice.get(
+            option__name="Option 0", name="Choice 1"
+        )
+        serializer = CartItemSerializer(
+            data={"item_id": self.items[1].id, "choices": [choice.id]},
+            context={"order": self.order}
+        )
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+        with mock.patch.object(
+                OrderItem.choices.through.objects, "bulk_create",
+                side_effect=DatabaseError):
+            with self.assertRaises(DatabaseError):
+                serializer.save()
+
+        self.assertEqual(
+            list(OrderItem.objects.values_list("id", flat=True)),
+            [self.line.id]
+        )
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.sub_total, 1000)
+
+    def test_added_line_is_priced(self):
+        choice = self.items[1].item_choice.get(
+            option__name="Option 0", name="Choice 1"
+        )
+        response = self.batch([{
+            "op": "add", "item_id": self.items[1].id, "quantity": 2,
+            "choices": [choice.id]
+        }])
+        line = OrderItem.objects.get(id=response.json()["order_items"][0])
+        self.assertEqual((line.unit_price, line.sub_total), (1100, 2200))
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.sub_total, 3200)
+
+
+class CheckoutTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.cash = PaymentMethod.objects.create(method="Cash")
+        cls.restaurant = create_restaurant()
+        cls.item = create_menu(cls.restaurant, sections=1, items=1,
+                               options=0)[0]
+        cls.customer = create_customer("customer")
+
+    def url(self, name, **kwargs):
+        return reverse(name, kwargs=dict(
+            restaurant_slug=self.restaurant.restaurant_slug, **kwargs
+        ))
+
+    def add_to_cart(self):
+        self.client.get(self.url(
+            "cart_add", item_id=self.item.id, action="add"
+        ))
+
+    def pick_payment_method(self):
+        self.client.post(
+            self.url("order_create") + "?action=payment",
+            {"payment_method": self.cash.id}
+        )
+
+    def test_checkout(self):
+        self.client.login(username="customer", password="secret")
+        self.add_to_cart()
+        self.add_to_cart()
+        self.pick_payment_method()
+
+        response = self.client.post(self.url("order_create"), {
+            "order_for": "pickup"
+        })
+        self.assertRedirects(
+            response, self.url("pickup_menu"), fetch_redirect_response=False
+        )
+
+        order = Order.objects.get()
+        self.assertEqual(order.customer, self.customer)
+        self.assertEqual(
+            (order.status, order.order_for), (Order.RECEIVED, Order.PICKUP)
+        )
+        self.assertEqual(order.payment_method, self.cash)
+        self.assertEqual((order.sub_total, order.total), (1000, 1130))
+        self.assertEqual(
+            list(order.order_orderitem.values_list("item_id", "quantity")),
+            [(self.item.id, 1)]
+        )
+
+        # the cart was cleared
+        self.client.post(self.url("order_create"), {"order_for": "pickup"})
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_checkout_needs_a_payment_method(self):
+        self.client.login(username="customer", password="secret")
+        self.add_to_cart()
+        response = self.client.post(self.url("order_create"), {
+            "order_for": "pickup"
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(Order.objects.exists())
+
+    def test_checkout_cart(self):
+        item = create_menu(self.restaurant, sections=1, items=1)[0]
+        choices = list(item.item_choice.filter(name="Choice 2"))
+        cart = Cart(SessionCartStorage(mock.Mock(session={})),
+                    self.restaurant.id)
+        cart.add(self.item.id, 2)
+        cart.add(item.id, 1, [choice.id for choice in choices])
+        cart.payment_method_id = self.cash.id
+
+        events = get_backend()
+        last_id = events.resume_id(None)
+        with run_on_commit():
+            order = checkout_cart(cart, self.customer, Order.DELIVERY, 300)
+
+        order.refresh_from_db()
+        self.assertEqual(order.status, Order.RECEIVED)
+        # 2 x 10 + (10 + 2 + 2) + a 3 delivery fee
+        self.assertEqual((order.sub_total, order.total), (3700, 4181))
+        self.assertEqual(
+            sorted(order.order_orderitem.values_list(
+                "item_id", "unit_price", "sub_total"
+            )),
+            sorted([(self.item.id, 1000, 2000), (item.id, 1400, 1400)])
+        )
+        self.assertEqual(
+            sorted(OrderItem.choices.through.objects.filter(
+                orderitem__order=order
+            ).values_list("orderitem__item_id", "choice_id")),
+            sorted((item.id, choice.id) for choice in choices)
+        )
+        self.assertEqual(len(cart), 0)
+
+        messages = [
+            message for _, message in events.wait(
+                restaurant_channel(self.restaurant.id), last_id, timeout=0
+            )
+        ]
+        self.assertEqual(
+            [(message["event"], message["id"], message["status"])
+             for message in messages],
+            [("created", order.id, Order.RECEIVED)]
+        )
+
+    def test_anonymous_checkout(self):
+        self.add_to_cart()
+        response = self.client.post(self.url("order_create"), {
+            "order_for": "pickup"
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertIn("login", response["Location"])
+        self.assertFalse(Order.objects.exists())
+
+
+class IdempotentOrderTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        PaymentMethod.objects.create(method="Cash")
+        cls.restaurant = create_restaurant()
+        cls.item = create_menu(cls.restaurant, sections=1, items=1,
+                               options=0)[0]
+        cls.customer = create_customer("customer")
+
+    def setUp(self):
+        cache.clear()
+
+    def place(self, key, quantity=1):
+        return self.client.post(
+            reverse("customer_add_order"),
+            json.dumps({
+                "order_items": [
+                    {"item_id": self.item.id, "quantity": quantity}
+                ],
+                "address": "1 King St",
+                "restaurant_id": self.restaurant.id,
+                "payment_method_id": 1,
+            }),
+            content_type="application/json", HTTP_IDEMPOTENCY_KEY=key,
+            **jwt_headers(self.customer.user)
+        )
+
+    def test_retry_replays_the_first_response(self):
+        first = self.place("key-1")
+        self.assertEqual(first.status_code, 201)
+
+        retry = self.place("key-1")
+        self.assertEqual(retry.status_code, 201)
+        self.assertEqual(retry["Idempotent-Replayed"], "true")
+        self.assertEqual(retry.json(), first.json())
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_key_reused_with_another_request(self):
+        self.place("key-1")
+        self.assertEqual(self.place("key-1", quantity=2).status_code, 422)
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_retry_while_running(self):
+        retries = []
+
+        def quote_and_retry(*args):
+            # the client retries before the first request answered
+            retries.append(self.place("key-1"))
+            return quote_cart(*args)
+
+        with mock.patch("eatplusapp.apis.quote_cart", quote_and_retry):
+            first = self.place("key-1")
+
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual(retries[0].status_code, 409)
+        self.assertEqual(retries[0]["Retry-After"], "1")
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_server_errors_are_not_kept(self):
+        with mock.patch(
+                "eatplusapp.apis.quote_cart", side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                self.place("key-1")
+        self.assertEqual(self.place("key-1").status_code, 201)
+
+
+class ManagerOrderPageTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        PaymentMethod.objects.create(method="Cash")
+        cls.restaurant = create_restaurant()
+        customer = create_customer("customer")
+        manager = User.objects.create_user("manager", password="secret")
+        Manager.objects.create(user=manager, restaurant=cls.restaurant)
+        cls.orders = [
+            Order.objects.create(
+                customer=customer, restaurant=cls.restaurant,
+                status=Order.RECEIVED, order_for=Order.PICKUP
+            )
+            for _ in range(3)
+        ]
+        # carts never reach the kitchen
+        Order.objects.create(
+            customer=customer, restaurant=cls.restaurant, status=Order.OPEN
+        )
+
+    def setUp(self):
+        self.client.login(username="manager", password="secret")
+
+    def test_pages(self):
+        url = reverse("manager_orders")
+        first = self.client.get(url, {"page_size": 2})
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(
+            [order.id for order in first.context["orders"]],
+            [self.orders[2].id, self.orders[1].id]
+        )
+        next_query = first.context["next_query"]
+        self.assertContains(first, "?%s" % next_query.replace("&", "&amp;"))
+
+        second = self.client.get("%s?%s" % (url, next_query))
+        self.assertEqual(
+            [order.id for order in second.context["orders"]],
+            [self.orders[0].id]
+        )
+        self.assertIsNone(second.context["next_query"])
+
+    def test_invalid_cursor(self):
+        response = self.client.get(reverse("manager_orders"), {
+            "cursor": "nope"
+        })
+        self.assertRedirects(response, reverse("manager_orders"))
+
+    def test_advance(self):
+        self.client.post(reverse("manager_orders"), {
+            "id": self.orders[0].id
+        })
+        self.orders[0].refresh_from_db()
+        self.assertEqual(self.orders[0].status, Order.READY)
+
+
+class OrderTransitionTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.restaurant = create_restaurant()
+        cls.customer = create_customer("customer")
+        manager = User.objects.create_user("manager", password="secret")
+        Manager.objects.create(user=manager, restaurant=cls.restaurant)
+
+    def create_order(self, status, order_for=Order.PICKUP, restaurant=None):
+        return Order.objects.create(
+            customer=self.customer, restaurant=restaurant or self.restaurant,
+            status=status, order_for=order_for
+        ).id
+
+    def statuses(self, *order_ids):
+        return list(Order.objects.filter(id__in=order_ids).order_by(
+            "id").values_list("status", flat=True))
+
+    def test_bulk_transition(self):
+        placed = [self.create_order(Order.PLACED) for _ in range(2)]
+        received = self.create_order(Order.RECEIVED)
+        foreign = self.create_order(
+            Order.PLACED, restaurant=create_restaurant("Other")
+        )
+
+        # lock and move, in a savepoint
+        with self.assertNumQueries(4):
+            result = bulk_transition(
+                self.restaurant.id, placed + [received, foreign, 0],
+                Order.PLACED, Order.RECEIVED
+            )
+        self.assertEqual(result.updated, placed)
+        self.assertEqual(result.conflicts, [0, received, foreign])
+        self.assertEqual(
+            self.statuses(*placed + [received, foreign]),
+            [Order.RECEIVED] * 3 + [Order.PLACED]
+        )
+
+    def test_order_for_limits_the_transition(self):
+        pickup = self.create_order(Order.READY)
+        delivery = self.create_order(Order.READY, order_for=Order.DELIVERY)
+
+        result = bulk_transition(
+            self.restaurant.id, [pickup, delivery],
+            Order.READY, Order.COMPLETED
+        )
+        self.assertEqual(result, ([pickup], [delivery]))
+        self.assertIsNotNone(Order.objects.get(id=pickup).picked_at)
+
+        with self.assertRaises(InvalidTransition):
+            bulk_transition(
+                self.restaurant.id, [pickup], Order.COMPLETED, Order.PLACED
+            )
+
+    def test_update_order_api(self):
+        order_id = self.create_order(Order.RECEIVED)
+        headers = jwt_headers(User.objects.get(username="manager"))
+        url = reverse("restaurant_update_order", args=[order_id])
+
+        response = self.client.put(
+            url, json.dumps({"status": Order.READY}),
+            content_type="application/json", **headers
+        )
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.statuses(order_id), [Order.READY])
+
+        # READY -> READY is not a transition
+        response = self.client.put(
+            url, json.dumps({"status": Order.READY}),
+            content_type="application/json", **headers
+        )
+        self.assertEqual(response.status_code, 400)
+
+        foreign = self.create_order(
+            Order.RECEIVED, restaurant=create_restaurant("Other")
+        )
+        response = self.client.put(
+            reverse("restaurant_update_order", args=[foreign]),
+            json.dumps({"status": Order.READY}),
+            content_type="application/json", **headers
+        )
+        self.assertEqual(response.status_code, 404)
+
+
+class ArchiveTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        PaymentMethod.objects.create(method="Cash")
+        cls.restaurant = create_restaurant()
+        cls.item = create_menu(cls.restaurant, sections=1, items=1)[0]
+        cls.choice = cls.item.item_choice.get(
+            option__name="Option 0", name="Choice 1"
+        )
+        cls.customer = create_customer("customer")
+
+    def create_order(self, status, days_ago):
+        order = Order.objects.create(
+            customer=self.customer, restaurant=self.restaurant,
+            status=Order.OPEN
+        )
+        line = OrderItem.objects.create(
+            order=order, item=self.item, quantity=1
+        )
+        line.choices.add(self.choice)
+        Order.objects.filter(id=order.id).update(
+            status=status,
+            updated_at=timezone.now() - timedelta(days=days_ago)
+        )
+        return order.id
+
+    def test_archive_chunk(self):
+        old = [
+            self.create_order(Order.COMPLETED, 40),
+            self.create_order(Order.CANCELLED, 40),
+        ]
+        kept = [
+            self.create_order(Order.COMPLETED, 1),
+            self.create_order(Order.RECEIVED, 40),
+        ]
+
+        cutoff = timezone.now() - timedelta(days=30)
+        self.assertEqual(archive.archive_chunk(cutoff), 2)
+
+        self.assertEqual(
+            sorted(ArchivedOrder.objects.values_list("id", "sub_total")),
+            [(order_id, 1100) for order_id in old]
+        )
+        lines = ArchivedOrderItem.objects.filter(order_id__in=old)
+        self.assertEqual(lines.count(), 2)
+        self.assertEqual(
+            set(lines.values_list("choices", flat=True)), {self.choice.id}
+        )
+        self.assertEqual(
+            sorted(Order.objects.values_list("id", flat=True)), kept
+        )
+        self.assertFalse(OrderItem.objects.filter(order_id__in=old).exists())
+        self.assertFalse(OrderItem.choices.through.objects.filter(
+            orderitem__order_id__in=old
+        ).exists())
+
+        self.assertEqual(archive.archive_chunk(cutoff), 0)
+
+    def test_archive_chunk_is_atomic(self):
+        order_id = self.create_order(Order.COMPLETED, 40)
+        delete_rows = archive.delete_rows
+
+        def fail_on_orders(model, column, values):
+            if model is Order:
+                raise RuntimeError
+            delete_rows(model, column, values)
+
+        with mock.patch("eatplusapp.archive.delete_rows", fail_on_orders):
+            with self.assertRaises(RuntimeError):
+                archive.archive_chunk(timezone.now())
+
+        self.assertFalse(ArchivedOrder.objects.exists())
+        self.assertFalse(ArchivedOrderItem.objects.exists())
+        line = OrderItem.objects.get(order_id=order_id)
+        self.assertEqual(list(line.choices.all()), [self.choice])
+
+    def test_order_history(self):
+        archived = [self.create_order(Order.COMPLETED, 40) for _ in range(2)]
+        archive.archive_orders(days=30)
+        hot = [self.create_order(Order.COMPLETED, 1) for _ in range(2)]
+
+        orders, cursor = archive.order_history(
+            page_size=3, customer_id=self.customer.id
+        )
+        self.assertEqual(
+            [order.id for order in orders], [hot[1], hot[0], archived[1]]
+        )
+        orders, cursor = archive.order_history(
+            cursor, page_size=3, customer_id=self.customer.id
+        )
+        self.assertEqual([order.id for order in orders], [archived[0]])
+        self.assertIsNone(cursor)
+
+        response = self.client.get(
+            reverse("customer_get_order_history"),
+            **jwt_headers(self.customer.user)
+        )
+        self.assertEqual(
+            [order["id"] for order in response.json()["orders"]],
+            hot[::-1] + archived[::-1]
+        )
+
+
+class ChangedOrderTests(TestCase):
+
+    def setUp(self):
+        self.restaurant = create_restaurant()
+        self.customer = create_customer("customer")
+
+    def create_order(self, seconds_ago):
+        order = Order.objects.create(
+            customer=self.customer, restaurant=self.restaurant,
+            status=Order.PLACED
+        )
+        # updated_at is auto_now, stamp it through an update
+        updated_at = timezone.now() - timedelta(seconds=seconds_ago)
+        Order.objects.filter(id=order.id).update(updated_at=updated_at)
+        return order
+
+    def changes(self, watermark=None, **kwargs):
+        orders, watermark, has_more = changed_orders(
+            Order.objects.filter(restaurant=self.restaurant),
+            watermark, settle=5, **kwargs
+        )
+        return [order.id for order in orders], watermark, has_more
+
+    def test_pages(self):
+        orders = [self.create_order(seconds) for seconds in (30, 20, 10)]
+
+        ids, watermark, has_more = self.changes(page_size=2)
+        self.assertEqual(ids, [orders[0].id, orders[1].id])
+        self.assertTrue(has_more)
+
+        ids, watermark, has_more = self.changes(watermark, page_size=2)
+        self.assertEqual(ids, [orders[2].id])
+        self.assertFalse(has_more)
+
+        self.assertEqual(self.changes(watermark), ([], watermark, False))
+
+    def test_holds_back_recent_changes(self):
+        self.create_order(seconds_ago=1)
+        self.assertEqual(self.changes(), ([], None, False))
+
+    def test_late_commit_is_not_skipped(self):
+        settled = self.create_order(seconds_ago=20)
+        recent = self.create_order(seconds_ago=1)
+        ids, watermark, has_more = self.changes()
+        self.assertEqual(ids, [settled.id])
+
+        # stamped before `recent` but committed after the poll
+        late = self.create_order(seconds_ago=3)
+        self.assertEqual(self.changes(watermark), ([], watermark, False))
+
+        Order.objects.update(updated_at=F("updated_at") - timedelta(seconds=5))
+        ids, watermark, has_more = self.changes(watermark)
+        self.assertEqual(ids, [late.id, recent.id])
+
+
+class LocalPubSubTests(TestCase):
+
+    def test_resume(self):
+        backend = LocalPubSub()
+        first = backend.publish("orders", {"id": 1})
+        second = backend.publish("orders", {"id": 2})
+        self.assertEqual(
+            backend.wait("orders", first, timeout=0), [(second, {"id": 2})]
+        )
+        self.assertEqual(backend.wait("orders", second, timeout=0), [])
+
+    def test_resume_after_restart(self):
+        seen = LocalPubSub().publish("orders", {"id": 1})
+        time.sleep(0.01)
+
+        backend = LocalPubSub()
+        event_id = backend.publish("orders", {"id": 2})
+        self.assertGreater(event_id, seen)
+        self.assertEqual(backend.resume_id(seen), seen)
+        self.assertEqual(
+            backend.wait("orders", backend.resume_id(seen), timeout=0),
+            [(event_id, {"id": 2})]
+        )
+
+    def test_unknown_id_resumes_from_now(self):
+        backend = LocalPubSub()
+        backend.publish("orders", {"id": 1})
+        # issued by a worker that started later
+        last_id = backend.resume_id(backend.last_id() + 1000)
+        self.assertEqual(last_id, backend.last_id())
+
+        event_id = backend.publish("orders", {"id": 2})
+        self.assertEqual(
+            backend.wait("orders", last_id, timeout=0),
+            [(event_id, {"id": 2})]
+        )
+
+
+@skipUnless(connection.vendor == "sqlite", "EXPLAIN QUERY PLAN is SQLite")
+class HotQueryPlanTests(TestCase):
+    """
+    Every hot query must be answered from an index, not a table scan
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        PaymentMethod.objects.create(method="Cash")
+        user_id = 0
+        for city in ("Toronto", "Ottawa", "Montreal"):
+            address = Address.objects.create(country="Canada", city=city)
+            for i in range(5):
+                restaurant = Restaurant.objects.create(
+                    name="%s %s" % (city, i), phone="0", address=address,
+                    verified=i % 2 == 0, available=i % 3 != 0
+                )
+                section = MenuSection.objects.create(
+                    restaurant=restaurant, title="Section", order=1
+                )
+                for j in range(5):
+                    Item.objects.create(
+                        restaurant=restaurant, menu_section=section,
+                        order=j + 1, name="Item %s" % j,
+                        short_description="", image="", price=10,
+                        available=j % 2 == 0, delivery=j % 3 == 0
+                    )
+
+                user_id += 1
+                user = User.objects.create_user("customer%s" % user_id)
+                customer = Customer.objects.create(
+                    user=user, address=address, image="images/customers/a.png"
+                )
+                for order_status, _ in Order.STATUS_CHOICES:
+                    Order.objects.create(
+                        customer=customer, restaurant=restaurant,
+                        status=order_status
+                    )
+
+        cls.restaurant = Restaurant.objects.first()
+        cls.customer = Customer.objects.first()
+
+    def assert_no_full_scan(self, queryset):
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute("EXPLAIN QUERY PLAN " + sql, params)
+            plan = [row[-1] for row in cursor.fetchall()]
+
+        table = queryset.model._meta.db_table
+        scans = [
+            step for step in plan
+            if step.startswith(("SCAN %s" % table, "SCAN TABLE %s" % table))
+        ]
+        self.assertFalse(scans, "Full scan in plan of:\n%s\n%s" % (
+            sql, "\n".join(plan)
+        ))
+
+    def test_restaurant_orders_by_status(self):
+        self.assert_no_full_scan(Order.objects.filter(
+            restaurant=self.restaurant,
+            status__in=[Order.RECEIVED, Order.READY]
+        ).order_by("-created_at"))
+
+    def test_customer_open_order(self):
+        self.assert_no_full_scan(Order.objects.filter(
+            customer=self.customer, status=Order.OPEN
+        ))
+
+    def test_listed_restaurants(self):
+        self.assert_no_full_scan(Restaurant.objects.filter(
+            verified=True, available=True
+        ).order_by("-id"))
+
+    def test_restaurant_delivery_items(self):
+        self.assert_no_full_scan(Item.objects.filter(
+            restaurant=self.restaurant, available=True, delivery=True
+        ))
+
+    def test_addresses_by_city(self):
+        self.assert_no_full_scan(Address.objects.filter(city_slug="toronto"))
+
+    def test_addresses_by_geohash(self):
+        self.assert_no_full_scan(Address.objects.filter(
+            geohash_5__in=["dpz80", "dpz81", "dpz82"]
+        ))
+
+
+class DeliveryZoneTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def test_postal_prefixes(self):
+        self.assertEqual(postal_prefix("m5v 2t6"), "M5V")
+        self.assertIsNone(postal_prefix("12345"))
+        self.assertIsNone(postal_prefix(None))
+        self.assertEqual(
+            parse_boundaries("M5V, m5w / M6K and XM7A"), {"M5V", "M5W", "M6K"}
+        )
+
+    def test_zones_follow_boundaries(self):
+        with run_on_commit():
+            restaurant = create_restaurant(boundaries="M5V, M5W")
+        self.assertEqual(
+            set(DeliveryZone.objects.filter(
+                restaurant=restaurant
+            ).values_list("postal_prefix", flat=True)),
+            {"M5V", "M5W"}
+        )
+        self.assertEqual(
+            restaurants_delivering_to("M5V 2T6"), {restaurant.id}
+        )
+
+        restaurant.boundaries = "M5W M6K"
+        with run_on_commit():
+            restaurant.save()
+        self.assertEqual(restaurants_delivering_to("M5V 2T6"), set())
+        self.assertEqual(
+            restaurants_delivering_to("m6k 1a1"), {restaurant.id}
+        )
+
+        with run_on_commit():
+            restaurant.delete()
+        self.assertFalse(DeliveryZone.objects.exists())
+        self.assertEqual(restaurants_delivering_to("M5W 1A1"), set())
+
+    def test_unchanged_boundaries_keep_the_map(self):
+        with run_on_commit():
+            restaurant = create_restaurant(boundaries="M5V")
+        version = get_zones_version()
+        with run_on_commit():
+            restaurant.save()
+        self.assertEqual(get_zones_version(), version)
+
+
+class DeliveryAreaTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        address = Address.objects.create(country="Canada", city="Toronto")
+        cls.downtown = Restaurant.objects.create(
+            name="Downtown", phone="0", address=address,
+            delivery_area=json.dumps(
+                [[-79.42, 43.63], [-79.36, 43.63], [-79.36, 43.68],
+                 [-79.42, 43.68]]
+            )
+        )
+        # two rings, the lake shore and the islands
+        cls.shore = Restaurant.objects.create(
+            name="Shore", phone="0", address=address,
+            delivery_area=json.dumps([
+                [[-79.40, 43.62], [-79.30, 43.62], [-79.30, 43.65],
+                 [-79.40, 43.65]],
+                [[-79.40, 43.60], [-79.35, 43.60], [-79.35, 43.61]],
+            ])
+        )
+        Restaurant.objects.create(
+            name="Nowhere", phone="0", address=address, delivery_area="bad"
+        )
+
+    def setUp(self):
+        cache.clear()
+
+    def test_point_in_one_area(self):
+        self.assertEqual(
+            restaurants_delivering_to_point(43.66, -79.40),
+            {self.downtown.id}
+        )
+
+    def test_point_in_overlapping_areas(self):
+        self.assertEqual(
+            restaurants_delivering_to_point(43.64, -79.37),
+            {self.downtown.id, self.shore.id}
+        )
+
+    def test_point_in_second_ring(self):
+        self.assertEqual(
+            restaurants_delivering_to_point(43.603, -79.36), {self.shore.id}
+        )
+
+    def test_point_outside_every_area(self):
+        self.assertEqual(restaurants_delivering_to_point(45.42, -75.69), set())
+
+    def test_deleted_area_leaves_the_index(self):
+        self.assertIn(
+            self.shore.id, restaurants_delivering_to_point(43.603, -79.36)
+        )
+        with run_on_commit():
+            Restaurant.objects.get(id=self.shore.id).delete()
+        self.assertEqual(
+            restaurants_delivering_to_point(43.603, -79.36), set()
+        )
+
+    def test_endpoint_rejects_invalid_points(self):
+        headers = jwt_headers(create_customer("customer").user)
+        path = "/api/v1/customer/restaurants/delivering/"
+        for params in (
+            {"lat": "inf", "lng": "-79.4"},
+            {"lat": "1e400", "lng": "-79.4"},
+            {"lat": "nan", "lng": "-79.4"},
+            {"lat": "43.6", "lng": "-200"},
+            {"lat": "43.6"},
+            {"lat": "north", "lng": "-79.4"},
+        ):
+            with self.subTest(params=params):
+                response = self.client.get(path, params, **headers)
+                self.assertEqual(response.status_code, 400)
+
+        Restaurant.objects.filter(id=self.downtown.id).update(
+            verified=True, available=True,
+            logo="images/restaurants/logo.png"
+        )
+        response = self.client.get(
+            path, {"lat": "43.66", "lng": "-79.40"}, **headers
+        )
+        self.assertEqual(
+            [restaurant["id"] for restaurant in response.json()[
+                "restaurants"]],
+            [self.downtown.id]
+        )
+
+
+class NearbyRestaurantTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.restaurants = {}
+        for name, lat, lng, verified in (
+                ("Union", 43.6453, -79.3806, True),
+                ("Kensington", 43.6547, -79.4005, True),
+                ("Unverified", 43.6460, -79.3810, False),
+                ("Leaside", 43.7001, -79.3000, True),
+                ("Ottawa", 45.4215, -75.6972, True)):
+            address = Address.objects.create(
+                country="Canada", city="Toronto", latitude=lat, longitude=lng
+            )
+            cls.restaurants[name] = Restaurant.objects.create(
+                name=name, phone="0", address=address,
+                verified=verified, available=True
+            )
+
+    def nearest(self, radius_km):
+        return [
+            restaurant.name
+            for restaurant in nearest_restaurants(43.6426, -79.3871, radius_km)
+        ]
+
+    def test_nearest_first_within_radius(self):
+        self.assertEqual(self.nearest(5), ["Union", "Kensington"])
+
+    def test_wider_radius(self):
+        self.assertEqual(
+            self.nearest(15), ["Union", "Kensington", "Leaside"]
+        )
+
+    def test_address_geohashes(self):
+        address = self.restaurants["Union"].address
+        self.assertEqual(
+            (address.geohash_4, address.geohash_5, address.geohash_6),
+            ("dpz8", "dpz83", "dpz839")
+        )
+
+    def test_search_precision(self):
+        self.assertEqual(search_precision(43.6426, 15), 4)
+        self.assertEqual(search_precision(43.6426, 2), 5)
+        self.assertEqual(search_precision(43.6426, 0.5), 6)
+        self.assertIsNone(search_precision(89.9, 5))
+
+    def test_candidates_use_geohash_index(self):
+        with CaptureQueriesContext(connection) as queries:
+            names = sorted(
+                restaurant.name
+                for restaurant in candidates(43.6426, -79.3871, 2)
+            )
+        self.assertEqual(names, ["Kensington", "Union"])
+        sql = queries[0]["sql"]
+        self.assertIn('"geohash_5" IN', sql)
+        self.assertNotIn("BETWEEN", sql)
+
+
+class CityListingTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.cash = PaymentMethod.objects.create(method="Cash")
+        cls.toronto = Address.objects.create(country="Canada", city="Toronto")
+        cls.ottawa = Address.objects.create(country="Canada", city="Ottawa")
+        cls.restaurant = Restaurant.objects.create(
+            name="Spice Bite", phone="0", address=cls.toronto,
+            logo="images/restaurants/logo.png", delivery_fee=2,
+            verified=True, available=True
+        )
+        Restaurant.objects.create(
+            name="Hidden", phone="0", address=cls.toronto
+        )
+
+    def setUp(self):
+        cache.clear()
+
+    def cards(self, city_slug="toronto"):
+        return get_city_cards([city_slug])[city_slug]
+
+    def test_cards_are_cached(self):
+        cards = self.cards()
+        self.assertEqual([card["name"] for card in cards], ["Spice Bite"])
+        self.assertEqual(
+            cards[0]["logo"], "/media/images/restaurants/logo.png"
+        )
+        self.assertEqual(cards[0]["delivery_fee"], 2)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.cards(), cards)
+
+    def test_restaurant_change(self):
+        self.cards()
+        with run_on_commit():
+            self.restaurant.delivery_fee = 5
+            self.restaurant.save()
+            # readers keep the committed cards until the commit
+            self.assertEqual(self.cards()[0]["delivery_fee"], 2)
+        self.assertEqual(self.cards()[0]["delivery_fee"], 5)
+
+    def test_rolled_back_change(self):
+        self.cards()
+        with run_on_commit():
+            with self.assertRaises(ValueError):
+                with transaction.atomic():
+                    self.restaurant.delivery_fee = 5
+                    self.restaurant.save()
+                    raise ValueError
+        with self.assertNumQueries(0):
+            self.assertEqual(self.cards()[0]["delivery_fee"], 2)
+
+    def test_restaurant_moves_city(self):
+        self.cards()
+        self.cards("ottawa")
+        with run_on_commit():
+            self.restaurant.address = self.ottawa
+            self.restaurant.save()
+        self.assertEqual(self.cards(), [])
+        self.assertEqual(len(self.cards("ottawa")), 1)
+
+    def test_address_change(self):
+        self.cards()
+        with run_on_commit():
+            self.toronto.city = "North York"
+            self.toronto.save()
+        self.assertEqual(self.cards(), [])
+        self.assertEqual(len(self.cards("north-york")), 1)
+
+    def test_payment_methods_change(self):
+        self.cards()
+        with run_on_commit():
+            self.restaurant.delivery_payment_methods.add(self.cash)
+        self.assertEqual(
+            self.cards()[0]["delivery_payment_methods"], [self.cash.id]
+        )
+        with run_on_commit():
+            self.cash.pickup_restaurant_payment.add(self.restaurant)
+        self.assertEqual(
+            self.cards()[0]["pickup_payment_methods"], [self.cash.id]
+        )
+        with run_on_commit():
+            self.cash.delivery_restaurant_payment.clear()
+        self.assertEqual(self.cards()[0]["delivery_payment_methods"], [])
+
+    def test_payment_method_deleted(self):
+        self.restaurant.pickup_payment_methods.add(self.cash)
+        self.assertEqual(
+            self.cards()[0]["pickup_payment_methods"], [self.cash.id]
+        )
+        with run_on_commit():
+            PaymentMethod.objects.get(pk=self.cash.pk).delete()
+        self.assertEqual(self.cards()[0]["pickup_payment_methods"], [])
+
+    def test_restaurant_deleted(self):
+        self.cards()
+        with run_on_commit():
+            Restaurant.objects.get(pk=self.restaurant.pk).delete()
+        self.assertEqual(self.cards(), [])
+
+
+class SeedScaleTests(TestCase):
+
+    def test_seed_refreshes_derived_data(self):
+        versions = (
+            get_zones_version(), get_areas_version(),
+            get_listing_versions(["toronto"])["toronto"]
+        )
+        call_command(
+            "seed_scale", cities=1, restaurants_per_city=3, sections=1,
+            items_per_section=2, options_per_item=1, choices_per_option=2,
+            customers=2, orders_per_day=2, days=1, stdout=StringIO()
+        )
+
+        self.assertEqual(Restaurant.objects.count(), 3)
+        for restaurant in Restaurant.objects.select_related("address"):
+            self.assertEqual(
+                restaurant.address.postal_code[:3], restaurant.boundaries
+            )
+            self.assertIn(
+                restaurant.id,
+                restaurants_delivering_to(restaurant.address.postal_code)
+            )
+
+        new_versions = (
+            get_zones_version(), get_areas_version(),
+            get_listing_versions(["toronto"])["toronto"]
+        )
+        for old, new in zip(versions, new_versions):
+            self.assertGreater(new, old)
+
+
+class BenchHttpReportTests(TestCase):
+
+    def setUp(self):
+        self.command = bench_http.Command(stdout=StringIO())
+
+    def test_failures_are_left_out_of_percentiles(self):
+        results = self.command.summarize(
+            {"menu": [10.0, 20.0, 30.0], "order": []},
+            {"menu": {"500": 2}, "order": {"connection": 1}},
+            elapsed=1.0
+        )
+        menu = results["workloads"]["menu"]
+        self.assertEqual(
+            (menu["requests"], menu["errors"], menu["p99_ms"]), (3, 2, 30.0)
+        )
+        self.assertIsNone(results["workloads"]["order"]["p50_ms"])
+        self.assertEqual(
+            results["total"]["error_statuses"], {"500": 2, "connection": 1}
+        )
+
+        with self.assertRaisesMessage(
+                CommandError, "3 requests failed: 500 x2, connection x1"):
+            self.command.check_failures(results)
+
+        results = self.command.summarize(
+            {"menu": [10.0]}, {"menu": {}}, elapsed=1.0
+        )
+        self.command.check_failures(results)
+
+    def test_compare(self):
+        baseline = {
+            "workloads": {
+                "menu": {"rps": 100, "p95_ms": 10},
+                "order": {"rps": 100, "p95_ms": 10},
+            },
+            "total": {"rps": 200, "p95_ms": 10},
+        }
+        results = {
+            "workloads": {
+                "menu": {"rps": 90, "p95_ms": 11},
+                "order": {"rps": 100, "p95_ms": 15},
+            },
+            "total": {"rps": 190, "p95_ms": 15},
+        }
+        self.assertEqual(
+            self.command.compare(baseline, results, tolerance=20),
+            ["order", "total"]
+        )
+        self.assertEqual(
+            self.command.compare(baseline, results, tolerance=50), []
+        )
+
+
+class ProfilingTests(TestCase):
+
+    def test_disabled_without_a_sample_rate(self):
+        with mock.patch.object(profiling, "PROFILING_SAMPLE_RATE", 0):
+            with self.assertRaises(MiddlewareNotUsed):
+                profiling.ProfilingMiddleware(lambda request: None)
+
+    def test_profiled_request(self):
+        def view(request):
+            list(User.objects.all())
+            list(User.objects.all())
+            return HttpResponse(Template("{{ a }}").render(Context({})))
+
+        request = RequestFactory().get("/restaurants/")
+        with mock.patch.object(profiling, "PROFILING_SAMPLE_RATE", 1):
+            middleware = profiling.ProfilingMiddleware(view)
+            with self.assertLogs("eatplusapp.profiling") as logs:
+                response = middleware(request)
+
+        header = response["Server-Timing"]
+        self.assertTrue(header.startswith("total;dur="), header)
+        self.assertIn("template;dur=", header)
+        self.assertIn('desc="2 queries"', header)
+
+        logged = json.loads(logs.records[0].getMessage())
+        self.assertEqual(
+            (logged["path"], logged["status"], logged["sql_count"]),
+            ("/restaurants/", 200, 2)
+        )
+        self.assertEqual(
+            set(logged["timings_ms"]), {"total", "template", "sql"}
+        )
+
+    def test_nested_calls_are_timed_once(self):
+        calls = []
+
+        def serialize(depth):
+            calls.append(depth)
+            if depth:
+                serialize(depth - 1)
+        serialize = profiling.timed("serializer", serialize)
+
+        profile = profiling._local.profile = profiling.Profile()
+        try:
+            with mock.patch.object(profile, "add") as add:
+                serialize(2)
+        finally:
+            profiling._local.profile = None
+        self.assertEqual(calls, [2, 1, 0])
+        self.assertEqual(add.call_count, 1)
+
+
+class MetricsTests(TestCase):
+
+    def setUp(self):
+        self.registry = metrics.Registry()
+        patch = mock.patch.object(metrics, "registry", self.registry)
+        patch.start()
+        self.addCleanup(patch.stop)
+        for path in os.listdir(metrics.METRICS_DIR) if os.path.isdir(
+                metrics.METRICS_DIR) else ():
+            os.remove(os.path.join(metrics.METRICS_DIR, path))
+
+    def write_worker(self, pid, rows):
+        os.makedirs(metrics.METRICS_DIR, exist_ok=True)
+        path = os.path.join(metrics.METRICS_DIR, "worker-%s.json" % pid)
+        with open(path, "w") as output:
+            json.dump(rows, output)
+        return path
+
+    def test_off_unless_enabled(self):
+        with self.assertRaises(MiddlewareNotUsed):
+            metrics.MetricsMiddleware(lambda request: None)
+
+    def test_render_prometheus(self):
+        text = metrics.render_prometheus({
+            ("http_requests_total", (
+                ("method", "GET"), ("route", 'a"b'), ("status", "2xx")
+            )): 3,
+            ("db_queries_per_request", (("route", "menu/"), )): {
+                "buckets": [1, 2, 0, 1, 0, 0, 0, 0], "sum": 9, "count": 4
+            },
+            ("cache_hits_total", ()): 3,
+            ("cache_misses_total", ()): 1,
+        })
+        lines = text.splitlines()
+        self.assertIn("# TYPE http_requests_total counter", lines)
+        self.assertIn(
+            'http_requests_total{method="GET",route="a\\"b",status="2xx"} 3',
+            lines
+        )
+        self.assertIn(
+            'db_queries_per_request_bucket{route="menu/",le="1"} 3', lines
+        )
+        self.assertIn(
+            'db_queries_per_request_bucket{route="menu/",le="5"} 4', lines
+        )
+        self.assertIn(
+            'db_queries_per_request_bucket{route="menu/",le="+Inf"} 4', lines
+        )
+        self.assertIn('db_queries_per_request_sum{route="menu/"} 9', lines)
+        self.assertIn("cache_hit_ratio 0.75", lines)
+
+    def test_route_of(self):
+        self.assertEqual(
+            metrics.route_of("/api/v1/customer/orders/"),
+            "api/v1/customer/orders/"
+        )
+        self.assertEqual(
+            metrics.route_of("/api/v1/customer/restaurants/5/menu-tree/"),
+            "api/v1/customer/restaurants/<restaurant_id>/menu-tree/"
+        )
+        self.assertEqual(
+            metrics.route_of("/spice-bite/pickup-menu/"),
+            "<restaurant_slug>/pickup-menu/"
+        )
+        self.assertEqual(metrics.route_of("/no/such/page/"), "unmatched")
+
+    def test_collect_adds_up_workers(self):
+        self.registry.inc("cache_hits_total", {}, 2)
+        self.registry.observe("db_queries_per_request", {"route": "r"}, 1)
+        # a live worker, the parent of this process
+        self.write_worker(os.getppid(), [
+            ["cache_hits_total", {}, 5],
+            ["db_queries_per_request", {"route": "r"}, {
+                "buckets": [0, 0, 1, 0, 0, 0, 0, 0], "sum": 2, "count": 1
+            }],
+            ["unknown_total", {}, 1],
+        ])
+
+        values = metrics.collect()
+        self.assertEqual(values[("cache_hits_total", ())], 7)
+        self.assertEqual(values[("db_queries_per_request", (
+            ("route", "r"),
+        ))], {"buckets": [0, 1, 1, 0, 0, 0, 0, 0], "sum": 3, "count": 2})
+        self.assertNotIn(("unknown_total", ()), values)
+
+    def test_collect_drops_exited_workers(self):
+        with mock.patch.object(metrics, "pid_alive", lambda pid: False):
+            path = self.write_worker(1234567, [["cache_hits_total", {}, 5]])
+            self.assertEqual(metrics.collect(), {})
+        self.assertFalse(os.path.exists(path))
+
+
+class QueryLogTests(TestCase):
+
+    def test_off_unless_enabled(self):
+        with self.assertRaises(MiddlewareNotUsed):
+            querylog.QueryLogMiddleware(lambda request: None)
+
+    def test_fingerprint(self):
+        for sql, expected in (
+            ('SELECT * FROM "t" WHERE "id" IN (%s, %s, %s) LIMIT 21',
+             'SELECT * FROM "t" WHERE "id" IN (...) LIMIT ?'),
+            ('SELECT * FROM "t" WHERE "id" IN (%s)',
+             'SELECT * FROM "t" WHERE "id" IN (...)'),
+            ('SELECT * FROM "t" WHERE "id" IN (?,?)',
+             'SELECT * FROM "t" WHERE "id" IN (...)'),
+            ("SELECT * FROM t WHERE name = 'it''s'  AND n > 2.5",
+             "SELECT * FROM t WHERE name = ? AND n > ?"),
+            ('SELECT "t2"."id" FROM "t2"',
+             'SELECT "t2"."id" FROM "t2"'),
+        ):
+            with self.subTest(sql=sql):
+                self.assertEqual(querylog.fingerprint(sql), expected)
+
+    def test_percentile_ms(self):
+        stats = querylog.new_stats("SELECT 1")
+        for elapsed_ms in [0.2] * 90 + [3] * 9 + [9000]:
+            querylog.add_duration(stats, elapsed_ms)
+
+        self.assertEqual(querylog.percentile_ms(stats, 50), 0.25)
+        self.assertEqual(querylog.percentile_ms(stats, 95), 5)
+        # past the last bucket: the slowest query seen
+        self.assertEqual(querylog.percentile_ms(stats, 100), 9000)
+        self.assertEqual(
+            querylog.percentile_ms(querylog.new_stats("SELECT 1"), 95), 0.0
+        )
+
+    def test_collect_adds_up_workers(self):
+        querylog.clear()
+        first, second = querylog.QueryStats(), querylog.QueryStats()
+        first.add("menu", [("SELECT 1 WHERE id IN (%s)", 1.0)])
+        second.add("menu", [("SELECT 2 WHERE id IN (%s, %s)", 3.0)])
+        # as if written by another worker
+        second.pid += 1
+        first.flush(force=True)
+        second.flush(force=True)
+
+        stats = querylog.collect()[("menu", "SELECT ? WHERE id IN (...)")]
+        self.assertEqual((stats["count"], stats["total_ms"]), (2, 4.0))
+        querylog.clear()
+
+
+# Query and latency budget of every eatplusapp URL, measured against
+# the EndpointBudgetTests dataset. Paths are formatted with the ids of
+# that dataset; /api/ paths authenticate with a JWT, the others with a
+# session. Raise a budget on purpose, never to make a test pass.
+# Query budgets always hold; timings depend on the machine, so latency
+# budgets are only checked with CHECK_LATENCY_BUDGETS=1, e.g. on a quiet
+# benchmark box.
+CHECK_LATENCY_BUDGETS = os.environ.get("CHECK_LATENCY_BUDGETS") == "1"
+
+
+def budget(method, path, status=200, user=None, data=None, queries=5,
+           ms=250):
+    return {
+        "method": method, "path": path, "status": status, "user": user,
+        "data": data, "queries": queries, "ms": ms,
+    }
+
+
+ENDPOINT_BUDGETS = {
+    # pages
+    "eatplusapp.views.restaurants_list": budget(
+        "get", "/restaurants/", queries=4, ms=500
+    ),
+    "eatplusapp.views.MyLoginView": budget("get", "/login/", ms=500),
+    "eatplusapp.views.CustomerSignUpView": budget(
+        "get", "/customer/signup/", ms=500
+    ),
+    "eatplusapp.manager_views.create_restaurant": budget(
+        "get", "/restaurant/create/", ms=500
+    ),
+    "eatplusapp.manager_views.create_manager": budget(
+        "get", "/{slug}/manager/signup/", queries=3, ms=500
+    ),
+    "eatplusapp.manager_views.menu": budget(
+        "get", "/manager/menu/", user="manager", queries=8, ms=500
+    ),
+    "eatplusapp.manager_views.restaurant_order": budget(
+        "get", "/manager/orders/", user="manager", queries=6, ms=500
+    ),
+    "eatplusapp.metrics.metrics_view": budget(
+        "get", "/admin/metrics/", user="staff", queries=3
+    ),
+    "eatplusapp.views.pickup_menu": budget(
+        "get", "/{slug}/pickup-menu/", user="customer", queries=10, ms=500
+    ),
+    "eatplusapp.views.delivery_menu": budget(
+        "get", "/{slug}/delivery-menu/", user="customer", queries=10, ms=500
+    ),
+
+    # web cart
+    "eatplusapp.views.item_option": budget(
+        "post", "/{slug}/items/{item_id}/options/", status=302,
+        user="customer", data="option_form", queries=12
+    ),
+    "eatplusapp.views.cart_add": budget(
+        "get", "/{slug}/cart/add/{plain_item_id}/add/", user="customer",
+        queries=12
+    ),
+    "eatplusapp.views.add_choice": budget(
+        "get", "/{slug}/cart/lines/1/choices/{choice_id}/", status=302,
+        user="customer", queries=12
+    ),
+    "eatplusapp.views.cart_remove": budget(
+        "get", "/{slug}/cart/remove/1/", status=302, user="customer",
+        queries=10
+    ),
+    # two cart lines, written with bulk INSERTs
+    "eatplusapp.views.order_create": budget(
+        "post", "/{slug}/checkout/", status=302, user="customer",
+        queries=19, ms=500
+    ),
+
+    # customer API
+    "eatplusapp.apis.customer_get_restaurants": budget(
+        "get", "/api/v1/customer/restaurants/", user="customer", queries=5
+    ),
+    "eatplusapp.apis.customer_get_delivering_restaurants": budget(
+        "get", "/api/v1/customer/restaurants/delivering/?lat=43.6&lng=-79.4",
+        user="customer", queries=4
+    ),
+    "eatplusapp.apis.customer_get_menus": budget(
+        "get", "/api/v1/customer/restaurants/{restaurant_id}/menus/",
+        user="customer", queries=8
+    ),
+    "eatplusapp.apis.customer_get_items": budget(
+        "get", "/api/v1/customer/restaurants/{restaurant_id}/items/",
+        user="customer", queries=8
+    ),
+    "eatplusapp.apis.customer_get_menu_tree": budget(
+        "get", "/api/v1/customer/restaurants/{restaurant_id}/menu-tree/",
+        user="customer", queries=8
+    ),
+    "eatplusapp.apis.get_item_options": budget(
+        "get", "/api/v1/customer/items/{item_id}/options/",
+        user="customer", queries=4
+    ),
+    "eatplusapp.apis.get_item_choices": budget(
+        "get", "/api/v1/customer/items/{item_id}/choices/",
+        user="customer", queries=4
+    ),
+    "eatplusapp.apis.add_item_to_cart": budget(
+        "post", "/api/v1/customer/orderitems/", status=201,
+        user="customer", data="cart_item", queries=12
+    ),
+    "eatplusapp.apis.batch_order_items": budget(
+        "post", "/api/v1/customer/orderitems/batch/", user="customer",
+        data="cart_ops", queries=12
+    ),
+    "eatplusapp.apis.delete_item_from_cart": budget(
+        "delete", "/api/v1/customer/orderitems/{order_item_id}/",
+        status=204, user="customer", queries=6
+    ),
+    "eatplusapp.apis.orderitem_quantity_up": budget(
+        "post", "/api/v1/customer/orderitems/{order_item_id}/quantity-up/",
+        status=204, user="customer", queries=5
+    ),
+    "eatplusapp.apis.orderitem_quantity_down": budget(
+        "post",
+        "/api/v1/customer/orderitems/{order_item_id}/quantity-down/",
+        status=204, user="customer", queries=5
+    ),
+    "eatplusapp.apis.update_delete_item_choice": budget(
+        "delete", "/api/v1/customer/choices/{choice_id}/", status=204,
+        user="customer", queries=11
+    ),
+    "eatplusapp.apis.customer_get_order_history": budget(
+        "get", "/api/v1/customer/orders/history/", user="customer",
+        queries=6
+    ),
+    "eatplusapp.apis.customer_add_order": budget(
+        "post", "/api/v1/customer/orders/", status=201, user="buyer",
+        data="order", queries=10
+    ),
+
+    # restaurant API
+    "eatplusapp.apis.get_restaurant_orders": budget(
+        "get", "/api/v1/restaurant/orders/", user="manager", queries=6
+    ),
+    "eatplusapp.apis.get_restaurant_order_changes": budget(
+        "get", "/api/v1/restaurant/orders/changes/", user="manager",
+        queries=6
+    ),
+    "eatplusapp.apis.get_restaurant_order_history": budget(
+        "get", "/api/v1/restaurant/orders/history/", user="manager",
+        queries=6
+    ),
+    "eatplusapp.apis.restaurant_order_poll": budget(
+        "get", "/api/v1/restaurant/orders/poll/?last_event_id=0",
+        user="manager", queries=4
+    ),
+    "eatplusapp.apis.restaurant_bulk_update_orders": budget(
+        "post", "/api/v1/restaurant/orders/status/", user="manager",
+        data="bulk_status", queries=10
+    ),
+    "eatplusapp.apis.restaurant_update_order": budget(
+        "put", "/api/v1/restaurant/orders/{placed_order_id}/", status=204,
+        user="manager", data={"status": Order.READY}, queries=10
+    ),
+}
+
+# URLs that can't be measured by a single request
+UNBUDGETED = {
+    # an endless event stream
+    "eatplusapp.apis.restaurant_order_stream",
+}
+
+
+def view_path(callback):
+    view = getattr(callback, "view_class", callback)
+    return "%s.%s" % (
+        getattr(view, "__module__", ""), getattr(view, "__name__", "")
+    )
+
+
+def iter_callbacks(patterns):
+    for pattern in patterns:
+        if hasattr(pattern, "url_patterns"):
+            for callback in iter_callbacks(pattern.url_patterns):
+                yield callback
+        else:
+            yield pattern.callback
+
+
+class EndpointBudgetTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.cash = PaymentMethod.objects.create(method="Cash")
+        address = Address.objects.create(
+            country="Canada", city="Toronto", postal_code="M5V 2T6"
+        )
+        for i in range(10):
+            Restaurant.objects.create(
+                name="Listed %s" % i, phone="0", address=address,
+                logo="images/restaurants/logo.png",
+                verified=True, available=True
+            )
+        cls.restaurant = Restaurant.objects.create(
+            name="Spice Bite", phone="123", address=address,
+            logo="images/restaurants/logo.png",
+            verified=True, available=True
+        )
+
+        cls.users = {
+            "staff": User.objects.create_user(
+                "staff", password="secret", is_staff=True
+            ),
+        }
+        for username in ("customer", "buyer", "manager"):
+            cls.users[username] = User.objects.create_user(
+                username, password="secret"
+            )
+            if username != "manager":
+                Customer.objects.create(
+                    user=cls.users[username], address=address,
+                    image="images/customers/a.png"
+                )
+        Manager.objects.create(
+            user=cls.users["manager"], restaurant=cls.restaurant
+        )
+        customer = cls.users["customer"].customer
+
+        items = []
+        for s in range(3):
+            section = MenuSection.objects.create(
+                restaurant=cls.restaurant, title="Section %s" % s,
+                order=s + 1
+            )
+            for i in range(8):
+                item = Item.objects.create(
+                    restaurant=cls.restaurant, menu_section=section,
+                    order=i + 1, name="Item %s-%s" % (s, i),
+                    short_description="", image="images/items/pizza.jpg",
+                    price=10, available=True, delivery=True
+                )
+                items.append(item)
+                # the last section has no options
+                if s == 2:
+                    continue
+                for j in range(2):
+                    option = Option.objects.create(
+                        item=item, name="Option %s" % j, type=j % 2
+                    )
+                    for k in range(3):
+                        Choice.objects.create(
+                            item=item, option=option,
+                            name="Choice %s" % k, extra_charge=1
+                        )
+
+        cls.item = items[0]
+        cls.plain_item = items[-1]
+        cls.choices = list(cls.item.item_choice.order_by("id"))
+
+        cart = Order.objects.create(
+            customer=customer, restaurant=cls.restaurant, status=Order.OPEN
+        )
+        for item in items[:6]:
+            order_item = OrderItem.objects.create(
+                order=cart, item=item, quantity=1
+            )
+            order_item.choices.add(
+                *item.item_choice.values_list("id", flat=True)[:2]
+            )
+        cls.cart = cart
+        cls.order_item = cart.order_orderitem.order_by("id").first()
+
+        cls.placed = [
+            Order.objects.create(
+                customer=customer, restaurant=cls.restaurant,
+                status=Order.RECEIVED, address="1 King St"
+            )
+            for _ in range(25)
+        ]
+
+    def setUp(self):
+        cache.clear()
+
+    def ids(self):
+        return {
+            "slug": self.restaurant.restaurant_slug,
+            "restaurant_id": self.restaurant.id,
+            "item_id": self.item.id,
+            "plain_item_id": self.plain_item.id,
+            "choice_id": self.choices[0].id,
+            "order_item_id": self.order_item.id,
+            "placed_order_id": self.placed[0].id,
+        }
+
+    def request_data(self, name):
+        if not isinstance(name, str):
+            return name
+        first, second = self.choices[0], self.choices[3]
+        return {
+            "option_form": {
+                first.option.name: [first.id], second.option.name: [second.id]
+            },
+            "cart_item": {
+                "order_id": self.cart.id, "item_id": self.item.id,
+                "quantity": 2, "choices": [first.id, second.id],
+            },
+            "cart_ops": {
+                "order_id": self.cart.id,
+                "ops": [
+                    {"op": "inc", "id": self.order_item.id, "by": 2},
+                    {"op": "dec", "id": self.order_item.id, "by": 1},
+                ],
+            },
+            "order": {
+                "order_items": [
+                    {"item_id": self.item.id, "quantity": 2,
+                     "choices": [first.id, second.id]},
+                    {"item_id": self.plain_item.id, "quantity": 1},
+                ],
+                "address": "1 King St",
+                "restaurant_id": self.restaurant.id,
+                "payment_method_id": 1,
+            },
+            "bulk_status": {
+                "order_ids": [order.id for order in self.placed[:10]],
+                "from": Order.RECEIVED, "to": Order.READY,
+            },
+        }.get(name, name)
+
+    def seed_session_cart(self, client):
+        session = client.session
+        session["cart:%s" % self.restaurant.id] = {
+            "lines": [
+                {"id": 1, "item_id": self.item.id, "quantity": 2,
+                 "choices": [self.choices[0].id, self.choices[3].id]},
+                {"id": 2, "item_id": self.plain_item.id, "quantity": 1,
+                 "choices": []},
+            ],
+            "next_id": 3,
+            "payment_method_id": self.cash.id,
+        }
+        session.save()
+
+    def client_for(self, path, username):
+        client = Client()
+        if username is None:
+            return client, {}
+        user = self.users[username]
+        if path.startswith("/api/"):
+            token = api_settings.JWT_ENCODE_HANDLER(
+                api_settings.JWT_PAYLOAD_HANDLER(user)
+            )
+            return client, {"HTTP_AUTHORIZATION": "JWT %s" % token}
+        client.force_login(user)
+        self.seed_session_cart(client)
+        return client, {}
+
+    def measure(self, spec):
+        path = spec["path"].format(**self.ids())
+        client, headers = self.client_for(path, spec["user"])
+        data = self.request_data(spec["data"])
+        if path.startswith("/api/") and data is not None:
+            data = json.dumps(data)
+            headers["content_type"] = "application/json"
+
+        args = (path, ) if data is None else (path, data)
+
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            response = getattr(client, spec["method"])(*args, **headers)
+            elapsed = (time.perf_counter() - started) * 1000
+        return path, response, queries.captured_queries, elapsed
+
+    def test_every_url_has_a_budget(self):
+        missing = set(
+            path for path in map(
+                view_path, iter_callbacks(get_resolver().url_patterns)
+            )
+            if path.startswith("eatplusapp.")
+        ) - set(ENDPOINT_BUDGETS) - UNBUDGETED
+        self.assertFalse(missing, "URLs without a budget: %s" % ", ".join(
+            sorted(missing)
+        ))
+
+    def test_endpoint_budgets(self):
+        get_backend().publish(
+            restaurant_channel(self.restaurant.id),
+            {"event": "created", "id": self.placed[0].id}
+        )
+
+        for view, spec in sorted(ENDPOINT_BUDGETS.items()):
+            # every endpoint starts cold and leaves no trace
+            cache.clear()
+            with self.subTest(view=view), transaction.atomic():
+                path, response, queries, elapsed = self.measure(spec)
+                transaction.set_rollback(True)
+
+                self.assertEqual(
+                    response.status_code, spec["status"],
+                    "%s %s" % (spec["method"].upper(), path)
+                )
+                self.assertLessEqual(
+                    len(queries), spec["queries"],
+                    "%s %s ran %s queries, budget %s:\n%s" % (
+                        spec["method"].upper(), path, len(queries),
+                        spec["queries"],
+                        "\n".join(query["sql"] for query in queries)
+                    )
+                )
+                if CHECK_LATENCY_BUDGETS:
+                    self.assertLessEqual(
+                        elapsed, spec["ms"],
+                        "%s %s took %.0fms, budget %sms" % (
+                            spec["method"].upper(), path, elapsed,
+                            spec["ms"]
+                        )
+                    )
@@ -1,5 +1,5 @@
 from django.contrib.auth import authenticate, login
-from django.http import HttpResponse
+from django.http import Http404, HttpResponse
 from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib.auth.decorators import login_required
 from django.urls import reverse
@@ -8,16 +8,19 @@ from django.views.generic import CreateView
 from eatplusapp.forms import (
     ItemForm,
     CustomerSignupForm)
+from eatplusapp.cart import CheckoutError, checkout_cart, get_cart
+from eatplusapp.delivery import restaurants_delivering_to_address
+from eatplusapp.listings import get_city_cards, listed_city_slugs
+from eatplusapp.menus import build_menu_page_context
+from eatplusapp.options import get_option_schema
+from eatplusapp.pricing import PricingError, quote_cart, to_cents
 
 from eatplusapp.models import (
+    Address,
     Customer,
     Restaurant,
     Item,
-    Option,
     Order,
-    OrderItem,
-    Choice,
-    PaymentMethod,
     Manager
 )
 from allauth.account.views import LoginView, SignupView
@@ -29,23 +32,30 @@ class MyLoginView(LoginView):
 
 # List of Restaurants
 def restaurants_list(request):
-    restaurants = Restaurant.objects.all()
-    context = {'restaurants': restaurants}
+    city_slug = request.GET.get('city')
+    if city_slug is None and request.user.is_authenticated:
+        city_slug = Address.objects.filter(
+            address_customer__user=request.user
+        ).values_list('city_slug', flat=True).first()
+    cards = get_city_cards([city_slug] if city_slug else listed_city_slugs())
+    restaurants = [card for slug in sorted(cards) for card in cards[slug]]
+    context = {'restaurants': restaurants, 'city_slug': city_slug}
     template = 'customer/restaurants_list.html'
     return render(request, template, context)
 
 
 def delivery(request, city_slug):
     customer = get_object_or_404(
-        Customer, user=request.user, address__city='city_slug')
+        Customer.objects.select_related('address'), user=request.user)
     restaurant = Restaurant.objects.filter(
-        city__city_slug=customer.city.city_slug,
-        boundaries__contains=customer.postal_code[:3],
+        id__in=restaurants_delivering_to_address(customer.address),
+        address__city_slug=city_slug,
         verified=True,
         available=True
     )
-    city_data = restaurant.address.city
-    item = Item.objects.filter(available=True, delivery=True)
+    city_data = customer.address.city
+    item = Item.objects.filter(
+        restaurant__in=restaurant, available=True, delivery=True)
     order_for = "delivery"
     template = 'city.html'
     context = {
@@ -56,215 +66,163 @@ def delivery(request, city_slug):
 
 
 # Menus
+def menu_redirect(restaurant, add_for):
+    if add_for == "delivery":
+        return redirect(
+            'delivery_menu', restaurant_slug=restaurant.restaurant_slug
+        )
+    return redirect('pickup_menu', restaurant_slug=restaurant.restaurant_slug)
+
+
 @login_required
 def pickup_menu(request, restaurant_slug):
     restaurant = get_object_or_404(Restaurant, restaurant_slug=restaurant_slug)
-    order, created = Order.objects.get_or_create(
-        restaurant=restaurant,
-        customer=get_object_or_404(Customer, user=request.user),
-        order_for=1,
-        status=1)
-
-    order.total = order.get_total_cost()
-    order.sub_total = order.get_sub_total()
-    order.save()
-    order_items_list = OrderItem.objects.filter(order_id=order.id)
-    order_items = {}
-    for i in order_items_list:
-        order_items[i] = [x.name for x in list(i.choices.all())]
-
-    items = Item.objects.filter(
-        restaurant__restaurant_slug=restaurant.restaurant_slug
-    )
-    payment_methods = PaymentMethod.objects.all()
-    add_for = "pickup"
-    template = "customer/menu_cart.html"
-    context = {
-        'restaurant': restaurant, 'items': items, 'order': order,
-        'order_items': order_items, 'add_for': add_for,
-        'payment_methods': payment_methods
-    }
+    cart = get_cart(request, restaurant.id)
+    context = build_menu_page_context(restaurant, cart)
 
+    template = "customer/menu_cart.html"
     return render(request, template, context)
 
 
 # @login_required
 def delivery_menu(request, restaurant_slug):
     restaurant = get_object_or_404(Restaurant, restaurant_slug=restaurant_slug)
-    if request.user == True:
-        order, created = Order.objects.get_or_create(
-            restaurant=restaurant,
-            customer=get_object_or_404(Customer, user=request.user),
-            order_for=2,
-            status=1)
-    else:
-        order, created = Order.objects.get_or_create(
-            restaurant=restaurant,
-            order_for=2,
-            status=1)
-    order.total = order.get_total_cost()
-    order.sub_total = order.get_sub_total()
-    order.save()
-    order_items_list = OrderItem.objects.filter(order_id=order.id)
-    order_items = {}
-    for i in order_items_list:
-        order_items[i] = [x.name for x in list(i.choices.all())]
-
-    items = Item.objects.filter(
-        restaurant__restaurant_slug=restaurant.restaurant_slug, delivery=True
-    )
-    payment_methods = PaymentMethod.objects.all()
-    add_for = "delivery"
-    template = "customer/menu_cart.html"
-    context = {
-        'restaurant': restaurant, 'items': items, 'order': order,
-        'order_items': order_items, 'add_for': add_for,
-        'payment_methods': payment_methods
-    }
+    cart = get_cart(request, restaurant.id)
+    context = build_menu_page_context(restaurant, cart, delivery=True)
 
+    template = "customer/menu_cart.html"
     return render(request, template, context)
 
 
 # display item's options. e.g : size: large, medium and small
-def item_option(request, item_id, order_id, restaurant_id):
-    option = Option.objects.filter(item_id=item_id)
-    order = get_object_or_404(Order, id=order_id)
-    add_for = order.order_for
-    restaurant = order.restaurant
-    item = Item.objects.filter(restaurant__id=restaurant_id)
-    order_item = OrderItem.objects.filter(order_id=order.id)
-    item = Item.objects.get(pk=item_id)
-    form = ItemForm(item=item)
-
-    if request.method == "POST":
-        order_item = OrderItem()
-        order_item.restaurant = item.restaurant
-        order_item.item = item
-
-        order_item.quantity = request.POST.get("quantity")
-        order_item.order_id = order.id
-        order_item.price = item.price
-        order_item.save()
-
-        for field_name in form.fields:
-            choices = request.POST.getlist(field_name)
-            for _choice in choices:
-                choice = Choice.objects.get(pk=_choice)
-                order_item.choices.add(choice)
-        order_item.save()
-
-        if order.order_for == 2:
-            return redirect(
-                'delivery_menu',
-                restaurant_slug=item.restaurant.restaurant_slug
-            )
-        if order.order_for == 1:
-            return redirect(
-                'pickup_menu', restaurant_slug=item.restaurant.restaurant_slug
-            )
+def item_option(request, restaurant_slug, item_id):
+    restaurant = get_object_or_404(Restaurant, restaurant_slug=restaurant_slug)
+    item = get_object_or_404(Item, pk=item_id, restaurant=restaurant)
+    add_for = request.GET.get("add_for", "pickup")
+    cart = get_cart(request, restaurant.id)
+    form = ItemForm(request.POST or None, item=item)
+    option = form.schema['options']
+
+    if request.method == "POST" and form.is_valid():
+        try:
+            quantity = max(int(request.POST.get("quantity", 1)), 1)
+        except ValueError:
+            quantity = 1
+        cart.add(item.id, quantity, form.selected_choices())
+        cart.save()
+        return menu_redirect(restaurant, add_for)
 
     template = 'menu.html'
     context = {
-        'item': item, 'order': order, 'order_item': order_item, 'options': option,
+        'item': item, 'cart': cart, 'options': option,
         'form': form, 'add_for': add_for, 'restaurant': restaurant
     }
 
     return render(request, template, context)
 
 
-def order_create(request, order_id):
+# checkout: the cart becomes an order
+@login_required
+def order_create(request, restaurant_slug):
+    restaurant = get_object_or_404(Restaurant, restaurant_slug=restaurant_slug)
+    cart = get_cart(request, restaurant.id)
+
     action = request.GET.get("action")
     if action == "payment":
         try:
-            order = Order.objects.get(pk=order_id)
-            order.payment_method_id = int(request.POST.get("payment_method"))
-            order.save()
-        except Order.DoesNotExist:
+            cart.payment_method_id = int(request.POST.get("payment_method"))
+            cart.save()
+        except (TypeError, ValueError):
             pass
         finally:
             return HttpResponse(content="")
 
-    order = get_object_or_404(Order, id=order_id)
-    if (
-        order.order_for == 2 and
-        order.sub_total > order.restaurant.minimum_delivery_order
-    ):
-        order.status = 3
-        order.sub_total += order.restaurant.delivery_fee
-        order.total = (
-            order.sub_total / 100 * order.restaurant.city.province.tax
-        )
-        order.save()
-    elif order.order_for == 1:
-        order.status = 3
-        order.save()
-    else:
-        return redirect(request.META['HTTP_REFERER'])
-    return redirect('order_list')
-
-
-def add_choice(request, choice_id, order_id, item_id, option_id):
-    order = get_object_or_404(Order, id=order_id)
-    order.status = 1
-    order.save()
-    item = get_object_or_404(Item, id=item_id)
-    choice = Choice.objects.get(id=choice_id)
-    option = get_object_or_404(Option, id=option_id)
-    item, created = OrderItem.objects.get_or_create(
-        order=order,
-        item=item,
-        option=option,
-        sub_total=item.price
+    if request.method != "POST" or not cart:
+        return redirect(request.META.get('HTTP_REFERER', '/'))
+
+    order_for = Order.DELIVERY if request.POST.get(
+        "order_for") == "delivery" else Order.PICKUP
+    customer = get_object_or_404(Customer, user=request.user)
+
+    try:
+        quote = quote_cart(restaurant.id, cart.lines)
+    except PricingError:
+        return redirect(request.META.get('HTTP_REFERER', '/'))
+
+    extra_cents = 0
+    if order_for == Order.DELIVERY:
+        if quote.sub_total_cents <= to_cents(
+                restaurant.minimum_delivery_order or 0):
+            return redirect(request.META.get('HTTP_REFERER', '/'))
+        extra_cents = to_cents(restaurant.delivery_fee or 0)
+
+    try:
+        checkout_cart(cart, customer, order_for, extra_cents, quote=quote)
+    except CheckoutError:
+        return redirect(request.META.get('HTTP_REFERER', '/'))
+    return menu_redirect(
+        restaurant, "delivery" if order_for == Order.DELIVERY else "pickup"
     )
 
-    if item.quantity == 0 and option.type == 0:
-        item.quantity += 1
-        item.choices.add(choice)
-    elif item.quantity == 0 and option.type == 1:
-        item.quantity += 1
-        item.choices.add(choice)
-    else:
-        item.choices.add(choice)
-
-    item.save()
-
-    return redirect(request.META.get['HTTP_REFERER'])
 
+def add_choice(request, restaurant_slug, line_id, choice_id):
+    restaurant = get_object_or_404(Restaurant, restaurant_slug=restaurant_slug)
+    cart = get_cart(request, restaurant.id)
+    line = cart.get_line(line_id)
+    if line is None:
+        raise Http404
+
+    schema = get_option_schema(line["item_id"])
+    option_id = schema['choice_options'].get(int(choice_id))
+    if option_id is None:
+        raise Http404
+
+    # a radio option keeps a single choice
+    option = [o for o in schema['options'] if o['id'] == option_id][0]
+    if option['widget'] == 'radio':
+        line["choices"] = [
+            c for c in line["choices"]
+            if schema['choice_options'].get(c) != option_id
+        ]
+    if int(choice_id) not in line["choices"]:
+        line["choices"] = sorted(line["choices"] + [int(choice_id)])
+    cart.save()
+
+    return redirect(request.META.get('HTTP_REFERER', '/'))
+
+
+def cart_add(request, restaurant_slug, item_id, action):
+    restaurant = get_object_or_404(Restaurant, restaurant_slug=restaurant_slug)
+    item = get_object_or_404(Item, id=item_id, restaurant=restaurant)
 
-def cart_add(request, order_id, item_id, action):
-    option = Option.objects.filter(item_id=item_id)
-    order = get_object_or_404(Order, id=order_id)
-    item = get_object_or_404(Item, id=item_id)
-
-    if option:
-        return redirect(
-            'item_option',
-            order_id=order.id,
-            item_id=item_id,
-            restaurant_id=item.restaurant.id
-        )
+    if get_option_schema(item.id)['options']:
+        url = reverse('item_option', kwargs={
+            'restaurant_slug': restaurant_slug, 'item_id': item.id
+        })
+        return redirect('%s?add_for=%s' % (
+            url, request.GET.get("add_for", "pickup")))
 
-    item, created = OrderItem.objects.get_or_create(
-        order=order,
-        restaurant=item.restaurant,
-        item=item,
-        sub_total=item.price
-    )
+    cart = get_cart(request, restaurant.id)
+    line = cart.add(item.id, 0)
     if action == "plus":
-        item.quantity += 1
+        cart.change_quantity(line["id"], 1)
     elif action == "mines":
-        item.quantity -= 1
-    elif action == "add" and item.quantity == 0:
-        item.quantity += 1
-    item.save()
+        cart.change_quantity(line["id"], -1)
+    elif action == "add" and line["quantity"] == 0:
+        cart.change_quantity(line["id"], 1)
+    else:
+        cart.change_quantity(line["id"], 0)
+    cart.save()
 
     return HttpResponse()
 
 
-def cart_remove(request, item_id):
-    item = get_object_or_404(OrderItem, id=item_id)
-    item.delete()
-    return redirect(request.META['HTTP_REFERER'])
+def cart_remove(request, restaurant_slug, line_id):
+    restaurant = get_object_or_404(Restaurant, restaurant_slug=restaurant_slug)
+    cart = get_cart(request, restaurant.id)
+    cart.remove(line_id)
+    cart.save()
+    return redirect(request.META.get('HTTP_REFERER', '/'))
 
 
 class CustomerSignUpView (SignupView):